@@ -0,0 +1,82 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""helpers for the benchmarks
+
+Each benchmark is a module in this package, run from the top of the 
+source tree with the server scripts in PATH, for example:
+
+    python -m bench.data_download
+
+To compare before and after a change, run the same benchmark against 
+both versions of the tree.
+"""
+
+import os
+import subprocess
+import socket
+import time
+
+class ServerError(Exception):
+    """server error"""
+
+def start_server(args, port, log_base):
+    """start_server(args, port, log_base) -> (po, fo_out, fo_err)
+
+    start a server by running args and wait for it to listen on port
+
+    stdout and stderr are written to tmp/<log_base>.stdout and .stderr
+    """
+
+    if not os.path.exists('tmp'):
+        os.mkdir('tmp')
+    fo_out = open('tmp/%s.stdout' % log_base, 'a')
+    fo_err = open('tmp/%s.stderr' % log_base, 'a')
+
+    po = subprocess.Popen(args, stdout=fo_out, stderr=fo_err)
+
+    for i in xrange(20):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.connect(('localhost', port))
+        except socket.error:
+            time.sleep(0.5)
+        else:
+            break
+        finally:
+            s.close()
+    else:
+        po.terminate()
+        fo_out.close()
+        fo_err.close()
+        raise ServerError()
+
+    return (po, fo_out, fo_err)
+
+def stop_server(po, fo_out, fo_err):
+    po.terminate()
+    po.wait()
+    fo_out.close()
+    fo_err.close()
+    return
+
+def peak_rss(pid):
+    """peak_rss(pid) -> peak resident set size in bytes
+
+    this reads VmHWM from /proc, so only works on Linux
+    """
+    for line in open('/proc/%d/status' % pid):
+        if line.startswith('VmHWM:'):
+            return int(line.split()[1]) * 1024
+    raise ValueError('no VmHWM for process %d' % pid)
+
+def percentile(values, p):
+    """percentile(values, p) -> the pth percentile of values"""
+    values = sorted(values)
+    index = int(round((len(values) - 1) * p / 100.0))
+    return values[index]
+
+def report(name, value, units):
+    print '%-40s %12.3f %s' % (name, value, units)
+    return
+
+# eof
@@ -0,0 +1,105 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""dpf_choose_media_type benchmark
+
+--n negotiations are done by:
+
+    running dpf_choose_media_type once for each
+    running dpf_choose_media_type --batch once for all of them
+    connecting to a dpf_choose_media_type --serve daemon once for each
+    sending all of them over one connection to the daemon
+
+and the time per negotiation is reported for each.  The daemon is only
+tried if the script supports --serve.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+import tempfile
+import shutil
+import socket
+import time
+from . import report
+
+accept = 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
+media_types = ['application/json', 'text/plain']
+
+def supports_serve():
+    po = subprocess.Popen(['dpf_choose_media_type', '--help'],
+                          stdout=subprocess.PIPE)
+    return '--serve' in po.communicate()[0]
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=100,
+                        help='number of negotiations (default 100)')
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, 'w')
+
+    t0 = time.time()
+    for i in xrange(args.n):
+        subprocess.call(['dpf_choose_media_type', accept] + media_types,
+                        stdout=devnull)
+    report('command line', (time.time() - t0) / args.n * 1000, 'ms')
+
+    if not supports_serve():
+        return 0
+
+    line = '\t'.join([accept] + media_types) + '\n'
+
+    t0 = time.time()
+    po = subprocess.Popen(['dpf_choose_media_type', '--batch'],
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE)
+    stdout = po.communicate(line * args.n)[0]
+    assert stdout.count('\n') == args.n
+    report('--batch', (time.time() - t0) / args.n * 1000, 'ms')
+
+    dir = tempfile.mkdtemp(prefix='bench-cmt-')
+    socket_fname = os.path.join(dir, 'socket')
+    po = subprocess.Popen(['dpf_choose_media_type', '--serve', socket_fname])
+    try:
+        while not os.path.exists(socket_fname):
+            time.sleep(0.1)
+
+        t0 = time.time()
+        for i in xrange(args.n):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(socket_fname)
+            s.sendall(line)
+            s.shutdown(socket.SHUT_WR)
+            while s.recv(1024):
+                pass
+            s.close()
+        report('--serve, connection per negotiation',
+               (time.time() - t0) / args.n * 1000,
+               'ms')
+
+        t0 = time.time()
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(socket_fname)
+        fo = s.makefile('r+')
+        for i in xrange(args.n):
+            fo.write(line)
+            fo.flush()
+            fo.readline()
+        fo.close()
+        s.close()
+        report('--serve, one connection',
+               (time.time() - t0) / args.n * 1000,
+               'ms')
+    finally:
+        po.terminate()
+        po.wait()
+        shutil.rmtree(dir)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
@@ -0,0 +1,132 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""concurrency benchmark for the data server
+
+For each number of workers in --workers, a data server is started and
+--clients clients run a mixed load for --duration seconds: each client
+repeatedly uploads a CSV dataset of --rows rows, downloads it once as
+uploaded and once converted to JSON, and deletes it.  The request rate,
+the median and 99th percentile request times, and the number of 
+failed requests (refused or reset connections) are reported.
+"""
+
+import sys
+import socket
+import argparse
+import threading
+import tempfile
+import shutil
+import httplib
+import time
+from . import start_server, stop_server, percentile, report
+
+port = 8090
+block_size = 1024*1024
+
+def timed_request(times, method, path, body=None, headers={}):
+    t0 = time.time()
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.request(method, path, body, headers)
+    r = hc.getresponse()
+    while r.read(block_size):
+        pass
+    hc.close()
+    times.append(time.time() - t0)
+    return r
+
+def client(data, t_end, times, errors):
+    while time.time() < t_end:
+        try:
+            cycle(data, times)
+        except socket.error:
+            errors.append(True)
+    return
+
+def cycle(data, times):
+    r = timed_request(times,
+                      'POST',
+                      '/',
+                      data,
+                      {'Content-Type': 'text/csv'})
+    assert r.status == 201
+    path = '/' + r.getheader('location').split('/')[-1]
+    r = timed_request(times, 'GET', path)
+    assert r.status == 200
+    r = timed_request(times,
+                      'GET',
+                      path,
+                      None,
+                      {'Accept': 'application/json'})
+    assert r.status == 200
+    r = timed_request(times, 'DELETE', path)
+    assert r.status == 204
+    return
+
+def run(workers, threads, clients, duration, data):
+
+    cache = tempfile.mkdtemp(prefix='bench-data-')
+    args = ['dpf_data_server',
+            '-C', cache,
+            '-p', str(port),
+            '-H', 'dpf.data.handlers.CSVHandler']
+    if workers > 1 or threads > 1:
+        args.extend(['--workers', str(workers), '--threads', str(threads)])
+    server = start_server(args, port, 'bench_concurrency')
+
+    try:
+        times = []
+        errors = []
+        t_end = time.time() + duration
+        client_threads = [ threading.Thread(target=client,
+                                            args=(data, t_end, times, errors))
+                           for i in xrange(clients) ]
+        t0 = time.time()
+        for t in client_threads:
+            t.start()
+        for t in client_threads:
+            t.join()
+        elapsed = time.time() - t0
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+
+    name = '%d workers x %d threads' % (workers, threads)
+    report('%s: requests' % name, len(times) / elapsed, 'requests/s')
+    report('%s: median request' % name,
+           percentile(times, 50) * 1000,
+           'ms')
+    report('%s: 99th percentile request' % name,
+           percentile(times, 99) * 1000,
+           'ms')
+    report('%s: failed requests' % name, len(errors), '')
+
+    return
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default='1,4,16',
+                        help='comma-separated numbers of workers ' +
+                             '(default 1,4,16)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='threads per worker (default 1)')
+    parser.add_argument('--clients', type=int, default=16,
+                        help='number of concurrent clients (default 16)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run each test (default 10)')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='rows in each uploaded dataset (default 10000)')
+    args = parser.parse_args()
+
+    data = ''.join( '%d,%f,row %d\n' % (i, i / 7.0, i)
+                    for i in xrange(args.rows) )
+
+    for workers in args.workers.split(','):
+        run(int(workers), args.threads, args.clients, args.duration, data)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
@@ -0,0 +1,86 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""CSV conversion benchmark for the data server
+
+A CSV file of --rows rows is uploaded and then requested as --type.  
+The time to the first byte of the response, the total time and the peak 
+RSS of the server are reported.
+"""
+
+import sys
+import argparse
+import tempfile
+import shutil
+import httplib
+import time
+from . import start_server, stop_server, peak_rss, report
+
+port = 8090
+block_size = 1024*1024
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=5000000, 
+                        help='number of rows (default 5000000)')
+    parser.add_argument('--type', default='application/json', 
+                        help='media type to request (default application/json)')
+    args = parser.parse_args()
+
+    cache = tempfile.mkdtemp(prefix='bench-data-')
+    server = start_server(['dpf_data_server', 
+                           '-C', cache, 
+                           '-p', str(port), 
+                           '-H', 'dpf.data.handlers.CSVHandler'], 
+                          port, 
+                          'bench_csv_convert')
+
+    try:
+
+        with tempfile.TemporaryFile() as fo:
+            for i in xrange(args.rows):
+                fo.write('%d,%d,row %d\n' % (i, i*i, i))
+            csv_size = fo.tell()
+            fo.seek(0)
+            hc = httplib.HTTPConnection('localhost', port)
+            hc.request('POST', '/', fo, {'Content-Type': 'text/csv'})
+            r = hc.getresponse()
+            assert r.status == 201
+            path = '/' + r.getheader('location').split('/')[-1]
+            hc.close()
+
+        rss_before = peak_rss(server[0].pid)
+
+        t0 = time.time()
+        hc = httplib.HTTPConnection('localhost', port)
+        hc.request('GET', path, '', {'Accept': args.type})
+        r = hc.getresponse()
+        assert r.status == 200
+        data = r.read(1)
+        t_first = time.time()
+        n = len(data)
+        while data:
+            data = r.read(block_size)
+            n += len(data)
+        t_last = time.time()
+        hc.close()
+
+        report('CSV size', csv_size / 1048576.0, 'MB')
+        report('response size', n / 1048576.0, 'MB')
+        report('peak server RSS after upload', rss_before / 1048576.0, 'MB')
+        report('peak server RSS after conversion', 
+               peak_rss(server[0].pid) / 1048576.0, 
+               'MB')
+        report('time to first byte', t_first - t0, 's')
+        report('total time', t_last - t0, 's')
+
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
@@ -0,0 +1,99 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""concurrent download benchmark for the data server
+
+A dataset of --size megabytes is uploaded, then downloaded --clients 
+times concurrently.  The peak RSS of the server and the aggregate 
+download rate are reported.
+"""
+
+import os
+import sys
+import argparse
+import threading
+import tempfile
+import shutil
+import httplib
+import time
+from . import start_server, stop_server, peak_rss, report
+
+port = 8090
+block_size = 1024*1024
+
+def download(path, results):
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.request('GET', path)
+    r = hc.getresponse()
+    n = 0
+    while True:
+        data = r.read(block_size)
+        if not data:
+            break
+        n += len(data)
+    hc.close()
+    results.append(n)
+    return
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1024, 
+                        help='dataset size in megabytes (default 1024)')
+    parser.add_argument('--clients', type=int, default=10, 
+                        help='number of concurrent downloads (default 10)')
+    args = parser.parse_args()
+
+    cache = tempfile.mkdtemp(prefix='bench-data-')
+    server = start_server(['dpf_data_server', '-C', cache, '-p', str(port)], 
+                          port, 
+                          'bench_data_download')
+
+    try:
+
+        with tempfile.TemporaryFile() as fo:
+            block = os.urandom(block_size)
+            for i in xrange(args.size):
+                fo.write(block)
+            fo.seek(0)
+            hc = httplib.HTTPConnection('localhost', port)
+            hc.request('POST', 
+                       '/', 
+                       fo, 
+                       {'Content-Type': 'application/octet-stream'})
+            r = hc.getresponse()
+            assert r.status == 201
+            path = '/' + r.getheader('location').split('/')[-1]
+            hc.close()
+
+        rss_before = peak_rss(server[0].pid)
+
+        results = []
+        threads = [ threading.Thread(target=download, args=(path, results)) 
+                    for i in xrange(args.clients) ]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+
+        assert len(results) == args.clients
+        assert all(n == args.size * block_size for n in results)
+
+        mb = sum(results) / 1024.0 / 1024.0
+        report('peak server RSS after upload', rss_before / 1048576.0, 'MB')
+        report('peak server RSS after downloads', 
+               peak_rss(server[0].pid) / 1048576.0, 
+               'MB')
+        report('aggregate download rate', mb / elapsed, 'MB/s')
+
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
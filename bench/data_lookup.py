@@ -0,0 +1,80 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""dataset lookup benchmark for the data server
+
+For each count, that many empty datasets are created in both the old flat 
+layout and the two-level fan-out, and the time to check whether a dataset 
+exists is reported for the old lookup (a search of os.listdir(base_dir)) 
+and for dpf.data.Application.data_dir().
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import shutil
+import random
+import time
+import dpf.data
+from . import report
+
+def make_idents(n):
+    idents = set()
+    while len(idents) < n:
+        idents.add('%08x' % random.getrandbits(32))
+    return list(idents)
+
+def time_lookups(lookup, idents, n_lookups):
+    sample = [ random.choice(idents) for i in xrange(n_lookups) ]
+    t0 = time.time()
+    for ident in sample:
+        assert lookup(ident)
+    return (time.time() - t0) / n_lookups
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('counts', 
+                        type=int, 
+                        nargs='*', 
+                        default=[10000, 100000, 1000000], 
+                        help='numbers of datasets (default 10000 100000 1000000)')
+    args = parser.parse_args()
+
+    for n in args.counts:
+
+        idents = make_idents(n)
+
+        flat_dir = tempfile.mkdtemp(prefix='bench-flat-')
+        fan_out_dir = tempfile.mkdtemp(prefix='bench-fan-out-')
+
+        try:
+
+            app = dpf.data.Application(fan_out_dir, [])
+            for ident in idents:
+                os.mkdir(os.path.join(flat_dir, ident))
+                os.makedirs(app.data_dir(ident))
+
+            def old_lookup(ident):
+                return ident in os.listdir(flat_dir)
+
+            def new_lookup(ident):
+                return os.path.isdir(app.data_dir(ident))
+
+            # the old lookup is slow, so needs fewer samples
+            t_old = time_lookups(old_lookup, idents, 20)
+            t_new = time_lookups(new_lookup, idents, 10000)
+
+            report('%d datasets: os.listdir() lookup' % n, t_old * 1e6, 'us')
+            report('%d datasets: fan-out lookup' % n, t_new * 1e6, 'us')
+
+        finally:
+            shutil.rmtree(flat_dir)
+            shutil.rmtree(fan_out_dir)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
@@ -0,0 +1,98 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""job database benchmark for the process server
+
+A process server with the echo handler is started and --clients
+clients repeatedly create a job and get its info for --duration
+seconds.  Each job creation writes to the job database and each info
+request reads from it.  The rate of job creations and gets and the
+median and 99th percentile request times are reported.
+
+--threads is passed to the server (if it is more than 1), so the
+clients' requests are handled concurrently.
+"""
+
+import sys
+import argparse
+import threading
+import tempfile
+import shutil
+import httplib
+import time
+from . import start_server, stop_server, percentile, report
+
+port = 8091
+
+def timed_request(times, method, path, body=None, headers={}):
+    t0 = time.time()
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.request(method, path, body, headers)
+    r = hc.getresponse()
+    r.read()
+    hc.close()
+    times.append(time.time() - t0)
+    return r
+
+def client(t_end, create_times, get_times):
+    while time.time() < t_end:
+        r = timed_request(create_times,
+                          'POST',
+                          '/echo',
+                          'data',
+                          {'Content-Type': 'text/plain'})
+        assert r.status == 201
+        path = '/job/' + r.getheader('location').split('/')[-1]
+        r = timed_request(get_times, 'GET', path)
+        assert r.status == 200
+    return
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of concurrent clients (default 8)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='server threads (default 8)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run (default 10)')
+    args = parser.parse_args()
+
+    cache = tempfile.mkdtemp(prefix='bench-process-')
+    server_args = ['dpf_process_server',
+                   '-C', cache,
+                   '-p', str(port),
+                   '-H', 'echo=dpf.process.handlers.tests.EchoHandler']
+    if args.threads > 1:
+        server_args.extend(['--threads', str(args.threads)])
+    server = start_server(server_args, port, 'bench_job_db')
+
+    try:
+        create_times = []
+        get_times = []
+        t_end = time.time() + args.duration
+        threads = [ threading.Thread(target=client,
+                                     args=(t_end, create_times, get_times))
+                    for i in xrange(args.clients) ]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+
+    for (name, times) in (('create', create_times), ('get', get_times)):
+        report('job %s rate' % name, len(times) / elapsed, 'requests/s')
+        report('job %s median' % name, percentile(times, 50) * 1000, 'ms')
+        report('job %s 99th percentile' % name,
+               percentile(times, 99) * 1000,
+               'ms')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
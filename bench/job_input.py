@@ -0,0 +1,91 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""concurrent job submission benchmark for the process server
+
+A process server with the echo handler is started and --clients
+clients each create a job with --size megabytes of input at the same
+time.  The peak RSS of the server and the aggregate upload rate are
+reported.
+
+--threads is passed to the server (if it is more than 1), so the
+uploads are handled concurrently.
+"""
+
+import os
+import sys
+import argparse
+import threading
+import tempfile
+import shutil
+import httplib
+import time
+from . import start_server, stop_server, peak_rss, report
+
+port = 8093
+block_size = 1024*1024
+
+def upload(size, results):
+    block = 'x' * block_size
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.putrequest('POST', '/echo')
+    hc.putheader('Content-Type', 'text/plain')
+    hc.putheader('Content-Length', str(size * block_size))
+    hc.endheaders()
+    for i in xrange(size):
+        hc.send(block)
+    r = hc.getresponse()
+    r.read()
+    hc.close()
+    results.append(r.status)
+    return
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1024,
+                        help='job input size in megabytes (default 1024)')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='number of concurrent uploads (default 4)')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='server threads (default 4)')
+    args = parser.parse_args()
+
+    cache = tempfile.mkdtemp(prefix='bench-process-')
+    server_args = ['dpf_process_server',
+                   '-C', cache,
+                   '-p', str(port),
+                   '-H', 'echo=dpf.process.handlers.tests.EchoHandler']
+    if args.threads > 1:
+        server_args.extend(['--threads', str(args.threads)])
+    server = start_server(server_args, port, 'bench_job_input')
+
+    try:
+        rss_before = peak_rss(server[0].pid)
+        results = []
+        threads = [ threading.Thread(target=upload,
+                                     args=(args.size, results))
+                    for i in xrange(args.clients) ]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+        assert results == [201] * args.clients
+        report('peak server RSS before uploads', rss_before / 1048576.0, 'MB')
+        report('peak server RSS after uploads',
+               peak_rss(server[0].pid) / 1048576.0,
+               'MB')
+        report('aggregate upload rate',
+               args.size * args.clients / elapsed,
+               'MB/s')
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
@@ -0,0 +1,111 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""job listing benchmark for the process server
+
+A job database with --rows jobs (spread over two processes and two
+statuses, one job in ten deleted) is created, a process server is
+started on it and each listing below is requested --n times.  The
+median and 99th percentile request times are reported.
+
+The deep page is the page after the middle of the table, as reached by
+following next links.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import shutil
+import httplib
+import urllib
+import json
+import time
+import dpf.process
+from . import start_server, stop_server, percentile, report
+
+port = 8094
+
+def make_db(cache, n_rows):
+    """create the job database with n_rows jobs and return the listing
+    cursor for the middle of the table
+    """
+    app = dpf.process.Application(cache, {})
+    db = app.db_pool.connection()
+    t0 = time.time() - n_rows
+    def rows():
+        for i in xrange(n_rows):
+            yield ('job%08d' % i,
+                   ('echo', 'wc')[i % 2],
+                   i % 10 == 0,
+                   t0 + i,
+                   ('completed', 'error')[i % 3 == 0],
+                   i)
+    with db:
+        db.executemany("""INSERT INTO job
+                          (id, process, deleted, created, status, size)
+                          VALUES (?, ?, ?, ?, ?, ?)""",
+                       rows())
+    return '%r,job%08d' % (t0 + n_rows / 2 + 1, n_rows / 2 + 1)
+
+def time_request(path, n):
+    times = []
+    for i in xrange(n):
+        t0 = time.time()
+        hc = httplib.HTTPConnection('localhost', port)
+        hc.request('GET', path, '', {'Accept': 'application/json'})
+        r = hc.getresponse()
+        data = r.read()
+        hc.close()
+        times.append(time.time() - t0)
+        assert r.status == 200
+        assert len(json.loads(data)['jobs']) == 100
+    return times
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='jobs in the database (default 1000000)')
+    parser.add_argument('--n', type=int, default=100,
+                        help='requests per listing (default 100)')
+    args = parser.parse_args()
+
+    cache = tempfile.mkdtemp(prefix='bench-process-')
+    middle = make_db(cache, args.rows)
+    now = time.time()
+    listings = [('first page', {}),
+                ('deep page', {'after': middle}),
+                ('process filter', {'process': 'wc'}),
+                ('status filter', {'status': 'error'}),
+                ('process and status filter',
+                 {'process': 'wc', 'status': 'error'}),
+                ('created range',
+                 {'created_after': now - args.rows / 2,
+                  'created_before': now - args.rows / 4}),
+                ('deleted', {'deleted': 1})]
+
+    server_args = ['dpf_process_server',
+                   '-C', cache,
+                   '-p', str(port),
+                   '-H', 'echo=dpf.process.handlers.tests.EchoHandler',
+                   '-H', 'wc=dpf.process.handlers.tests.WCHandler']
+    server = start_server(server_args, port, 'bench_job_list')
+
+    try:
+        for (name, params) in listings:
+            path = '/job/?' + urllib.urlencode(params)
+            times = time_request(path, args.n)
+            report('%s median' % name, percentile(times, 50) * 1000, 'ms')
+            report('%s 99th percentile' % name,
+                   percentile(times, 99) * 1000,
+                   'ms')
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
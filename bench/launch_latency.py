@@ -0,0 +1,121 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""job launch latency benchmark for the process server
+
+A process server with the SGE wc handler is started with a fake qsub
+that takes --qsub-delay seconds to submit a job, and --clients clients
+repeatedly create jobs for --duration seconds.  The median and 99th
+percentile job creation times are reported, first with launches done
+during the POST and then (if the server supports --async-launch) with
+launches done in the background.
+
+--threads is passed to the server (if it is more than 1).
+"""
+
+import os
+import sys
+import subprocess
+import argparse
+import threading
+import tempfile
+import shutil
+import httplib
+import time
+from . import start_server, stop_server, percentile, report
+
+port = 8092
+
+qsub_script = """#!/bin/sh
+sleep %g
+echo "Your job $$ (\\"bench\\") has been submitted"
+"""
+
+def supports_async_launch():
+    po = subprocess.Popen(['dpf_process_server', '--help'],
+                          stdout=subprocess.PIPE)
+    return '--async-launch' in po.communicate()[0]
+
+def client(t_end, times, statuses):
+    while time.time() < t_end:
+        t0 = time.time()
+        hc = httplib.HTTPConnection('localhost', port)
+        hc.request('POST',
+                   '/wc',
+                   'http://localhost/',
+                   {'Content-Type': 'text/plain'})
+        r = hc.getresponse()
+        r.read()
+        hc.close()
+        times.append(time.time() - t0)
+        statuses.append(r.status)
+    return
+
+def run(args, extra_server_args):
+    """run the clients against a server, returning the request times"""
+    cache = tempfile.mkdtemp(prefix='bench-process-')
+    server_args = ['dpf_process_server',
+                   '-C', cache,
+                   '-p', str(port),
+                   '-H', 'wc=dpf.process.handlers.tests.WCHandler']
+    if args.threads > 1:
+        server_args.extend(['--threads', str(args.threads)])
+    server = start_server(server_args + extra_server_args,
+                          port,
+                          'bench_launch_latency')
+    try:
+        times = []
+        statuses = []
+        t_end = time.time() + args.duration
+        threads = [ threading.Thread(target=client,
+                                     args=(t_end, times, statuses))
+                    for i in xrange(args.clients) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        stop_server(*server)
+        shutil.rmtree(cache)
+    assert set(statuses) <= set([201, 202])
+    return times
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of concurrent clients (default 8)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='server threads (default 8)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run (default 10)')
+    parser.add_argument('--qsub-delay', type=float, default=0.5,
+                        help='seconds qsub takes (default 0.5)')
+    args = parser.parse_args()
+
+    bin_dir = tempfile.mkdtemp(prefix='bench-bin-')
+    qsub = os.path.join(bin_dir, 'qsub')
+    open(qsub, 'w').write(qsub_script % args.qsub_delay)
+    os.chmod(qsub, 0755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+    try:
+        modes = [('synchronous', [])]
+        if supports_async_launch():
+            modes.append(('asynchronous', ['--async-launch']))
+        for (name, extra_server_args) in modes:
+            times = run(args, extra_server_args)
+            report('%s launch median' % name,
+                   percentile(times, 50) * 1000,
+                   'ms')
+            report('%s launch 99th percentile' % name,
+                   percentile(times, 99) * 1000,
+                   'ms')
+    finally:
+        shutil.rmtree(bin_dir)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
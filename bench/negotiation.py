@@ -0,0 +1,81 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""dpf.choose_media_type() microbenchmark
+
+Each Accept header below is negotiated against the resource types of a
+data server dataset and of a process server info request, --n times
+each.  The time per call is reported for each header, first with a new
+header each time (as a cache would see unique headers) and then with
+the same header repeatedly.  If dpf has MediaTypes, calls with
+precompiled resource types are timed too.
+
+Headers that dpf can't parse (the Chrome header, whose parameters
+choose_media_type() doesn't accept) are timed all the same: the error is
+part of the cost.
+"""
+
+import sys
+import argparse
+import time
+import dpf
+from . import report
+
+accept_headers = [
+    ('firefox',
+     'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'),
+    ('chrome',
+     'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,' +
+     'image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7'),
+    ('curl', '*/*'),
+    ('json tool', 'application/json'),
+    ('text tool', 'text/plain'),
+    ('weighted tool', 'application/json, text/plain;q=0.5, */*;q=0.1'),
+]
+
+resource_types = [
+    ('data', ['text/csv', 'application/json', 'application/x-ndjson']),
+    ('info', ['text/plain', 'application/json']),
+]
+
+def negotiate(accept, types):
+    try:
+        return dpf.choose_media_type(accept, types)
+    except (dpf.HTTP400BadRequest, dpf.HTTP406NotAcceptable):
+        return None
+
+def time_calls(n, accepts, types):
+    t0 = time.time()
+    for accept in accepts:
+        negotiate(accept, types)
+    return (time.time() - t0) / n * 1e6
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=100000,
+                        help='calls per test (default 100000)')
+    args = parser.parse_args()
+
+    for (types_name, types) in resource_types:
+        for (accept_name, accept) in accept_headers:
+            name = '%s, %s' % (accept_name, types_name)
+            # unique headers, differing only in trailing whitespace
+            accepts = [ accept + ' ' * (i % 1000) for i in xrange(args.n) ]
+            report('%s, unique' % name,
+                   time_calls(args.n, accepts, types),
+                   'us')
+            accepts = [accept] * args.n
+            report('%s, repeated' % name,
+                   time_calls(args.n, accepts, types),
+                   'us')
+            if hasattr(dpf, 'MediaTypes'):
+                report('%s, repeated, precompiled' % name,
+                       time_calls(args.n, accepts, dpf.MediaTypes(types)),
+                       'us')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# eof
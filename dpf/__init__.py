@@ -1,9 +1,34 @@
 # See file COPYING distributed with dpf for copyright and license.
 
+import os
+import re
+import email.utils
+
+# block size for reading and writing files and request/response bodies
+read_size = 1024*1024
+
+entity_tag_re = re.compile('(?:W/)?"[^"]*"')
+
+# Range headers with more ranges than this are ignored
+max_ranges = 20
+
 class Application:
 
     """base class for DPF WSGI applications"""
 
+    def start(self):
+        """called in each server process before it handles any requests
+
+        (in a pre-forked server, this is after the fork)
+        """
+        return
+
+    def stop(self):
+        """called in a pre-forked server's worker processes after they 
+        stop handling requests, before they exit
+        """
+        return
+
 class BaseHTTPError(Exception):
 
     """base class for HTTP exceptions"""
@@ -48,10 +73,27 @@ class HTTP411LengthRequired(BaseHTTPError):
 
     status = '411 Length Required'
 
+class HTTP413RequestEntityTooLarge(BaseHTTPError):
+
+    status = '413 Request Entity Too Large'
+
 class HTTP415UnsupportedMediaType(BaseHTTPError):
 
     status = '415 Unsupported Media Type'
 
+class HTTP416RequestedRangeNotSatisfiable(BaseHTTPError):
+
+    status = '416 Requested Range Not Satisfiable'
+
+    def __init__(self, size, content_type=None, content=None):
+        BaseHTTPError.__init__(self, content_type, content)
+        self.headers.append(('Content-Range', 'bytes */%d' % size))
+        return
+
+class HTTP503ServiceUnavailable(BaseHTTPError):
+
+    status = '503 Service Unavailable'
+
 def get_accept(environ):
 
     """get_accept(environ) -> accept header
@@ -65,24 +107,364 @@ def get_accept(environ):
         return environ['HTTP_ACCEPT']
     return '*/*'
 
-def choose_media_type(accept, resource_types):
+def input_chunks(environ, content_length):
 
-    """choose_media_type(accept, resource_types) -> resource type
+    """input_chunks(environ, content_length) -> iterator
 
-    select a media type for the response
+    Generate the content_length bytes of a request body, at most read_size bytes at a time.
 
-    accept is the Accept header from the request.  If there is no Accept header, '*/*' is assumed.  If the Accept header cannot be parsed, HTTP400BadRequest is raised.
+    HTTP400BadRequest is raised if the body ends early.
+    """
 
-    resource_types is an ordered list of available resource types, with the most desirable type first.
+    bytes_remaining = content_length
+    while bytes_remaining:
+        if bytes_remaining > read_size:
+            data = environ['wsgi.input'].read(read_size)
+        else:
+            data = environ['wsgi.input'].read(bytes_remaining)
+        if not data:
+            raise HTTP400BadRequest('text/plain', 'Incomplete request body.\n')
+        bytes_remaining -= len(data)
+        yield data
+    return
 
-    To find a match, the types in the Accept header are ordered by q value (descending), and each is compared with the available resource types in order.  The first matching media type is returned.
+def not_modified(environ, etag, mtime):
 
-    If not match is found, HTTP406NotAcceptable is raised.
+    """not_modified(environ, etag, mtime) -> boolean
+
+    Check the conditional headers of a GET or HEAD request.
+
+    etag is the entity tag of the selected representation, or None if it has none, and mtime is its modification time in seconds since the epoch.
+
+    True is returned (and a 304 Not Modified response should be sent) if the If-None-Match header matches etag (using the weak comparison) or, if there is no If-None-Match header, if the If-Modified-Since header is no earlier than mtime.
     """
 
-    # This function is exposed in the script dpf_choose_media_type, 
-    # so if changes are made here, that script's documentation 
-    # should be updated to reflect them.
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return False
+
+    if 'HTTP_IF_NONE_MATCH' in environ:
+        value = environ['HTTP_IF_NONE_MATCH'].strip()
+        if value == '*':
+            return True
+        if etag is None:
+            return False
+        opaque_tag = etag[2:] if etag.startswith('W/') else etag
+        for tag in entity_tag_re.findall(value):
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == opaque_tag:
+                return True
+        return False
+
+    if 'HTTP_IF_MODIFIED_SINCE' in environ:
+        t = email.utils.parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE'])
+        if t is None:
+            return False
+        return mtime <= email.utils.mktime_tz(t)
+
+    return False
+
+def file_iterator(environ, fo, start=0, length=None):
+
+    """file_iterator(environ, fo[, start, length]) -> iterable
+
+    Return an iterable over the contents of the open file fo, suitable for use as a WSGI response.
+
+    If the whole file is wanted (start is 0 and length is None) and the server provides wsgi.file_wrapper, the wrapper is used so the server can use sendfile() or similar.  Otherwise, length bytes (or the rest of the file if length is None) starting at start are read read_size bytes at a time, so memory use does not depend on the size of the file.
+
+    fo is closed when the response is finished.
+    """
+
+    if start == 0 and length is None and 'wsgi.file_wrapper' in environ:
+        return environ['wsgi.file_wrapper'](fo, read_size)
+
+    return _read_file(fo, start, length)
+
+def _read_file(fo, start, length):
+    """generator for file_iterator()"""
+    try:
+        for data in _read_range(fo, start, length):
+            yield data
+    finally:
+        fo.close()
+    return
+
+def _read_range(fo, start, length):
+    """generate the contents of fo from start, read_size bytes at a time
+
+    if length is None, the rest of the file is read
+    """
+    fo.seek(start)
+    while length is None or length > 0:
+        if length is None or length > read_size:
+            data = fo.read(read_size)
+        else:
+            data = fo.read(length)
+        if not data:
+            break
+        if length is not None:
+            length -= len(data)
+        yield data
+    return
+
+def parse_range(range_header, size):
+
+    """parse_range(range_header, size) -> list of (start, end)
+
+    Parse a Range header for an entity of size bytes.
+
+    The satisfiable byte ranges are returned as a list of (start, end), with end inclusive, in order and with overlapping and adjacent ranges merged.  If the header can't be parsed, is not for byte ranges, or asks for more than max_ranges ranges, None is returned, and the header should be ignored.  If none of the ranges are satisfiable, HTTP416RequestedRangeNotSatisfiable is raised.
+    """
+
+    if not range_header.startswith('bytes='):
+        return None
+
+    specs = [ spec.strip() for spec in range_header[6:].split(',') ]
+    specs = [ spec for spec in specs if spec ]
+    if len(specs) > max_ranges:
+        return None
+
+    ranges = []
+
+    for spec in specs:
+        if '-' not in spec:
+            return None
+        (first, last) = [ el.strip() for el in spec.split('-', 1) ]
+        if first and not first.isdigit():
+            return None
+        if last and not last.isdigit():
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            if not last:
+                return None
+            n = int(last)
+            # nothing to give for an empty entity
+            if n == 0 or size == 0:
+                continue
+            ranges.append((max(size - n, 0), size - 1))
+        else:
+            start = int(first)
+            if last:
+                end = int(last)
+                if end < start:
+                    return None
+            else:
+                end = size - 1
+            if start >= size:
+                continue
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise HTTP416RequestedRangeNotSatisfiable(size)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for (start, end) in ranges[1:]:
+        (last_start, last_end) = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(end, last_end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+def _if_range_matches(environ, headers):
+    """check an If-Range header against the ETag or Last-Modified header 
+    in headers
+
+    returns True if there is no If-Range header
+    """
+    if 'HTTP_IF_RANGE' not in environ:
+        return True
+    value = environ['HTTP_IF_RANGE'].strip()
+    header_dict = dict( (name.lower(), val) for (name, val) in headers )
+    # If-Range requires a strong comparison, so weak tags never match
+    if value.startswith('W/'):
+        return False
+    if value.startswith('"'):
+        return value == header_dict.get('etag')
+    return value == header_dict.get('last-modified')
+
+def file_response(environ, fname, content_type, headers=[]):
+
+    """file_response(environ, fname, content_type[, headers]) -> (status, headers, output iterator)
+
+    Respond to a GET or HEAD request for the contents of the file fname.
+
+    headers is a list of additional headers for the response (such as ETag and Last-Modified).  Content-Type, Content-Length and Accept-Ranges are added, as is Content-Range for partial responses.
+
+    A Range header in a GET request gives a 206 Partial Content response (with a multipart/byteranges body if more than one range is requested), unless an If-Range header doesn't match the ETag or Last-Modified header given in headers.  The requested ranges are read directly from the file.  If none of the ranges are satisfiable, HTTP416RequestedRangeNotSatisfiable is raised.
+    """
+
+    fo = open(fname, 'rb')
+    try:
+        size = os.fstat(fo.fileno()).st_size
+        headers = list(headers)
+        headers.append(('Accept-Ranges', 'bytes'))
+        ranges = None
+        if environ['REQUEST_METHOD'] == 'GET' and \
+           'HTTP_RANGE' in environ and \
+           _if_range_matches(environ, headers):
+            ranges = parse_range(environ['HTTP_RANGE'], size)
+    except:
+        fo.close()
+        raise
+
+    if ranges is None:
+        headers.append(('Content-Type', content_type))
+        headers.append(('Content-Length', str(size)))
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            fo.close()
+            return ('200 OK', headers, [''])
+        return ('200 OK', headers, file_iterator(environ, fo))
+
+    if len(ranges) == 1:
+        (start, end) = ranges[0]
+        headers.append(('Content-Type', content_type))
+        headers.append(('Content-Length', str(end - start + 1)))
+        headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, size)))
+        return ('206 Partial Content', 
+                headers, 
+                file_iterator(environ, fo, start, end - start + 1))
+
+    boundary = os.urandom(16).encode('hex')
+    parts = []
+    content_length = 0
+    for (start, end) in ranges:
+        part_header = '\r\n--%s\r\n' % boundary + \
+                      'Content-Type: %s\r\n' % content_type + \
+                      'Content-Range: bytes %d-%d/%d\r\n\r\n' % (start, 
+                                                                  end, 
+                                                                  size)
+        parts.append((part_header, start, end - start + 1))
+        content_length += len(part_header) + end - start + 1
+    trailer = '\r\n--%s--\r\n' % boundary
+    content_length += len(trailer)
+
+    mt = 'multipart/byteranges; boundary=%s' % boundary
+    headers.append(('Content-Type', mt))
+    headers.append(('Content-Length', str(content_length)))
+    return ('206 Partial Content', 
+            headers, 
+            _read_parts(fo, parts, trailer))
+
+def _read_parts(fo, parts, trailer):
+    """generate a multipart/byteranges body for file_response()"""
+    try:
+        for (part_header, start, length) in parts:
+            yield part_header
+            for data in _read_range(fo, start, length):
+                yield data
+        yield trailer
+    finally:
+        fo.close()
+    return
+
+# a value no cache holds
+_missing = object()
+
+class LRUCache:
+
+    """dictionary holding (approximately) the size most recently used items
+
+    Items are kept in two generations.  New items go in the current 
+    generation; when it is full, it becomes the old generation and the 
+    previous old generation is dropped.  An item found in the old 
+    generation is moved to the current one.  Lookups of items in the 
+    current generation are a single dictionary lookup, and so are safe 
+    across threads without a lock.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.current = {}
+        self.old = {}
+        return
+
+    def get(self, key, default=None):
+        value = self.current.get(key, _missing)
+        if value is not _missing:
+            return value
+        value = self.old.get(key, _missing)
+        if value is _missing:
+            return default
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        current = self.current
+        if len(current) >= self.size:
+            self.old = current
+            current = self.current = {}
+        current[key] = value
+        return
+
+    def clear(self):
+        self.current = {}
+        self.old = {}
+        return
+
+class MediaTypes:
+
+    """an ordered list of available media types, precompiled for 
+    choose_media_type()
+
+    Each media range that can match (type/subtype, type/*, */subtype and 
+    */*) is mapped to the first matching type, so matching a range is a 
+    single lookup.  Handlers should build these once rather than passing 
+    lists to choose_media_type().
+
+    ValueError is raised if a type is not of the form type/subtype.
+    """
+
+    def __init__(self, types):
+        self.types = tuple(types)
+        self.table = {}
+        for mt in reversed(self.types):
+            if '/' not in mt:
+                raise ValueError('bad media type %s' % mt)
+            (type, subtype) = mt.split('/', 1)
+            for key in ((type, subtype), 
+                        (type, '*'), 
+                        ('*', subtype), 
+                        ('*', '*')):
+                self.table[key] = mt
+        return
+
+    def __iter__(self):
+        return iter(self.types)
+
+# parsed Accept headers, keyed by header; a header that can't be parsed 
+# maps to None
+accept_cache = LRUCache(128)
+
+# MediaTypes for lists passed to choose_media_type(), keyed by tuple
+media_types_cache = LRUCache(128)
+
+def parse_accept(accept):
+
+    """parse_accept(accept) -> tuple of (type, subtype, q)
+
+    Parse an Accept header, returning the media ranges in the order they 
+    should be tried (see choose_media_type()).  If the header cannot be 
+    parsed, HTTP400BadRequest is raised.
+
+    Parsed headers are cached.
+    """
+
+    accept_types = accept_cache.get(accept, False)
+    if accept_types is False:
+        accept_types = _parse_accept(accept)
+        accept_cache.put(accept, accept_types)
+    if accept_types is None:
+        raise HTTP400BadRequest('text/plain', 'Bad Accept header.\n')
+    return accept_types
+
+def _parse_accept(accept):
+    """parse an Accept header for parse_accept(), returning None if it 
+    can't be parsed
+    """
 
     # list of (type, subtype, q)
     accept_types = []
@@ -97,27 +479,53 @@ def choose_media_type(accept, resource_types):
             mt = mt.strip()
             q = q.strip()
             if not q.startswith('q='):
-                raise HTTP400BadRequest('text/plain', 'Bad Accept header.\n')
+                return None
             try:
                 q = float(q[2:])
             except ValueError:
-                raise HTTP400BadRequest('text/plain', 'Bad Accept header.\n')
+                return None
         if '/' not in mt:
-            raise HTTP400BadRequest('text/plain', 'Bad Accept header.\n')
+            return None
         (type, subtype) = mt.split('/', 1)
         accept_types.append((type, subtype, q))
 
     accept_types.sort(cmp_accept_type)
     accept_types.reverse()
 
-    for (type, subtype, q) in accept_types:
-        for available_type in resource_types:
-            (a_type, a_subtype) = available_type.split('/', 1)
-            if type != '*' and type != a_type:
-                continue
-            if subtype != '*' and subtype != a_subtype:
-                continue
-            return available_type
+    return tuple(accept_types)
+
+def choose_media_type(accept, resource_types):
+
+    """choose_media_type(accept, resource_types) -> resource type
+
+    select a media type for the response
+
+    accept is the Accept header from the request.  If there is no Accept header, '*/*' is assumed.  If the Accept header cannot be parsed, HTTP400BadRequest is raised.
+
+    resource_types is an ordered list of available resource types, with the most desirable type first, or a MediaTypes instance.
+
+    To find a match, the types in the Accept header are ordered by q value (descending), and each is compared with the available resource types in order.  The first matching media type is returned.
+
+    If not match is found, HTTP406NotAcceptable is raised.
+    """
+
+    # This function is exposed in the script dpf_choose_media_type, 
+    # so if changes are made here, that script's documentation 
+    # should be updated to reflect them.
+
+    if not isinstance(resource_types, MediaTypes):
+        key = tuple(resource_types)
+        mts = media_types_cache.get(key)
+        if mts is None:
+            mts = MediaTypes(key)
+            media_types_cache.put(key, mts)
+        resource_types = mts
+
+    table = resource_types.table
+    for (type, subtype, q) in parse_accept(accept):
+        mt = table.get((type, subtype))
+        if mt is not None:
+            return mt
 
     raise HTTP406NotAcceptable()
 
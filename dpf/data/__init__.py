@@ -1,46 +1,107 @@
 # See file COPYING distributed with dpf for copyright and license.
 
 import os
+import errno
+import re
 import traceback
 import shutil
 import random
 import time
 import json
+import hashlib
+import sqlite3
 import wsgiref.util
 import dpf
+import dpf.metrics
+from .cache import ConversionCache, Lock
 
-read_size = 1024*1024
+ident_re = re.compile('^[0-9a-f]{8}$')
+sha256_re = re.compile('^[0-9a-f]{64}$')
+
+text_or_json = dpf.MediaTypes(['text/plain', 'application/json'])
 
 class Application(dpf.Application):
 
-    def __init__(self, base_dir, data_handlers):
+    def __init__(self, 
+                 base_dir, 
+                 data_handlers, 
+                 cache_size=None, 
+                 metrics=False):
+        """create the application
+
+        base_dir is the directory in which data is stored.
+
+        data_handlers is a list of DataHandler instances.
+
+        Data is stored once for each distinct content (see blob_fname()), 
+        however many times it is uploaded.  Converted representations are 
+        stored with the data the first time they are requested, and are 
+        shared by all uploads of the same data.  cache_size limits the 
+        total size of these stored conversions in bytes, the least 
+        recently used being removed to make room; if it is None, the 
+        total size is not limited.
+
+        If metrics is true, requests are timed by phase (read, write, 
+        hash, validate, store, metadata, negotiate and convert) and 
+        counted, the metrics are served at /admin/metrics in the 
+        Prometheus text format, and each response carries a 
+        Server-Timing header.
+        """
         self.base_dir = base_dir
         self.data_handlers = {}
+        # source content type -> the types it is available as
+        self.available_types = {}
         for dh in data_handlers:
             self.data_handlers[dh.from_type] = dh
+            types = [dh.from_type] + list(dh.to_types)
+            self.available_types[dh.from_type] = dpf.MediaTypes(types)
+        self.blob_dir = os.path.join(self.base_dir, 'blobs')
+        if not os.path.isdir(self.blob_dir):
+            try:
+                os.mkdir(self.blob_dir)
+            except OSError, data:
+                if data.errno != errno.EEXIST:
+                    raise
+        self.cache = ConversionCache(self.base_dir, cache_size)
+        if metrics:
+            self.metrics = dpf.metrics.Metrics('dpf_data')
+            self.metrics.describe('errors_total', 
+                                  'counter', 
+                                  'Requests answered with an error status.')
+            self.metrics.describe('bytes_in_total', 
+                                  'counter', 
+                                  'Bytes of data uploaded.')
+            self.metrics.describe('bytes_out_total', 
+                                  'counter', 
+                                  'Bytes of response bodies sent.')
+            self.metrics.describe('conversion_cache_hits_total', 
+                                  'counter', 
+                                  'Conversions served from the blob store.')
+            self.metrics.describe('conversion_cache_misses_total', 
+                                  'counter', 
+                                  'Conversions run.')
+        else:
+            self.metrics = dpf.metrics.NullMetrics()
         return
 
     def __call__(self, environ, start_response):
+        self.metrics.begin_request()
         try:
             path = environ['PATH_INFO']
             if not path:
                 path = '/'
             if path == '/':
                 (status, headers, oi) = self.handle_root(environ)
+            elif path.startswith('/admin/'):
+                name = path[7:].strip('/')
+                (status, headers, oi) = self.handle_admin(environ, name)
             else:
                 ident = path.strip('/')
                 (status, headers, oi) = self.handle_data(environ, ident)
-            start_response(status, headers)
-            return oi
         except dpf.BaseHTTPError, exc:
             status = exc.status
-            if exc.content_type:
-                output = exc.content
-                headers = [('Content-type', exc.content_type),
-                        ('Content-Length', str(len(output)))]
-            else:
-                output = ''
-                headers = [('Content-Length', '0')]
+            headers = exc.headers
+            oi = [exc.content]
         except:
             traceback.print_exc()
             status = '500 Internal Server Error'
@@ -48,8 +109,42 @@ class Application(dpf.Application):
                      'Please contact the administrator.\n'
             headers = [('Content-Type', 'text/plain'),
                        ('Content-Length', str(len(output)))]
+            oi = [output]
+        if self.metrics.enabled:
+            (headers, oi) = self._end_metrics(environ, status, headers, oi)
         start_response(status, headers)
-        return [output]
+        return oi
+
+    def _end_metrics(self, environ, status, headers, oi):
+        """finish the metrics for a request
+
+        returns the response headers, with Server-Timing added, and the 
+        output iterator, which counts the bytes sent if the response 
+        has no Content-Length
+        """
+        code = int(status.split()[0])
+        timings = self.metrics.end_request(environ['REQUEST_METHOD'], code)
+        if code >= 400:
+            self.metrics.count('errors_total', status=str(code))
+        headers = list(headers)
+        headers.append(('Server-Timing', dpf.metrics.server_timing(timings)))
+        if environ['REQUEST_METHOD'] == 'HEAD' or code == 304:
+            return (headers, oi)
+        for (name, value) in headers:
+            if name.lower() == 'content-length':
+                self.metrics.count('bytes_out_total', int(value))
+                return (headers, oi)
+        return (headers, self._count_output(oi))
+
+    def _count_output(self, oi):
+        try:
+            for data in oi:
+                self.metrics.count('bytes_out_total', len(data))
+                yield data
+        finally:
+            if hasattr(oi, 'close'):
+                oi.close()
+        return
 
     def handle_root(self, environ):
 
@@ -73,39 +168,73 @@ class Application(dpf.Application):
 
             while True:
                 ident = '%08x' % random.getrandbits(32)
-                dir = os.path.join(self.base_dir, ident)
-                if not os.path.exists(dir):
+                dir = self.data_dir(ident)
+                try:
+                    os.makedirs(dir)
+                except OSError, data:
+                    if data.errno != errno.EEXIST:
+                        raise
+                else:
                     break
-            os.mkdir(dir)
 
             fname = 'data'
             full_fname = os.path.join(dir, fname)
-            fo = open(full_fname, 'w')
-            bytes_remaining = content_length
-            while bytes_remaining:
-                if bytes_remaining > read_size:
-                    n_to_read = read_size
-                else:
-                    n_to_read = bytes_remaining
-                data = environ['wsgi.input'].read(n_to_read)
-                fo.write(data)
-                bytes_remaining -= n_to_read
-            fo.close()
-
-            if environ['CONTENT_TYPE'] in self.data_handlers:
-                data_handler = self.data_handlers[environ['CONTENT_TYPE']]
-                if not data_handler.validate(full_fname):
-                    shutil.rmtree(dir)
-                    msg = 'Data did not validate against content-type.\n'
-                    raise dpf.HTTP400BadRequest('text/plain', msg)
+
+            data_handler = self.data_handlers.get(environ['CONTENT_TYPE'])
+            validator = None
+            if data_handler:
+                validator = data_handler.validator()
+
+            # the data is read once: each chunk is written, hashed (for 
+            # entity tags) and validated as it arrives
+            h = hashlib.sha256()
+            size = 0
+            try:
+                fo = open(full_fname, 'wb')
+                try:
+                    chunks = dpf.input_chunks(environ, content_length)
+                    while True:
+                        with self.metrics.phase('read'):
+                            data = next(chunks, None)
+                        if data is None:
+                            break
+                        with self.metrics.phase('write'):
+                            fo.write(data)
+                        with self.metrics.phase('hash'):
+                            h.update(data)
+                        size += len(data)
+                        if validator is not None:
+                            with self.metrics.phase('validate'):
+                                validator.update(data)
+                finally:
+                    self.metrics.count('bytes_in_total', size)
+                    with self.metrics.phase('write'):
+                        fo.close()
+                    if validator is not None:
+                        with self.metrics.phase('validate'):
+                            valid = validator.finish()
+                if data_handler and validator is None:
+                    with self.metrics.phase('validate'):
+                        valid = data_handler.validate(full_fname)
+            except:
+                shutil.rmtree(dir)
+                raise
+
+            if data_handler and not valid:
+                shutil.rmtree(dir)
+                msg = 'Data did not validate against content-type.\n'
+                raise dpf.HTTP400BadRequest('text/plain', msg)
+
+            with self.metrics.phase('store'):
+                self._link_blob(full_fname, h.hexdigest())
 
             d = {'source content type': environ['CONTENT_TYPE'], 
                 'creation time': int(time.time()), 
+                'sha256': h.hexdigest(), 
+                'size': size, 
                 'data': {environ['CONTENT_TYPE']: fname}}
 
-            fo = open(os.path.join(dir, 'info.json'), 'w')
-            json.dump(d, fo)
-            fo.close()
+            self._write_info(ident, d)
 
             app_uri = wsgiref.util.application_uri(environ).rstrip('/')
             headers = [('Location', '%s/%s' % (app_uri, ident)), 
@@ -117,54 +246,556 @@ class Application(dpf.Application):
 
     def handle_data(self, environ, ident):
 
-        if ident not in os.listdir(self.base_dir):
+        if not ident_re.search(ident):
             raise dpf.HTTP404NotFound()
 
-        if not os.path.exists(os.path.join(self.base_dir, ident, 'info.json')):
+        dir = self.data_dir(ident)
+
+        if not os.path.isdir(dir):
+            raise dpf.HTTP404NotFound()
+
+        if not os.path.exists(os.path.join(dir, 'info.json')):
             raise dpf.HTTP410Gone()
 
         if environ['REQUEST_METHOD'] == 'DELETE':
-            for fname in os.listdir(os.path.join(self.base_dir, ident)):
-                os.unlink(os.path.join(self.base_dir, ident, fname))
+            with self._lock(ident):
+                try:
+                    d = self._read_info(ident)
+                except IOError:
+                    # deleted while we waited
+                    raise dpf.HTTP410Gone()
+                with self._store_lock():
+                    for fname in os.listdir(dir):
+                        os.unlink(os.path.join(dir, fname))
+                    if 'sha256' in d:
+                        self._release_blob(d['sha256'])
             headers = []
             oi = ['']
             return ('204 No Content', headers, oi)
 
         if environ['REQUEST_METHOD'] in ('HEAD', 'GET'):
 
-            d = json.load(open(os.path.join(self.base_dir, ident, 'info.json')))
+            d = self._read_info(ident)
+
+            if 'sha256' not in d or \
+               os.stat(os.path.join(dir, 'data')).st_nlink < 2:
+                d = self._upgrade(ident)
 
             source_content_type = d['source content type']
+            sha256 = str(d['sha256'])
 
-            available_types = [source_content_type]
+            available_types = self.available_types.get(source_content_type, 
+                                                       [source_content_type])
 
-            if source_content_type in self.data_handlers:
-                to_types = self.data_handlers[source_content_type].to_types
-                available_types.extend(to_types)
+            with self.metrics.phase('negotiate'):
+                content_type = dpf.choose_media_type(dpf.get_accept(environ), 
+                                                     available_types)
 
-            content_type = dpf.choose_media_type(dpf.get_accept(environ), 
-                                                 available_types)
+            tt = time.gmtime(d['creation time'])
+            time_string = time.strftime('%a, %d %b %Y %H:%M:%S GMT', tt)
+
+            headers = [('Last-Modified', time_string), ('Vary', 'Accept')]
+            etag = self._etag(d, content_type)
+            headers.append(('ETag', etag))
 
-            fname = os.path.join(self.base_dir, ident, 'data')
+            # this only needs the metadata, so is done before any data is 
+            # read or converted
+            if dpf.not_modified(environ, etag, d['creation time']):
+                return ('304 Not Modified', headers, [''])
 
+            # the data is streamed from disk rather than read into memory, 
+            # so serving it costs the same however large it is
+            fname = None
             if content_type == source_content_type:
-                data = open(fname).read()
+                fname = os.path.join(dir, 'data')
+            elif os.path.exists(self.blob_fname(sha256, content_type)):
+                fname = self.blob_fname(sha256, content_type)
+                self.cache.touch(sha256, content_type)
+                self.metrics.count('conversion_cache_hits_total')
             else:
-                data_handler = self.data_handlers[source_content_type]
-                data = data_handler.convert(fname, content_type)
+                # for a GET, stream the conversion to the client as it is 
+                # stored, unless another request is already converting or 
+                # only part of the data is wanted
+                conversion = None
+                if environ['REQUEST_METHOD'] == 'GET' and \
+                   'HTTP_RANGE' not in environ:
+                    conversion = self._start_conversion(sha256, 
+                                                        source_content_type, 
+                                                        content_type)
+                if conversion is None:
+                    fname = self._convert(sha256, 
+                                          source_content_type, 
+                                          content_type)
+
+            if fname is None:
+                # the length isn't known until the conversion is finished
+                headers.extend([('Content-Type', str(content_type)), 
+                                ('Accept-Ranges', 'bytes')])
+                return ('200 OK', headers, conversion)
+
+            return dpf.file_response(environ, 
+                                     fname, 
+                                     str(content_type), 
+                                     headers)
 
-            tt = time.gmtime(d['creation time'])
-            time_string = time.strftime('%a, %d %b %Y %H:%M:%S GMT', tt)
+        raise dpf.HTTP405MethodNotAllowed(['HEAD', 'GET', 'DELETE'])
 
-            headers = [('Content-Type', str(content_type)), 
-                        ('Content-Length', str(len(data))), 
-                        ('Last-Modified', time_string)]
+    def data_dir(self, ident):
+        """data_dir(ident) -> the directory for ident (see data_dir())"""
+        return data_dir(self.base_dir, ident)
+
+    def blob_fname(self, sha256, content_type=None):
+        """blob_fname(sha256[, content_type]) -> file name
+
+        return the name of the file in the blob store holding the data 
+        with the given hash or, if content_type is given, the data 
+        converted to content_type
+
+        Each dataset's data file is a hard link to the data's file in the 
+        blob store, so identical uploads share one copy on disk and the 
+        link count of the blob store file tracks the number of datasets 
+        using it.  Conversions are only stored in the blob store, so a 
+        conversion done for one dataset serves all datasets with the same 
+        data.
+        """
+        fname = os.path.join(self.blob_dir, sha256[0:2], sha256[2:4], sha256)
+        if content_type is not None:
+            fname += '-%s' % content_type.replace('/', '_')
+        return fname
+
+    def handle_admin(self, environ, name):
+
+        if name == 'metrics' and self.metrics.enabled:
+            if environ['REQUEST_METHOD'] != 'GET':
+                raise dpf.HTTP405MethodNotAllowed(['GET'])
+            output = self.metrics.render()
+            headers = [('Content-Type', 'text/plain; version=0.0.4'),
+                       ('Content-Length', str(len(output)))]
+            return ('200 OK', headers, [output])
 
-            if environ['REQUEST_METHOD'] == 'HEAD':
-                return ('200 OK', headers, [''])
+        if name != 'store':
+            raise dpf.HTTP404NotFound()
 
-            return ('200 OK', headers, [data])
+        if environ['REQUEST_METHOD'] != 'GET':
+            raise dpf.HTTP405MethodNotAllowed(['GET'])
+
+        mt = dpf.choose_media_type(dpf.get_accept(environ), text_or_json)
+
+        d = self.store_stats()
+        keys = ('datasets', 'blobs', 'data size', 'stored size', 
+                'dedup ratio', 'conversions', 'conversions size')
+
+        if mt == 'text/plain':
+            output = ''
+            for key in keys:
+                output += '%s: %s\n' % (key, d[key])
+        else:
+            output = json.dumps(d) + '\n'
+
+        headers = [('Content-Type', mt),
+                   ('Content-Length', str(len(output)))]
+        return ('200 OK', headers, [output])
+
+    def store_stats(self):
+        """store_stats() -> dictionary
+
+        return statistics about the blob store:
+
+            datasets: the number of datasets
+            blobs: the number of distinct data files stored
+            data size: the total size of the data in all datasets
+            stored size: the total size of the stored data files
+            dedup ratio: data size / stored size
+            conversions: the number of stored conversions
+            conversions size: the total size of the stored conversions
+
+        This walks the blob store, so takes time proportional to its size.
+        """
+        d = {'datasets': 0, 
+             'blobs': 0, 
+             'data size': 0, 
+             'stored size': 0, 
+             'conversions': 0, 
+             'conversions size': 0}
+        for (dirpath, dirnames, fnames) in os.walk(self.blob_dir):
+            for fname in fnames:
+                if fname.endswith('.tmp') or fname.endswith('.lock'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, fname))
+                except OSError:
+                    continue
+                if sha256_re.search(fname):
+                    d['datasets'] += st.st_nlink - 1
+                    d['blobs'] += 1
+                    d['data size'] += st.st_size * (st.st_nlink - 1)
+                    d['stored size'] += st.st_size
+                else:
+                    d['conversions'] += 1
+                    d['conversions size'] += st.st_size
+        if d['stored size']:
+            d['dedup ratio'] = float(d['data size']) / d['stored size']
+        else:
+            d['dedup ratio'] = 1.0
+        return d
+
+    def _etag(self, d, content_type):
+        """_etag(d, content_type) -> entity tag
+
+        return the (strong) entity tag for the representation of a 
+        dataset as content_type, given the dataset's info.json contents
+
+        The tag is derived from the hash of the data.
+        """
+        if content_type == d['source content type']:
+            return '"%s"' % str(d['sha256'])
+        return '"%s-%s"' % (str(d['sha256']), 
+                             str(content_type).replace('/', '_'))
+
+    def _read_info(self, ident):
+        with self.metrics.phase('metadata'):
+            with open(os.path.join(self.data_dir(ident), 'info.json')) as fo:
+                return json.load(fo)
+
+    def _write_info(self, ident, d):
+        """write info.json for ident
+
+        the file is replaced atomically, so readers never see a partial file
+        """
+        fname = os.path.join(self.data_dir(ident), 'info.json')
+        with self.metrics.phase('metadata'):
+            with open(fname + '.tmp', 'w') as fo:
+                json.dump(d, fo)
+            os.rename(fname + '.tmp', fname)
+        return
 
-        raise dpf.HTTP405MethodNotAllowed(['HEAD', 'GET', 'DELETE'])
+    def _lock(self, ident):
+        """return the lock guarding changes to ident's stored files"""
+        return Lock(os.path.join(self.data_dir(ident), 'lock'))
+
+    def _store_lock(self):
+        """return the lock guarding the link counts of the blob store
+
+        this is only held briefly; if both are needed, it must be taken 
+        after a dataset's lock
+        """
+        return Lock(os.path.join(self.blob_dir, 'lock'))
+
+    def _blob_lock(self, sha256):
+        """return the lock guarding the conversions of the data with the 
+        given hash
+        """
+        return Lock(self.blob_fname(sha256) + '.lock')
+
+    def _link_blob(self, fname, sha256):
+        """make fname a link to the blob store file for its data (which 
+        has the given hash), storing it in the blob store if it isn't 
+        already there
+        """
+        blob_fname = self.blob_fname(sha256)
+        with self._store_lock():
+            if os.path.exists(blob_fname):
+                os.link(blob_fname, fname + '.tmp')
+                os.rename(fname + '.tmp', fname)
+            else:
+                parent = os.path.dirname(blob_fname)
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                os.link(fname, blob_fname)
+        return
+
+    def _release_blob(self, sha256):
+        """remove the data with the given hash, and its conversions, from 
+        the blob store if no dataset uses it any longer
+
+        the caller must hold the store lock
+        """
+        blob_fname = self.blob_fname(sha256)
+        try:
+            st = os.stat(blob_fname)
+        except OSError:
+            return
+        if st.st_nlink > 1:
+            return
+        os.unlink(blob_fname)
+        # if a conversion is running, leave it be; its result will be 
+        # evicted from the conversion cache in time
+        lock = self._blob_lock(sha256)
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            parent = os.path.dirname(blob_fname)
+            prefix = '%s-' % sha256
+            for fname in os.listdir(parent):
+                if fname.startswith(prefix) and not fname.endswith('.tmp'):
+                    os.unlink(os.path.join(parent, fname))
+            self.cache.remove(sha256)
+            os.unlink(lock.fname)
+        finally:
+            lock.release()
+        return
+
+    def _upgrade(self, ident):
+        """_upgrade(ident) -> info.json contents
+
+        bring a dataset stored by an earlier version of the data server 
+        into the blob store, computing the hash of its data if it wasn't 
+        recorded and removing any conversions stored with the dataset 
+        rather than in the blob store
+        """
+
+        dir = self.data_dir(ident)
+        data_fname = os.path.join(dir, 'data')
+
+        with self._lock(ident):
+
+            d = self._read_info(ident)
+            if 'sha256' in d and os.stat(data_fname).st_nlink > 1:
+                return d
+
+            if 'sha256' not in d:
+                h = hashlib.sha256()
+                size = 0
+                with open(data_fname, 'rb') as fo:
+                    while True:
+                        data = fo.read(dpf.read_size)
+                        if not data:
+                            break
+                        h.update(data)
+                        size += len(data)
+                d['sha256'] = h.hexdigest()
+                d['size'] = size
+
+            self._link_blob(data_fname, d['sha256'])
+
+            for fname in d['data'].itervalues():
+                if fname != 'data' and os.path.exists(os.path.join(dir, fname)):
+                    os.unlink(os.path.join(dir, fname))
+            d['data'] = {d['source content type']: 'data'}
+
+            self._write_info(ident, d)
+
+        return d
+
+    def _start_conversion(self, sha256, source_content_type, content_type):
+        """_start_conversion(sha256, source_content_type, content_type) -> Conversion or None
+
+        lock the data with the given hash and return a Conversion of it 
+        to content_type
+
+        If another request holds the lock or has already stored the 
+        conversion (or the data is no longer stored), return None.
+        """
+
+        lock = self._blob_lock(sha256)
+        if not lock.acquire(blocking=False):
+            return None
+
+        try:
+            if os.path.exists(self.blob_fname(sha256, content_type)) or \
+               not os.path.exists(self.blob_fname(sha256)):
+                lock.release()
+                return None
+            return Conversion(self, 
+                              sha256, 
+                              source_content_type, 
+                              content_type, 
+                              lock)
+        except:
+            lock.release()
+            raise
+
+    def _convert(self, sha256, source_content_type, content_type):
+        """_convert(sha256, source_content_type, content_type) -> file name
+
+        convert the data with the given hash to content_type, store the 
+        result in the blob store, and return the name of the stored file
+
+        Only one conversion of given data runs at a time.  If another 
+        request stored the same conversion while this one waited for the 
+        lock, that stored conversion is used.
+        """
+
+        fname = self.blob_fname(sha256, content_type)
+
+        with self._blob_lock(sha256):
+
+            if os.path.exists(fname):
+                self.cache.touch(sha256, content_type)
+                self.metrics.count('conversion_cache_hits_total')
+                return fname
+
+            if not os.path.exists(self.blob_fname(sha256)):
+                # the last dataset using the data was deleted while we 
+                # waited
+                raise dpf.HTTP410Gone()
+
+            conversion = Conversion(self, 
+                                    sha256, 
+                                    source_content_type, 
+                                    content_type)
+            for data in conversion:
+                pass
+
+        return fname
+
+    def _store_conversion(self, sha256, content_type, size):
+        """record a stored conversion in the cache index
+
+        the caller must hold the lock for sha256
+        """
+        self.cache.evict(self._remove_conversion, size)
+        self.cache.add(sha256, content_type, size)
+        return
+
+    def _remove_conversion(self, sha256, content_type):
+        """remove a stored conversion
+
+        returns False if the data's conversions are locked, True otherwise
+        """
+        lock = self._blob_lock(sha256)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            fname = self.blob_fname(sha256, content_type)
+            if os.path.exists(fname):
+                os.unlink(fname)
+        finally:
+            lock.release()
+        return True
+
+def data_dir(base_dir, ident):
+    """data_dir(base_dir, ident) -> the directory for ident
+
+    Data is stored in a two-level fan-out on the first four hex digits 
+    of the ident (12345678 is stored in 12/34/12345678) so that no 
+    directory holds too many entries and a dataset can be found without 
+    searching.
+    """
+    return os.path.join(base_dir, ident[0:2], ident[2:4], ident)
+
+def migrate(base_dir):
+
+    """migrate(base_dir) -> number of datasets changed
+
+    Bring datasets stored by earlier versions of the data server up to 
+    date: move datasets stored directly in base_dir (the layout used 
+    before the two-level fan-out) to their places in the fan-out, and 
+    move data not in the blob store into it.
+    """
+
+    changed = set()
+    for ident in os.listdir(base_dir):
+        if not ident_re.search(ident):
+            continue
+        old_dir = os.path.join(base_dir, ident)
+        if not os.path.isdir(old_dir):
+            continue
+        parent = os.path.join(base_dir, ident[0:2], ident[2:4])
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        os.rename(old_dir, os.path.join(parent, ident))
+        changed.add(ident)
+
+    app = Application(base_dir, [])
+
+    for (dirpath, dirnames, fnames) in os.walk(base_dir):
+        if dirpath == base_dir:
+            # don't descend into the blob store
+            dirnames[:] = [ dn for dn in dirnames if dn != 'blobs' ]
+        ident = os.path.basename(dirpath)
+        if not ident_re.search(ident) or 'info.json' not in fnames:
+            continue
+        d = app._read_info(ident)
+        if 'sha256' in d and \
+           os.stat(os.path.join(dirpath, 'data')).st_nlink > 1:
+            continue
+        app._upgrade(ident)
+        changed.add(ident)
+
+    # conversions were indexed by dataset before the blob store
+    db = sqlite3.connect(app.cache.db_fname)
+    try:
+        db.execute("DROP TABLE IF EXISTS conversion")
+        db.commit()
+    finally:
+        db.close()
+
+    return len(changed)
+
+class Conversion:
+
+    """iterator over data converted to another content type
+
+    The converted data is written to a file as it is generated, and is 
+    stored in the blob store when the iteration finishes.  If the 
+    iteration is abandoned (close() is called before the end), the 
+    partial file is removed.
+
+    The caller must hold the lock for the data's conversions.  If lock 
+    is given, it is released when the conversion is finished or 
+    abandoned.
+    """
+
+    def __init__(self, 
+                 app, 
+                 sha256, 
+                 source_content_type, 
+                 content_type, 
+                 lock=None):
+        self.app = app
+        self.sha256 = sha256
+        self.content_type = content_type
+        self.lock = lock
+        self.fname = app.blob_fname(sha256, content_type)
+        data_handler = app.data_handlers[source_content_type]
+        source_fname = app.blob_fname(sha256)
+        self.source = iter(data_handler.convert(source_fname, content_type))
+        self.fo = open(self.fname + '.tmp', 'wb')
+        self.size = 0
+        # time spent converting, observed when the conversion ends
+        self.seconds = 0.0
+        app.metrics.count('conversion_cache_misses_total')
+        return
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        t0 = time.time()
+        try:
+            data = self.source.next()
+        except StopIteration:
+            self.seconds += time.time() - t0
+            self._finish()
+            raise
+        except:
+            self.close()
+            raise
+        self.seconds += time.time() - t0
+        self.fo.write(data)
+        self.size += len(data)
+        return data
+
+    def _finish(self):
+        self.fo.close()
+        os.rename(self.fname + '.tmp', self.fname)
+        self.app._store_conversion(self.sha256, self.content_type, self.size)
+        self.app.metrics.observe('convert', self.seconds)
+        self._release()
+        return
+
+    def _release(self):
+        if self.lock is not None:
+            self.lock.release()
+            self.lock = None
+        return
+
+    def close(self):
+        if not self.fo.closed:
+            self.fo.close()
+            os.unlink(self.fname + '.tmp')
+        self._release()
+        return
 
 # eof
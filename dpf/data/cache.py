@@ -0,0 +1,195 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+import os
+import time
+import fcntl
+import sqlite3
+
+db_ddl = """CREATE TABLE IF NOT EXISTS blob_conversion
+                (sha256 TEXT NOT NULL,
+                 content_type TEXT NOT NULL,
+                 size INTEGER NOT NULL,
+                 last_access REAL NOT NULL,
+                 PRIMARY KEY (sha256, content_type));
+            CREATE INDEX IF NOT EXISTS blob_conversion_last_access
+                ON blob_conversion (last_access);"""
+
+class Lock:
+
+    """an exclusive lock on a file, shared between threads and processes
+
+    The lock file is created if it doesn't exist.  The holder of the lock 
+    may remove the lock file; anyone waiting on the removed file will 
+    then lock a new one.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.fo = None
+        return
+
+    def acquire(self, blocking=True):
+        """acquire the lock
+
+        returns True if the lock was acquired; if blocking is False and
+        the lock is held elsewhere, returns False
+        """
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        while True:
+            fo = open(self.fname, 'a')
+            try:
+                fcntl.flock(fo.fileno(), flags)
+            except IOError:
+                fo.close()
+                if blocking:
+                    raise
+                return False
+            # check that the file we locked wasn't removed while we waited
+            try:
+                st = os.stat(self.fname)
+            except OSError:
+                st = None
+            if st and st.st_ino == os.fstat(fo.fileno()).st_ino:
+                break
+            fo.close()
+        self.fo = fo
+        return True
+
+    def release(self):
+        fcntl.flock(self.fo.fileno(), fcntl.LOCK_UN)
+        self.fo.close()
+        self.fo = None
+        return
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+        return False
+
+class ConversionCache:
+
+    """index of the converted representations in a data server's blob 
+    store
+
+    Conversions are identified by the hash of the source data and the 
+    content type converted to.  The index records the size and last 
+    access time of each stored conversion so that, when max_size is not 
+    None, the least recently used conversions can be evicted to keep the 
+    total size of the conversions under max_size bytes.
+
+    The converted files themselves are managed by the application; 
+    evict() calls back into the application to remove them.
+
+    The index is kept in db_name in base_dir.  (The process server's 
+    FetchCache uses one for its fetched inputs, with the hash of the URL 
+    for sha256 and the entity tag for content_type.)
+    """
+
+    def __init__(self, base_dir, max_size=None, db_name='conversions.sqlite'):
+        self.base_dir = base_dir
+        self.max_size = max_size
+        self.db_fname = os.path.join(self.base_dir, db_name)
+        db = sqlite3.connect(self.db_fname)
+        try:
+            db.executescript(db_ddl)
+            db.commit()
+        finally:
+            db.close()
+        return
+
+    def _connect(self):
+        return sqlite3.connect(self.db_fname, timeout=60)
+
+    def add(self, sha256, content_type, size):
+        db = self._connect()
+        try:
+            c = db.cursor()
+            c.execute("""INSERT OR REPLACE INTO blob_conversion
+                         (sha256, content_type, size, last_access)
+                         VALUES (?, ?, ?, ?)""",
+                      (sha256, content_type, size, time.time()))
+            c.close()
+            db.commit()
+        finally:
+            db.close()
+        return
+
+    def touch(self, sha256, content_type):
+        """note an access to a conversion"""
+        db = self._connect()
+        try:
+            c = db.cursor()
+            c.execute("""UPDATE blob_conversion SET last_access = ?
+                         WHERE sha256 = ? AND content_type = ?""",
+                      (time.time(), sha256, content_type))
+            c.close()
+            db.commit()
+        finally:
+            db.close()
+        return
+
+    def remove(self, sha256, content_type=None):
+        """remove a conversion (or all conversions of the data if 
+        content_type is None) from the index
+        """
+        db = self._connect()
+        try:
+            c = db.cursor()
+            if content_type is None:
+                c.execute("DELETE FROM blob_conversion WHERE sha256 = ?", 
+                          (sha256, ))
+            else:
+                c.execute("""DELETE FROM blob_conversion
+                             WHERE sha256 = ? AND content_type = ?""",
+                          (sha256, content_type))
+            c.close()
+            db.commit()
+        finally:
+            db.close()
+        return
+
+    def evict(self, remove_conversion, extra=0):
+        """evict least recently used conversions until the total size,
+        plus extra bytes about to be added, is under max_size
+
+        remove_conversion(sha256, content_type) is called for each
+        conversion to evict; it should remove the stored file and return
+        True, or return False if the conversion can't be removed now
+        (because it is in use), in which case it is skipped
+        """
+
+        if self.max_size is None:
+            return
+
+        db = self._connect()
+        try:
+            c = db.cursor()
+            c.execute("SELECT SUM(size) FROM blob_conversion")
+            total = (c.fetchone()[0] or 0) + extra
+            if total <= self.max_size:
+                c.close()
+                return
+            c.execute("""SELECT sha256, content_type, size 
+                         FROM blob_conversion
+                         ORDER BY last_access""")
+            candidates = c.fetchall()
+            c.close()
+        finally:
+            db.close()
+
+        for (sha256, content_type, size) in candidates:
+            if total <= self.max_size:
+                break
+            if not remove_conversion(sha256, content_type):
+                continue
+            self.remove(sha256, content_type)
+            total -= size
+
+        return
+
+# eof
@@ -2,14 +2,52 @@
 
 import csv
 import json
+import dpf
+from .validators import JSONValidator, CSVValidator
+
+# size of the chunks generated by conversions
+chunk_size = 64*1024
 
 class DataHandler:
 
-    """base class for type handlers"""
+    """base class for type handlers
+
+    Handlers have the attributes from_type (the media type handled) and 
+    to_types (a list of media types to which the data can be converted) 
+    and the methods:
+
+        validator() -> an incremental validator (see 
+            dpf.data.handlers.validators), or None if the handler 
+            doesn't validate incrementally
+
+        validate(fname) -> True if the data in fname is valid
+
+        convert(fname, content_type) -> an iterator over the data in 
+            fname converted to content_type (one of to_types)
+
+    The data server feeds uploads to the validator as they arrive, so 
+    the data is only read once; validate() is only used for handlers 
+    that don't provide a validator.
+    """
 
     def __init__(self):
         return
 
+    def validator(self):
+        return None
+
+    def validate(self, fname):
+        validator = self.validator()
+        if validator is None:
+            return True
+        with open(fname) as fo:
+            while True:
+                data = fo.read(dpf.read_size)
+                if not data:
+                    break
+                validator.update(data)
+        return validator.finish()
+
 class JSONHandler(DataHandler):
 
     def __init__(self):
@@ -18,36 +56,66 @@ class JSONHandler(DataHandler):
         self.to_types = ['application/json']
         return
 
-    def validate(self, fname):
-        data = open(fname).read()
-        try:
-            json.loads(data)
-        except ValueError:
-            return False
-        return True
+    def validator(self):
+        return JSONValidator()
 
 class CSVHandler(DataHandler):
 
     def __init__(self):
         DataHandler.__init__(self)
         self.from_type = 'text/csv'
-        self.to_types = ['application/json']
+        self.to_types = ['application/json', 'application/x-ndjson']
         return
 
-    def validate(self, fname):
-        try:
-            with open(fname) as fo:
-                reader = csv.reader(fo)
-                for row in reader:
-                    pass
-        except csv.Error:
-            return False
-        return True
+    def validator(self):
+        return CSVValidator()
 
     def convert(self, fname, content_type):
+        """generate the JSON (an array of rows) or NDJSON (a row per line) 
+        for the CSV data in fname
+
+        rows are read and serialized one at a time, so memory use does 
+        not depend on the size of the data
+        """
         with open(fname) as fo:
             reader = csv.reader(fo)
-            l = [ row for row in reader ]
-        return json.dumps(l)
+            if content_type == 'application/x-ndjson':
+                rows = ( json.dumps(row) + '\n' for row in reader )
+            else:
+                rows = _json_array(reader)
+            for chunk in _chunks(rows):
+                yield chunk
+        return
+
+def _json_array(rows):
+    """generate the fragments of the JSON array of rows
+
+    the output is the same as json.dumps(list(rows))
+    """
+    yield '['
+    first = True
+    for row in rows:
+        if first:
+            first = False
+            yield json.dumps(row)
+        else:
+            yield ', ' + json.dumps(row)
+    yield ']'
+    return
+
+def _chunks(fragments):
+    """join fragments into chunks of about chunk_size bytes"""
+    buffer = []
+    size = 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+    return
 
 # eof
@@ -0,0 +1,297 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""incremental validators
+
+A validator is fed data as it arrives and reports at the end whether the
+data was valid:
+
+    validator.update(data)
+    ...
+    valid = validator.finish()
+
+finish() must be called even if the data isn't complete (if the upload
+fails, for instance) so that any resources held by the validator are
+released.
+"""
+
+import re
+import csv
+import json
+import json.scanner
+import codecs
+import threading
+import Queue
+
+_ws_re = re.compile(r'[ \t\n\r]*')
+
+# the groups are indexed by token type, below
+_token_re = re.compile(r'''[ \t\n\r]*(?:
+                           (")|
+                           ([{\[])|
+                           ([}\]])|
+                           (:)|
+                           (,)|
+                           (-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|
+                            true|false|null|NaN|Infinity|-Infinity))''',
+                       re.VERBOSE)
+
+(_STRING, _OPEN, _CLOSE, _COLON, _COMMA, _SCALAR) = range(1, 7)
+
+_string_body_re = re.compile(r'(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*')
+
+# something at the end of the data that could be the start of a scalar
+# token that is continued in the next chunk
+_partial_scalar_re = re.compile(r'-?[0-9]*(?:\.[0-9]*)?(?:[eE][-+]?[0-9]*)?\Z')
+_literals = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+_value_states = ('value', 'value or end')
+
+_scan_once = json.scanner.make_scanner(json.JSONDecoder())
+
+class JSONValidator:
+
+    """incremental JSON validator
+
+    This accepts the same documents as json.loads() (including NaN and
+    the infinities and any top-level value) without holding the whole
+    document or its decoded object: only the containers that span the
+    chunks passed to update() are tracked, and values within a chunk
+    are decoded one at a time and discarded.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        # the containers we are in
+        self.stack = []
+        # what is expected next: 'value', 'value or end' (after [),
+        # 'key or end' (after {), 'key', 'colon', 'comma or end' or 'done'
+        self.state = 'value'
+        # whether we are in a string, and whether it is a key
+        self.in_string = False
+        self.string_is_key = False
+        self.valid = True
+        return
+
+    def update(self, data):
+        if not self.valid:
+            return
+        try:
+            text = self.decoder.decode(data)
+        except UnicodeDecodeError:
+            self.valid = False
+            return
+        self._scan(text, False)
+        return
+
+    def finish(self):
+        if self.valid:
+            try:
+                text = self.decoder.decode('', True)
+            except UnicodeDecodeError:
+                self.valid = False
+            else:
+                self._scan(text, True)
+        if self.in_string or self.state != 'done':
+            self.valid = False
+        return self.valid
+
+    def _value(self):
+        """note the end of a value"""
+        if self.stack:
+            self.state = 'comma or end'
+        else:
+            self.state = 'done'
+        return
+
+    def _scan(self, text, final):
+
+        buffer = self.buffer + text
+        pos = 0
+        n = len(buffer)
+
+        while pos < n:
+
+            if self.state in _value_states and not self.in_string:
+                # values that are complete in the buffer are checked in one 
+                # go by the json module's (C) scanner, so the token-by-token 
+                # scan below is only needed for values that continue in 
+                # the next chunk (and a string continued from the last 
+                # chunk must be finished by it first)
+                start = _ws_re.match(buffer, pos).end()
+                try:
+                    end = _scan_once(buffer, start)[1]
+                except (StopIteration, ValueError):
+                    end = None
+                if end is not None and \
+                   (final or 
+                    (end < n and not _partial_scalar_re.match(buffer, start))):
+                    pos = end
+                    self._value()
+                    continue
+
+            if self.in_string:
+                end = _string_body_re.match(buffer, pos).end()
+                if end == n:
+                    pos = n
+                    break
+                if buffer[end] == '"':
+                    self.in_string = False
+                    pos = end + 1
+                    if self.string_is_key:
+                        self.state = 'colon'
+                    else:
+                        self._value()
+                    continue
+                if buffer[end] == '\\' and n - end < 6 and not final:
+                    # possibly an escape sequence split between chunks
+                    pos = end
+                    break
+                self.valid = False
+                return
+
+            mo = _token_re.match(buffer, pos)
+
+            if not mo:
+                rest = buffer[_ws_re.match(buffer, pos).end():]
+                if not rest:
+                    pos = n
+                    break
+                if not final and self.state in _value_states and \
+                   (_partial_scalar_re.match(rest) or
+                    any( lit.startswith(rest) for lit in _literals )):
+                    pos = n - len(rest)
+                    break
+                self.valid = False
+                return
+
+            token_type = mo.lastindex
+            token = mo.group(token_type)
+
+            if token_type == _SCALAR and not final and \
+               (mo.end() == n or 
+                _partial_scalar_re.match(buffer, mo.start(token_type))):
+                # the token may continue in the next chunk
+                pos = mo.start(token_type)
+                break
+
+            pos = mo.end()
+
+            if token_type == _STRING:
+                if self.state in ('key or end', 'key'):
+                    self.string_is_key = True
+                elif self.state in _value_states:
+                    self.string_is_key = False
+                else:
+                    self.valid = False
+                    return
+                self.in_string = True
+            elif token_type == _SCALAR:
+                if self.state not in _value_states:
+                    self.valid = False
+                    return
+                self._value()
+            elif token_type == _OPEN:
+                if self.state not in _value_states:
+                    self.valid = False
+                    return
+                self.stack.append(token)
+                if token == '{':
+                    self.state = 'key or end'
+                else:
+                    self.state = 'value or end'
+            elif token_type == _CLOSE:
+                if not self.stack:
+                    self.valid = False
+                    return
+                if token == '}':
+                    ok_states = ('key or end', 'comma or end')
+                    ok_container = '{'
+                else:
+                    ok_states = ('value or end', 'comma or end')
+                    ok_container = '['
+                if self.state not in ok_states or \
+                   self.stack[-1] != ok_container:
+                    self.valid = False
+                    return
+                self.stack.pop()
+                self._value()
+            elif token_type == _COLON:
+                if self.state != 'colon':
+                    self.valid = False
+                    return
+                self.state = 'value'
+            else:
+                if self.state != 'comma or end':
+                    self.valid = False
+                    return
+                if self.stack[-1] == '{':
+                    self.state = 'key'
+                else:
+                    self.state = 'value'
+
+        self.buffer = buffer[pos:]
+
+        return
+
+class CSVValidator:
+
+    """incremental CSV validator
+
+    The data is parsed by a csv.reader, exactly as CSVHandler.convert()
+    will parse it.  Since csv.reader pulls its input, it runs in a
+    separate thread that is handed the chunks passed to update() through
+    a short queue.
+    """
+
+    def __init__(self):
+        self.queue = Queue.Queue(4)
+        self.valid = True
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def _lines(self):
+        """generate the lines in the data passed to update()"""
+        partial = ''
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            lines = (partial + data).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial:
+            yield partial
+        return
+
+    def _run(self):
+        lines = self._lines()
+        try:
+            for row in csv.reader(lines):
+                pass
+        except csv.Error:
+            self.valid = False
+        except Exception, data:
+            self.error = data
+        # consume anything left so update() doesn't block
+        for line in lines:
+            pass
+        return
+
+    def update(self, data):
+        if data:
+            self.queue.put(data)
+        return
+
+    def finish(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.valid
+
+# eof
@@ -0,0 +1,74 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""persistent SQLite connections
+
+ConnectionPool keeps one connection to a database for each thread (in
+each process, since connections can't be shared across a fork), so
+requests don't pay for opening the file and parsing the schema each
+time, and the connection's statement cache holds the prepared
+statements between requests.  Connections use write-ahead logging, so
+readers don't wait for writers and commits need fewer syncs.
+
+    pool = ConnectionPool(fname)
+    with pool.transaction() as db:
+        db.execute(...)
+"""
+
+import os
+import threading
+import sqlite3
+
+# how many prepared statements each connection keeps
+cached_statements = 100
+
+synchronous_values = ('OFF', 'NORMAL', 'FULL')
+
+class ConnectionPool:
+
+    """per-thread connections to the SQLite database fname
+
+    synchronous is the PRAGMA synchronous setting: 'OFF', 'NORMAL' or
+    'FULL'.  With write-ahead logging, NORMAL is safe against corruption
+    but a commit may be lost on a power failure.
+
+    busy_timeout is the time in seconds to wait for another connection's
+    lock before failing.
+
+    detect_types is passed to sqlite3.connect().
+    """
+
+    def __init__(self,
+                 fname,
+                 synchronous='NORMAL',
+                 busy_timeout=60,
+                 detect_types=0):
+        if synchronous.upper() not in synchronous_values:
+            raise ValueError('bad synchronous value %s' % synchronous)
+        self.fname = fname
+        self.synchronous = synchronous.upper()
+        self.busy_timeout = busy_timeout
+        self.detect_types = detect_types
+        self.local = threading.local()
+        return
+
+    def connection(self):
+        """return this thread's connection, opening it if necessary"""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            # new thread, or a connection inherited across a fork
+            db = sqlite3.connect(self.fname,
+                                 timeout=self.busy_timeout,
+                                 detect_types=self.detect_types,
+                                 cached_statements=cached_statements)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = %s' % self.synchronous)
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def transaction(self):
+        """return this thread's connection as a context manager that
+        commits on success and rolls back on an exception
+        """
+        return self.connection()
+
+# eof
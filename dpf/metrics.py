@@ -0,0 +1,239 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""request metrics
+
+A Metrics object collects counters and histograms and renders them in
+the Prometheus text format.  Requests are timed by phase:
+
+    metrics.begin_request()
+    with metrics.phase('read'):
+        ...
+    timings = metrics.end_request('GET', 200)
+
+Phase durations feed the <prefix>_phase_seconds histogram and are
+returned by end_request() for the Server-Timing header (see
+server_timing()).  The current request is tracked per thread, so code
+called while handling a request can time its phases without being
+passed anything.
+
+NullMetrics has the same interface and does nothing, so applications
+with instrumentation disabled pay only for a few empty method calls per
+request.
+
+Metrics are kept in memory, so each process of a pre-forked server
+reports its own.
+"""
+
+import time
+import threading
+
+# histogram bucket upper bounds, in seconds
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_null_phase = _NullPhase()
+
+class NullMetrics:
+
+    """metrics that aren't collected"""
+
+    enabled = False
+
+    def describe(self, name, type, help):
+        return
+
+    def begin_request(self):
+        return
+
+    def end_request(self, method, status):
+        return []
+
+    def phase(self, name):
+        return _null_phase
+
+    def observe(self, phase, seconds):
+        return
+
+    def count(self, name, n=1, **labels):
+        return
+
+    def render(self):
+        return ''
+
+class _Phase:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        return
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.metrics.observe(self.name, time.time() - self.t0)
+        return False
+
+class Metrics:
+
+    """collected metrics
+
+    All metric names are prefixed with prefix.
+    """
+
+    enabled = True
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        # name -> (type, help)
+        self.descriptions = {}
+        # name -> {labels: value}, labels being a sorted tuple of
+        # (label, value)
+        self.counters = {}
+        # name -> {labels: [bucket counts, sum, count]}
+        self.histograms = {}
+        self.local = threading.local()
+        self.describe('phase_seconds',
+                      'histogram',
+                      'Time spent in each phase of handling requests.')
+        self.describe('request_seconds',
+                      'histogram',
+                      'Time spent handling requests.')
+        self.describe('requests_total', 'counter', 'Requests handled.')
+        return
+
+    def describe(self, name, type, help):
+        """describe a metric (type is 'counter' or 'histogram')"""
+        self.descriptions[name] = (type, help)
+        return
+
+    def begin_request(self):
+        """start timing a request in this thread"""
+        self.local.t0 = time.time()
+        self.local.timings = []
+        return
+
+    def end_request(self, method, status):
+        """end_request(method, status) -> [(phase, seconds), ...]
+
+        finish timing the request in this thread and count it
+
+        The returned list gives the total time in each phase, in the
+        order the phases were first entered, followed by ('total',
+        seconds).
+        """
+        total = time.time() - self.local.t0
+        timings = self.local.timings
+        self.local.timings = None
+        self._observe('request_seconds', total, method=method)
+        self.count('requests_total', method=method, status=str(status))
+        totals = {}
+        order = []
+        for (phase, seconds) in timings:
+            if phase not in totals:
+                totals[phase] = 0.0
+                order.append(phase)
+            totals[phase] += seconds
+        rv = [ (phase, totals[phase]) for phase in order ]
+        rv.append(('total', total))
+        return rv
+
+    def phase(self, name):
+        """return a context manager timing a phase of the current request"""
+        return _Phase(self, name)
+
+    def observe(self, phase, seconds):
+        """record time spent in a phase"""
+        timings = getattr(self.local, 'timings', None)
+        if timings is not None:
+            timings.append((phase, seconds))
+        self._observe('phase_seconds', seconds, phase=phase)
+        return
+
+    def _observe(self, name, value, **labels):
+        key = tuple(sorted(labels.iteritems()))
+        with self.lock:
+            d = self.histograms.setdefault(name, {})
+            if key not in d:
+                d[key] = [[0] * len(buckets), 0.0, 0]
+            h = d[key]
+            for (i, bound) in enumerate(buckets):
+                if value <= bound:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+        return
+
+    def count(self, name, n=1, **labels):
+        """add n to a counter"""
+        key = tuple(sorted(labels.iteritems()))
+        with self.lock:
+            d = self.counters.setdefault(name, {})
+            d[key] = d.get(key, 0) + n
+        return
+
+    def render(self):
+        """render the metrics in the Prometheus text format"""
+        lines = []
+        with self.lock:
+            for name in sorted(self.descriptions):
+                (type, help) = self.descriptions[name]
+                full_name = '%s_%s' % (self.prefix, name)
+                lines.append('# HELP %s %s' % (full_name, help))
+                lines.append('# TYPE %s %s' % (full_name, type))
+                if type == 'counter':
+                    d = self.counters.get(name, {})
+                    for key in sorted(d):
+                        lines.append('%s%s %s' % (full_name,
+                                                  _labels(key),
+                                                  d[key]))
+                    continue
+                d = self.histograms.get(name, {})
+                for key in sorted(d):
+                    (counts, total, count) = d[key]
+                    for (bound, n) in zip(buckets, counts):
+                        le = (('le', repr(bound)), )
+                        lines.append('%s_bucket%s %d' % (full_name,
+                                                         _labels(key + le),
+                                                         n))
+                    le = (('le', '+Inf'), )
+                    lines.append('%s_bucket%s %d' % (full_name,
+                                                     _labels(key + le),
+                                                     count))
+                    lines.append('%s_sum%s %r' % (full_name,
+                                                  _labels(key),
+                                                  total))
+                    lines.append('%s_count%s %d' % (full_name,
+                                                    _labels(key),
+                                                    count))
+        return '\n'.join(lines) + '\n'
+
+def _labels(key):
+    if not key:
+        return ''
+    parts = []
+    for (label, value) in key:
+        value = value.replace('\\', '\\\\').replace('"', '\\"')
+        parts.append('%s="%s"' % (label, value))
+    return '{%s}' % ','.join(parts)
+
+def server_timing(timings):
+    """server_timing(timings) -> Server-Timing header value
+
+    timings is a list of (phase, seconds) as returned by
+    Metrics.end_request()
+    """
+    return ', '.join( '%s;dur=%.3f' % (phase, seconds * 1000)
+                      for (phase, seconds) in timings )
+
+# eof
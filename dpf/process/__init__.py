@@ -1,18 +1,138 @@
 # See file COPYING distributed with dpf for copyright and license.
 
 import os
+import errno
+import time
+import hashlib
 import traceback
 import tempfile
 import shutil
 import wsgiref
 import sqlite3
 import json
+import threading
+import Queue
+import urllib
+import urlparse
+import subprocess
 import dpf
+import dpf.db
+from dpf.process.handlers import process_exists, local_job_ddl, \
+                                  local_job_index_ddl
+from dpf.process.watcher import StatusWatcher
+from dpf.process.fetch import FetchCache, FetchError, FetchTooLarge
 
 db_ddl = """CREATE TABLE job (id TEXT NOT NULL PRIMARY KEY,
                               process TEXT NOT NULL,
                               deleted BOOLEAN NOT NULL DEFAULT 0);"""
 
+# launches not yet done: state is pending, error (the launch failed) or 
+# deleted (the job was deleted before the launch finished)
+launch_ddl = """CREATE TABLE IF NOT EXISTS launch 
+                (id TEXT NOT NULL PRIMARY KEY, 
+                 state TEXT NOT NULL DEFAULT 'pending', 
+                 owner INTEGER, 
+                 message TEXT)"""
+
+# deleted jobs not yet cleaned up; launched is false if the handler never 
+# launched the job, so only its directory needs removing
+reap_ddl = """CREATE TABLE IF NOT EXISTS reap 
+              (id TEXT NOT NULL PRIMARY KEY, 
+               process TEXT NOT NULL, 
+               launched BOOLEAN NOT NULL, 
+               owner INTEGER)"""
+
+# the job database schema version, kept in PRAGMA user_version
+db_version = 5
+
+# statements that bring the job database from each version to the next
+db_migrations = {
+    # job creation time, last known status and input size, for listing
+    0: ["ALTER TABLE job ADD COLUMN created REAL", 
+        "ALTER TABLE job ADD COLUMN status TEXT", 
+        "ALTER TABLE job ADD COLUMN size INTEGER", 
+        "CREATE INDEX job_created ON job (deleted, created, id)", 
+        """CREATE INDEX job_process_created 
+           ON job (process, deleted, created, id)""", 
+        """CREATE INDEX job_status_created 
+           ON job (status, deleted, created, id)"""], 
+    # the hash of the process, content type and input of memoized jobs
+    1: ["ALTER TABLE job ADD COLUMN memo_key TEXT", 
+        "CREATE INDEX job_memo_key ON job (memo_key)"], 
+    # pipelines: spec is the stages and input as given (JSON) and jobs 
+    # is the list of stage jobs created so far (JSON)
+    2: ["""CREATE TABLE pipeline (id TEXT NOT NULL PRIMARY KEY, 
+                                  created REAL NOT NULL, 
+                                  spec TEXT NOT NULL, 
+                                  jobs TEXT NOT NULL, 
+                                  state TEXT NOT NULL, 
+                                  owner INTEGER, 
+                                  message TEXT)"""], 
+    # when jobs were deleted, so deleted jobs can be purged
+    3: ["ALTER TABLE job ADD COLUMN deleted_time REAL", 
+        "CREATE INDEX job_deleted_time ON job (deleted_time)", 
+        """UPDATE job SET deleted_time = CAST(strftime('%s', 'now') AS REAL) 
+            WHERE deleted"""], 
+    # launches, deletions and local pool jobs; servers before version 5 
+    # created these tables on startup, so they may already exist
+    4: [launch_ddl, reap_ddl, local_job_ddl, local_job_index_ddl], 
+}
+
+# how many earlier jobs with the same input are checked for one that 
+# has completed
+max_memo_candidates = 10
+
+# how often (in seconds) each server process looks for work left by 
+# processes that have gone
+recover_interval = 5
+
+# the most jobs cleaned up at once (and so given to one qdel)
+reap_batch = 100
+
+text_or_json = dpf.MediaTypes(['text/plain', 'application/json'])
+event_stream = dpf.MediaTypes(['text/event-stream'])
+
+# statuses that don't change
+final_statuses = ('completed', 'error', 'deleted', None)
+
+# the longest a GET /job/<id>?wait=<seconds> waits
+max_wait = 60
+
+# seconds between keepalive comments in an idle event stream
+event_keepalive = 15
+
+# the default and largest number of jobs in a page of GET /job/
+list_limit = 100
+max_list_limit = 1000
+
+# the most job statuses a page of GET /job/ looks up with their handlers
+max_list_refreshes = 20
+
+class PipelineError(Exception):
+    """a pipeline stage failed"""
+
+def link_or_copy(source, dest):
+    """hardlink source to dest, or copy it if it can't be linked"""
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+    return
+
+def remove_dirs(dirs):
+    """remove directories and their contents at idle I/O priority (if 
+    ionice is available), so cleaning up doesn't slow down running jobs
+    """
+    try:
+        po = subprocess.Popen(['ionice', '-c', '3', 'rm', '-rf', '--'] + dirs)
+        po.wait()
+    except OSError, exc:
+        if exc.errno != errno.ENOENT:
+            raise
+    for dir in dirs:
+        shutil.rmtree(dir, True)
+    return
+
 def sqlite_convert_boolean(i):
     if i == '1':
         return True
@@ -28,7 +148,85 @@ sqlite3.register_converter('boolean', sqlite_convert_boolean)
 
 class Application(dpf.Application):
 
-    def __init__(self, base_dir, process_handlers):
+    def __init__(self, 
+                 base_dir, 
+                 process_handlers, 
+                 db_synchronous='NORMAL', 
+                 db_busy_timeout=60, 
+                 async_launch=False, 
+                 launch_threads=4, 
+                 watch_interval=1, 
+                 max_input_size=None, 
+                 memoize=(), 
+                 data_servers=None, 
+                 fetch_cache_size=None, 
+                 purge_deleted=None, 
+                 max_waiters=None):
+        """create the application
+
+        base_dir is the directory in which jobs are stored.
+
+        process_handlers is a dictionary mapping process labels to 
+        process handlers.
+
+        The job database is used through a connection per thread (see 
+        dpf.db); db_synchronous and db_busy_timeout are its synchronous 
+        setting and busy timeout in seconds.
+
+        If async_launch is true, a POST registers the job, validates the 
+        data and returns 202 without waiting for the handler's launch, 
+        which is done by one of launch_threads background threads.  
+        Until it is done the job's status is queued; if it fails the 
+        status is error.  A pre-forked worker that stops hands back the 
+        launches it hasn't started, and every recover_interval seconds 
+        each server process takes over launches left by processes that 
+        have gone.  A launch interrupted part way (by a crash) isn't 
+        repeated if the handler can tell that it happened (see 
+        BaseProcessHandler.launched()); if the handler can't tell, the 
+        job's status becomes error.
+
+        Clients waiting for job status changes (GET /job/<id>?wait=<seconds> 
+        and the event stream at /job/<id>/events) share one status 
+        poller, which checks each watched job every watch_interval 
+        seconds.  Each waiting client holds a server thread, so 
+        max_waiters (if it is not None) limits how many may wait at once 
+        in each server process; beyond it, a wait returns the job's 
+        status at once and an event stream gets 503 Service Unavailable.  
+        It should leave threads free for other requests: 
+        dpf_process_server sets it to one less than the number of 
+        threads, so a single-threaded server doesn't wait at all.
+
+        max_input_size is the largest job input (POST body) accepted, in 
+        bytes, or None for no limit.  Larger inputs get 413 Request 
+        Entity Too Large before any of the body is read.
+
+        memoize lists the labels of processes whose results are reused.  
+        A job for one of these is not launched if there is a completed, 
+        undeleted job for the same process with the same content type 
+        and input; the response is instead 303 See Other, pointing to 
+        that job (so deleting it deletes it for every client that gets 
+        it).  A Cache-Control: no-cache request header forces a new job.
+
+        data_servers maps the base URLs of data servers to their base 
+        directories (or None).  If it is given, a job's input can be the 
+        URL of a dataset on one of these servers, POSTed as 
+        text/uri-list; the job's data is then the dataset (with its 
+        content type), fetched through a cache shared by all jobs (see 
+        dpf.process.fetch).  max_input_size applies to the dataset (a 
+        larger one isn't fetched beyond the limit), and memoized jobs are 
+        reused only for the same version of it.  fetch_cache_size limits 
+        the total size of the fetched data kept in the cache, in bytes 
+        (None for no limit).
+
+        Deleting a job marks it deleted and returns; a background thread 
+        in each server process then deletes the jobs with their handlers 
+        (in batches, see BaseProcessHandler.delete_jobs()) and removes 
+        their directories; cleanups left by a process that has gone are 
+        taken over within recover_interval seconds.  Jobs deleted more 
+        than purge_deleted seconds ago are removed from the job database 
+        (after which requests for them get 404 rather than 410); if 
+        purge_deleted is None, they are kept.
+        """
         self.base_dir = base_dir
         self.process_handlers = {}
         for (label, ph) in process_handlers.iteritems():
@@ -42,6 +240,310 @@ class Application(dpf.Application):
             c.close()
             db.commit()
             db.close()
+        self.migrate_db()
+        self.db_pool = dpf.db.ConnectionPool(self.db_fname, 
+                                             db_synchronous, 
+                                             db_busy_timeout, 
+                                             sqlite3.PARSE_DECLTYPES)
+        self.async_launch = async_launch
+        self.launch_threads = int(launch_threads)
+        self.launch_queue = None
+        self.launch_pool = []
+        self.status_watcher = StatusWatcher(float(watch_interval))
+        self.max_input_size = max_input_size
+        self.memoize = set( label.strip('/') for label in memoize )
+        if data_servers:
+            fetch_dir = os.path.join(self.base_dir, 'fetch')
+            self.fetch_cache = FetchCache(fetch_dir, 
+                                          data_servers, 
+                                          fetch_cache_size, 
+                                          max_input_size)
+        else:
+            self.fetch_cache = None
+        self.purge_deleted = purge_deleted
+        if max_waiters is None:
+            self.waiters = None
+        else:
+            self.waiters = threading.Semaphore(max_waiters)
+        self.reap_queue = None
+        return
+
+    def migrate_db(self):
+        """bring the job database schema up to date"""
+        db = sqlite3.connect(self.db_fname, isolation_level=None)
+        try:
+            # the write lock keeps other processes from migrating too
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                version = db.execute('PRAGMA user_version').fetchone()[0]
+                while version < db_version:
+                    for statement in db_migrations[version]:
+                        db.execute(statement)
+                    if version == 0:
+                        self._fill_job_columns(db)
+                    version += 1
+                db.execute('PRAGMA user_version = %d' % version)
+            except:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+        return
+
+    def _fill_job_columns(self, db):
+        """fill in the creation times and input sizes of existing jobs 
+        from their job directories
+        """
+        for (ident, ) in db.execute('SELECT id FROM job').fetchall():
+            job_dir = os.path.join(self.base_dir, ident)
+            try:
+                created = os.stat(job_dir).st_mtime
+            except OSError:
+                created = 0
+            try:
+                size = os.stat(os.path.join(job_dir, 'data')).st_size
+            except OSError:
+                size = None
+            db.execute('UPDATE job SET created = ?, size = ? WHERE id = ?', 
+                       (created, size, ident))
+        return
+
+    def start(self):
+        for (label, ph) in self.process_handlers.iteritems():
+            ph.start(self, label)
+        if self.async_launch:
+            self.launch_queue = Queue.Queue()
+            for i in xrange(self.launch_threads):
+                t = threading.Thread(target=self._launch_jobs)
+                t.daemon = True
+                t.start()
+                self.launch_pool.append(t)
+            self._recover_launches()
+        self._recover_pipelines()
+        self.reap_queue = Queue.Queue()
+        t = threading.Thread(target=self._reap_jobs)
+        t.daemon = True
+        t.start()
+        self.wake_reaper()
+        t = threading.Thread(target=self._recover)
+        t.daemon = True
+        t.start()
+        return
+
+    def stop(self):
+        """hand back the launches not yet started and finish the ones 
+        in progress
+        """
+        if self.launch_queue is None:
+            return
+        idents = []
+        try:
+            while True:
+                idents.append(self.launch_queue.get_nowait())
+        except Queue.Empty:
+            pass
+        with self.db_pool.transaction() as db:
+            db.executemany("""UPDATE launch SET owner = NULL 
+                               WHERE id = ? AND owner = ?""", 
+                           [ (ident, os.getpid()) for ident in idents ])
+        for t in self.launch_pool:
+            self.launch_queue.put(None)
+        for t in self.launch_pool:
+            t.join()
+        return
+
+    def _recover(self):
+        """periodically take over the work of processes that have gone"""
+        while True:
+            time.sleep(recover_interval)
+            try:
+                if self.async_launch:
+                    self._recover_launches()
+                self._recover_pipelines()
+                # the reaper takes over cleanups when it wakes
+                self.wake_reaper()
+            except:
+                traceback.print_exc()
+        return
+
+    def _recover_launches(self):
+        """take over the pending launches of processes that have gone 
+        (or that handed them back)
+        """
+        db = self.db_pool.connection()
+        c = db.execute("""SELECT id, owner FROM launch 
+                           WHERE state IN ('pending', 'deleted')""")
+        rows = c.fetchall()
+        c.close()
+        for (ident, owner) in rows:
+            if owner == os.getpid():
+                continue
+            if owner is not None and process_exists(owner):
+                continue
+            with self.db_pool.transaction() as db:
+                c = db.execute("""UPDATE launch SET owner = ? 
+                                   WHERE id = ? AND owner IS ?""", 
+                               (os.getpid(), ident, owner))
+                claimed = c.rowcount
+            if claimed:
+                self.launch_queue.put(ident)
+        return
+
+    def _launch_jobs(self):
+        while True:
+            ident = self.launch_queue.get()
+            if ident is None:
+                break
+            try:
+                self._launch_job(ident)
+            except:
+                traceback.print_exc()
+        return
+
+    def _launch_job(self, ident):
+        job_dict = self.get_job(ident)
+        ph = self.process_handlers[job_dict['process']]
+        job_dir = os.path.join(self.base_dir, ident)
+        launched = False
+        message = None
+        if job_dict['launch_state'] == 'pending':
+            attempted_fname = os.path.join(job_dir, 'launch_attempted')
+            if os.path.exists(attempted_fname):
+                # an earlier launch was interrupted, perhaps once it was 
+                # done
+                launched = ph.launched(job_dir)
+            if launched is None:
+                # rather than risk running the job twice
+                launched = False
+                message = 'launch interrupted'
+            elif not launched:
+                try:
+                    open(attempted_fname, 'w').close()
+                    ph.launch(job_dir)
+                    launched = True
+                except dpf.BaseHTTPError, exc:
+                    message = exc.content.strip() or exc.status
+                except Exception, exc:
+                    traceback.print_exc()
+                    message = str(exc) or exc.__class__.__name__
+        with self.db_pool.transaction() as db:
+            if launched:
+                c = db.execute("""DELETE FROM launch 
+                                   WHERE id = ? AND state = 'pending'""", 
+                               (ident, ))
+            else:
+                c = db.execute("""UPDATE launch SET state = 'error', 
+                                                    message = ? 
+                                   WHERE id = ? AND state = 'pending'""", 
+                               (message, ident))
+                db.execute("UPDATE job SET status = 'error' WHERE id = ?", 
+                           (ident, ))
+            done = c.rowcount
+        if not done:
+            # deleted while pending
+            with self.db_pool.transaction() as db:
+                db.execute("DELETE FROM launch WHERE id = ?", (ident, ))
+                self.queue_reap(db, ident, job_dict['process'], launched)
+            self.wake_reaper()
+        return
+
+    def queue_reap(self, db, ident, process, launched):
+        """queue a deleted job to be cleaned up by this process's reaper
+
+        db is the connection of the transaction deleting the job; the 
+        caller calls wake_reaper() once it commits
+        """
+        db.execute("""INSERT OR REPLACE INTO reap 
+                      (id, process, launched, owner) 
+                      VALUES (?, ?, ?, ?)""", 
+                   (ident, process, launched, os.getpid()))
+        return
+
+    def wake_reaper(self):
+        """have the reaper clean up the jobs queued so far
+
+        without a reaper (if start() hasn't been called), they are 
+        cleaned up by a running server once this process has gone
+        """
+        if self.reap_queue is not None:
+            self.reap_queue.put(None)
+        return
+
+    def _recover_reaps(self):
+        """take over the cleanups of processes that have gone"""
+        db = self.db_pool.connection()
+        c = db.execute("SELECT DISTINCT owner FROM reap")
+        owners = [ row[0] for row in c.fetchall() ]
+        c.close()
+        for owner in owners:
+            if owner != os.getpid() and process_exists(owner):
+                continue
+            with self.db_pool.transaction() as db:
+                db.execute("UPDATE reap SET owner = ? WHERE owner = ?", 
+                           (os.getpid(), owner))
+        return
+
+    def _reap_jobs(self):
+        while True:
+            self.reap_queue.get()
+            # everything queued so far is done in this round
+            try:
+                while True:
+                    self.reap_queue.get_nowait()
+            except Queue.Empty:
+                pass
+            try:
+                self._recover_reaps()
+                while self._reap():
+                    pass
+                self.purge()
+            except:
+                traceback.print_exc()
+        return
+
+    def _reap(self):
+        """clean up a batch of this process's deleted jobs, returning the 
+        number cleaned up
+        """
+        db = self.db_pool.connection()
+        c = db.execute("""SELECT id, process, launched FROM reap 
+                           WHERE owner = ? 
+                           LIMIT ?""", 
+                       (os.getpid(), reap_batch))
+        rows = c.fetchall()
+        c.close()
+        job_dirs = {}
+        for (ident, process, launched) in rows:
+            if launched:
+                job_dir = os.path.join(self.base_dir, ident)
+                job_dirs.setdefault(process, []).append(job_dir)
+        for (process, dirs) in job_dirs.iteritems():
+            ph = self.process_handlers.get(process)
+            if ph is None:
+                continue
+            try:
+                ph.delete_jobs(dirs)
+            except:
+                traceback.print_exc()
+        remove_dirs([ os.path.join(self.base_dir, row[0]) for row in rows ])
+        with self.db_pool.transaction() as db:
+            db.executemany("DELETE FROM reap WHERE id = ?", 
+                           [ (row[0], ) for row in rows ])
+        return len(rows)
+
+    def purge(self):
+        """remove jobs deleted more than purge_deleted seconds ago (and 
+        cleaned up) from the job database
+        """
+        if self.purge_deleted is None:
+            return
+        with self.db_pool.transaction() as db:
+            db.execute("""DELETE FROM job 
+                           WHERE deleted_time < ? 
+                             AND id NOT IN (SELECT id FROM reap) 
+                             AND id NOT IN (SELECT id FROM launch)""", 
+                       (time.time() - self.purge_deleted, ))
         return
 
     def __call__(self, environ, start_response):
@@ -51,6 +553,12 @@ class Application(dpf.Application):
                 path = '/'
             if path == '/':
                 (status, headers, oi) = self.handle_root(environ)
+            elif path in ('/job', '/job/'):
+                (status, headers, oi) = self.handle_job_list(environ)
+            elif path in ('/pipeline', '/pipeline/'):
+                (status, headers, oi) = self.handle_pipeline_post(environ)
+            elif path.startswith('/pipeline/'):
+                (status, headers, oi) = self.handle_pipeline(environ)
             elif path.startswith('/job/'):
                 (status, headers, oi) = self.handle_job(environ)
             else:
@@ -75,8 +583,7 @@ class Application(dpf.Application):
     def handle_root(self, environ):
 
         if environ['REQUEST_METHOD'] == 'GET':
-            mt = dpf.choose_media_type(dpf.get_accept(environ), 
-                                       ['text/plain', 'application/json'])
+            mt = dpf.choose_media_type(dpf.get_accept(environ), text_or_json)
             if mt == 'text/plain':
                 output = 'Available:\n'
                 for label in sorted(self.process_handlers):
@@ -128,29 +635,231 @@ class Application(dpf.Application):
             if 'CONTENT_TYPE' not in environ:
                 raise dpf.HTTP400BadRequest('text/plain', 'No content-type.\n')
 
-            data = environ['wsgi.input'].read(content_length)
+            if self.max_input_size is not None and \
+               content_length > self.max_input_size:
+                msg = 'Input larger than %d bytes.\n' % self.max_input_size
+                raise dpf.HTTP413RequestEntityTooLarge('text/plain', msg)
+
+            ct = environ['CONTENT_TYPE']
+            if process_name in self.memoize:
+                h = hashlib.sha256('%s\0%s\0' % (process_name, ct))
+            else:
+                h = None
+            app_uri = wsgiref.util.application_uri(environ).rstrip('/')
 
             job_dir = tempfile.mkdtemp(prefix='', dir=self.base_dir)
             try:
                 ident = os.path.basename(job_dir)
-                open(os.path.join(job_dir, 'data'), 'w').write(data)
-                if 'CONTENT_TYPE' in environ:
-                    ct = environ['CONTENT_TYPE']
-                    open(os.path.join(job_dir, 'content-type'), 'w').write(ct)
-                ph.launch(job_dir)
+                # the body is written as it arrives, so memory use doesn't 
+                # depend on its size
+                data_fname = os.path.join(job_dir, 'data')
+                with open(data_fname, 'wb') as fo:
+                    for data in dpf.input_chunks(environ, content_length):
+                        fo.write(data)
+                        if h is not None:
+                            h.update(data)
+                size = content_length
+                if self.fetch_cache and \
+                   ct.split(';')[0].strip().lower() == 'text/uri-list':
+                    (ct, etag) = self.fetch_input(job_dir)
+                    size = os.path.getsize(data_fname)
+                    if self.max_input_size is not None and \
+                       size > self.max_input_size:
+                        msg = 'Input larger than %d bytes.\n' % \
+                              self.max_input_size
+                        raise dpf.HTTP413RequestEntityTooLarge('text/plain', 
+                                                               msg)
+                    if h is not None:
+                        if etag is None:
+                            h = None
+                        else:
+                            h.update('\0%s' % etag)
+                open(os.path.join(job_dir, 'content-type'), 'w').write(ct)
+                ph.validate(job_dir)
+                if h is None:
+                    memo_key = None
+                else:
+                    memo_key = h.hexdigest()
+                    cache_control = environ.get('HTTP_CACHE_CONTROL', '')
+                    directives = [ d.strip().lower() 
+                                   for d in cache_control.split(',') ]
+                    if 'no-cache' not in directives:
+                        memo_ident = self.find_memo_job(memo_key)
+                        if memo_ident is not None:
+                            shutil.rmtree(job_dir)
+                            url = '%s/job/%s' % (app_uri, memo_ident)
+                            headers = [('Location', url), 
+                                       ('Content-Length', '0')]
+                            return ('303 See Other', headers, [''])
+                if self.async_launch:
+                    self.register_job(ident, 
+                                      process_name, 
+                                      size, 
+                                      memo_key, 
+                                      True)
+                else:
+                    ph.launch(job_dir)
             except:
-                shutil.rmtree(job_dir)
+                shutil.rmtree(job_dir, True)
                 raise
 
-            self.register_job(ident, process_name)
-
-            app_uri = wsgiref.util.application_uri(environ).rstrip('/')
             headers = [('Location', '%s/job/%s' % (app_uri, ident)), 
                        ('Content-Length', '0')]
+
+            if self.async_launch:
+                self.launch_queue.put(ident)
+                return ('202 Accepted', headers, [''])
+
+            self.register_job(ident, process_name, size, memo_key)
+
             return ('201 Created', headers, [''])
 
         raise dpf.HTTP405MethodNotAllowed(['GET', 'POST'])
 
+    def fetch_input(self, job_dir):
+        """replace a job's data (a text/uri-list) with the data at the URL
+
+        the URL is kept in the job directory, in the file url
+
+        returns (content type, entity tag) for the fetched data
+        """
+        data_fname = os.path.join(job_dir, 'data')
+        urls = [ line.strip() for line in open(data_fname) 
+                 if line.strip() and not line.startswith('#') ]
+        if len(urls) != 1:
+            msg = 'text/uri-list input must contain one URL.\n'
+            raise dpf.HTTP400BadRequest('text/plain', msg)
+        try:
+            rv = self.fetch_cache.fetch(urls[0], data_fname)
+        except FetchTooLarge:
+            msg = 'Input larger than %d bytes.\n' % self.max_input_size
+            raise dpf.HTTP413RequestEntityTooLarge('text/plain', msg)
+        except FetchError, exc:
+            msg = "Can't fetch input: %s\n" % str(exc)
+            raise dpf.HTTP400BadRequest('text/plain', msg)
+        open(os.path.join(job_dir, 'url'), 'w').write(urls[0] + '\n')
+        return rv
+
+    def handle_job_list(self, environ):
+
+        """list jobs, newest first
+
+        The query string may give:
+
+            process: only jobs of this process
+            status: only jobs with this last known status
+            created_after, created_before: only jobs created in this 
+                range (in seconds since the epoch)
+            deleted: 1 to list deleted jobs instead of current ones
+            limit: the number of jobs in a page (default 100, at most 1000)
+            after: where the page starts, from the previous page's next 
+                link
+
+        The statuses of up to max_list_refreshes of the listed jobs 
+        (newest first) are brought up to date, and the rest are the last 
+        known statuses.  Jobs whose handlers don't track statuses (see 
+        BaseProcessHandler.tracks_status) aren't looked up.  The status 
+        filter uses the last known status, which is only updated when a 
+        job's status is checked.
+        """
+
+        if environ['REQUEST_METHOD'] != 'GET':
+            raise dpf.HTTP405MethodNotAllowed(['GET'])
+
+        mt = dpf.choose_media_type(dpf.get_accept(environ), text_or_json)
+
+        query = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+        params = {}
+        for (name, param_values) in query.iteritems():
+            params[name] = param_values[0]
+
+        def bad_request(msg):
+            return dpf.HTTP400BadRequest('text/plain', msg + '\n')
+
+        where = ['deleted = ?']
+        values = [params.get('deleted', '0') == '1']
+        if params.get('deleted', '0') not in ('0', '1'):
+            raise bad_request('Bad deleted value.')
+        for name in ('process', 'status'):
+            if name in params:
+                where.append('%s = ?' % name)
+                values.append(params[name])
+        for (name, op) in (('created_after', '>='), ('created_before', '<')):
+            if name in params:
+                try:
+                    values.append(float(params[name]))
+                except ValueError:
+                    raise bad_request('Bad %s value.' % name)
+                where.append('created %s ?' % op)
+        if 'after' in params:
+            try:
+                (created, ident) = params['after'].split(',', 1)
+                created = float(created)
+            except ValueError:
+                raise bad_request('Bad after value.')
+            # the first term lets the created index find the start
+            where.append('created <= ? AND (created < ? OR id < ?)')
+            values.extend([created, created, ident])
+        try:
+            limit = int(params.get('limit', list_limit))
+        except ValueError:
+            raise bad_request('Bad limit value.')
+        if not 0 < limit <= max_list_limit:
+            raise bad_request('Bad limit value.')
+
+        db = self.db_pool.connection()
+        c = db.execute("""SELECT id, process, created, status, size 
+                            FROM job 
+                           WHERE %s 
+                           ORDER BY created DESC, id DESC 
+                           LIMIT ?""" % ' AND '.join(where), 
+                       values + [limit + 1])
+        rows = c.fetchall()
+        c.close()
+
+        app_uri = wsgiref.util.application_uri(environ).rstrip('/')
+        jobs = []
+        n_refreshes = 0
+        for (ident, process, created, status, size) in rows[:limit]:
+            if status is None or status not in final_statuses:
+                ph = self.process_handlers.get(process)
+                if ph is not None and \
+                   ph.tracks_status and \
+                   n_refreshes < max_list_refreshes:
+                    status = self.get_job_status(ident)
+                    n_refreshes += 1
+            jobs.append({'id': ident, 
+                         'url': '%s/job/%s' % (app_uri, ident), 
+                         'process': process, 
+                         'created': created, 
+                         'status': status, 
+                         'size': size})
+
+        headers = []
+        if len(rows) > limit:
+            (ident, process, created, status, size) = rows[limit - 1]
+            params['after'] = '%r,%s' % (created, ident)
+            query_string = urllib.urlencode(sorted(params.items()))
+            next_url = '%s/job/?%s' % (app_uri, query_string)
+            headers.append(('Link', '<%s>; rel="next"' % next_url))
+        else:
+            next_url = None
+
+        if mt == 'text/plain':
+            output = 'Jobs:\n'
+            for job in jobs:
+                output += '    %(id)s: %(process)s, %(status)s\n' % job
+            if next_url:
+                output += 'Next: %s\n' % next_url
+            # identifiers come from the database as unicode
+            output = output.encode('utf-8')
+        else:
+            output = json.dumps({'jobs': jobs, 'next': next_url}) + '\n'
+        headers.extend([('Content-Type', mt), 
+                        ('Content-Length', str(len(output)))])
+
+        return ('200 OK', headers, [output])
+
     def handle_job(self, environ):
 
         assert environ['PATH_INFO'].startswith('/job/')
@@ -164,9 +873,28 @@ class Application(dpf.Application):
         if job_dict['deleted']:
             raise dpf.HTTP410Gone()
 
+        job_url = '/job/%s' % ident
+
+        if environ['REQUEST_METHOD'] == 'GET':
+            if environ['PATH_INFO'] == job_url + '/events':
+                return self.handle_job_events(environ, ident)
+            query = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+            if 'wait' in query:
+                try:
+                    wait = float(query['wait'][0])
+                except ValueError:
+                    raise dpf.HTTP400BadRequest('text/plain', 
+                                                'Bad wait value.\n')
+                self.wait_for_job(ident, min(wait, max_wait))
+                job_dict = self.get_job(ident)
+                if job_dict['deleted']:
+                    raise dpf.HTTP410Gone()
+
         ph = self.process_handlers[job_dict['process']]
         job_dir = os.path.join(self.base_dir, ident)
-        job_url = '/job/%s' % ident
+
+        if job_dict['launch_state'] is not None:
+            return self.handle_unlaunched_job(environ, job_dict)
 
         if environ['REQUEST_METHOD'] == 'GET':
 
@@ -181,6 +909,10 @@ class Application(dpf.Application):
                 return ('200 OK', headers, oi)
 
             subpath = environ['PATH_INFO'][len(job_url)+1:]
+            rv = ph.get_subpart_file(accept, job_dir, subpath)
+            if rv is not None:
+                (content_type, fname) = rv
+                return self.handle_output_file(environ, fname, content_type)
             (content_type, content) = ph.get_subpart(accept, job_dir, subpath)
             headers = [('Content-Type', content_type), 
                        ('Content-Length', str(len(content)))]
@@ -190,63 +922,563 @@ class Application(dpf.Application):
 
             if environ['PATH_INFO'] == job_url or \
                environ['PATH_INFO'] == job_url+'/':
-                self.delete_job(ident)
-                ph.delete(job_dir)
-                shutil.rmtree(job_dir)
+                # the job is cleaned up in the background
+                self.delete_job(ident, True)
                 return ('204 No Content', [], [''])
 
             subpath = environ['PATH_INFO'][len(job_url)+1:]
 
             # we just use this to raise the 404 if the subpart doesn't exist; 
             # if it does...
-            ph.get_subpart(dpf.get_accept(environ), job_dir, subpath)
+            accept = dpf.get_accept(environ)
+            if ph.get_subpart_file(accept, job_dir, subpath) is None:
+                ph.get_subpart(accept, job_dir, subpath)
 
             # ...fall through to method not allowed
             raise dpf.HTTP405MethodNotAllowed(['GET'])
 
         raise dpf.HTTP405MethodNotAllowed(['GET', 'DELETE'])
 
-    def register_job(self, ident, process):
-        db = sqlite3.connect(self.db_fname, 
-                             detect_types=sqlite3.PARSE_DECLTYPES)
+    def handle_output_file(self, environ, fname, content_type):
+        """respond with the contents of a subpart file, which may still be 
+        growing
+
+        ?offset=<n> gives the bytes from n to the current end of the 
+        file, so clients can follow the output of a running job by 
+        adding the length of each response to the offset.  Otherwise a 
+        Range header is handled by dpf.file_response().  Only the bytes 
+        in the file when the request arrives are sent.
+        """
+        query = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+        offset = None
+        if 'offset' in query:
+            try:
+                offset = int(query['offset'][0])
+                if offset < 0:
+                    raise ValueError()
+            except ValueError:
+                raise dpf.HTTP400BadRequest('text/plain', 'Bad offset.\n')
+        elif 'HTTP_RANGE' in environ and os.path.exists(fname):
+            return dpf.file_response(environ, fname, content_type)
         try:
-            c = db.cursor()
-            c.execute("INSERT INTO job (id, process) VALUES (?, ?)", 
-                      (ident, process))
-            c.close()
-            db.commit()
+            fo = open(fname, 'rb')
+        except IOError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            headers = [('Content-Type', content_type), 
+                       ('Content-Length', '0')]
+            return ('200 OK', headers, [''])
+        size = os.fstat(fo.fileno()).st_size
+        start = min(offset or 0, size)
+        headers = [('Content-Type', content_type), 
+                   ('Content-Length', str(size - start))]
+        return ('200 OK', headers, dpf.file_iterator(environ, 
+                                                     fo, 
+                                                     start, 
+                                                     size - start))
+
+    def handle_job_events(self, environ, ident):
+        dpf.choose_media_type(dpf.get_accept(environ), event_stream)
+        if not self._start_waiting():
+            msg = 'No server threads free for event streams.\n'
+            raise dpf.HTTP503ServiceUnavailable('text/plain', msg)
+        headers = [('Content-Type', 'text/event-stream'), 
+                   ('Cache-Control', 'no-cache')]
+        return ('200 OK', headers, self.job_events(ident))
+
+    def job_events(self, ident):
+        """generate the server-sent events for job ident: its status, then 
+        each change of status until it is final
+
+        the caller must have called _start_waiting()
+        """
+        try:
+            get_status = lambda: self.get_job_status(ident)
+            status = get_status()
+            while True:
+                data = json.dumps({'job_status': status})
+                yield 'event: status\ndata: %s\n\n' % data
+                if status in final_statuses:
+                    break
+                while True:
+                    new_status = self.status_watcher.wait(ident, 
+                                                          get_status, 
+                                                          status, 
+                                                          event_keepalive)
+                    if new_status != status:
+                        break
+                    yield ': keepalive\n\n'
+                status = new_status
         finally:
-            db.close()
+            self._stop_waiting()
+        return
+
+    def wait_for_job(self, ident, timeout):
+        """wait up to timeout seconds for the status of job ident to 
+        change, if it can (see max_waiters)
+        """
+        get_status = lambda: self.get_job_status(ident)
+        status = get_status()
+        if status in final_statuses or not self._start_waiting():
+            return
+        try:
+            self.status_watcher.wait(ident, get_status, status, timeout)
+        finally:
+            self._stop_waiting()
+        return
+
+    def _start_waiting(self):
+        """take a waiter slot, returning False if none is free"""
+        if self.waiters is None:
+            return True
+        return self.waiters.acquire(False)
+
+    def _stop_waiting(self):
+        if self.waiters is not None:
+            self.waiters.release()
+        return
+
+    def get_job_status(self, ident):
+        """return the status of job ident (queued, running, completed, 
+        error or deleted), or None if its handler doesn't track it
+        """
+        job_dict = self.get_job(ident)
+        if job_dict['deleted'] or job_dict['launch_state'] == 'deleted':
+            return 'deleted'
+        if job_dict['launch_state'] == 'pending':
+            return 'queued'
+        if job_dict['launch_state'] == 'error':
+            return 'error'
+        ph = self.process_handlers[job_dict['process']]
+        # handlers only report final statuses they are sure of (see 
+        # BaseProcessHandler.get_status()), so these are safe to record
+        status = ph.get_status(os.path.join(self.base_dir, ident))
+        if status is not None and status != job_dict['status']:
+            with self.db_pool.transaction() as db:
+                db.execute("UPDATE job SET status = ? WHERE id = ?", 
+                           (status, ident))
+        return status
+
+    def handle_unlaunched_job(self, environ, job_dict):
+        """handle a request for a job whose launch is pending or failed"""
+
+        ident = job_dict['id']
+        job_url = '/job/%s' % ident
+        is_job = environ['PATH_INFO'] in (job_url, job_url + '/')
+
+        if environ['REQUEST_METHOD'] == 'GET':
+            if not is_job:
+                raise dpf.HTTP404NotFound()
+            if job_dict['launch_state'] == 'pending':
+                d = {'job_status': 'queued'}
+            else:
+                d = {'job_status': 'error', 
+                     'error': job_dict['launch_message']}
+            mt = dpf.choose_media_type(dpf.get_accept(environ), text_or_json)
+            if mt == 'text/plain':
+                output = ''
+                for key in ('job_status', 'error'):
+                    if key in d:
+                        output += '%s: %s\n' % (key, d[key])
+            else:
+                output = json.dumps(d)
+            headers = [('Content-Type', mt), 
+                       ('Content-Length', str(len(output)))]
+            return ('200 OK', headers, [output])
+
+        if environ['REQUEST_METHOD'] == 'DELETE':
+            if not is_job:
+                raise dpf.HTTP404NotFound()
+            with self.db_pool.transaction() as db:
+                self._delete_job(db, ident)
+                c = db.execute("""UPDATE launch SET state = 'deleted' 
+                                   WHERE id = ? AND state = 'pending'""", 
+                               (ident, ))
+                pending = c.rowcount
+                # a pending job is cleaned up when its launch finishes
+                if not pending:
+                    db.execute("DELETE FROM launch WHERE id = ?", (ident, ))
+                    self.queue_reap(db, ident, job_dict['process'], False)
+            if not pending:
+                self.wake_reaper()
+            return ('204 No Content', [], [''])
+
+        raise dpf.HTTP405MethodNotAllowed(['GET', 'DELETE'])
+
+    def find_memo_job(self, memo_key):
+        """return the ident of the newest completed, undeleted job with 
+        memo_key, or None if there is none
+        """
+        db = self.db_pool.connection()
+        c = db.execute("""SELECT id FROM job 
+                           WHERE memo_key = ? AND deleted = 0 
+                             AND (status IS NULL 
+                                  OR status NOT IN ('error', 'deleted')) 
+                           ORDER BY created DESC 
+                           LIMIT ?""", 
+                       (memo_key, max_memo_candidates))
+        rows = c.fetchall()
+        c.close()
+        for (ident, ) in rows:
+            # the last known status is only a hint: the handler confirms 
+            # the job has completed
+            if self.get_job_status(ident) == 'completed':
+                return str(ident)
+        return None
+
+    def register_job(self, 
+                     ident, 
+                     process, 
+                     size, 
+                     memo_key=None, 
+                     pending_launch=False):
+        if pending_launch:
+            status = 'queued'
+        else:
+            status = None
+        with self.db_pool.transaction() as db:
+            db.execute("""INSERT INTO job 
+                          (id, process, created, status, size, memo_key) 
+                          VALUES (?, ?, ?, ?, ?, ?)""", 
+                       (ident, process, time.time(), status, size, memo_key))
+            if pending_launch:
+                db.execute("INSERT INTO launch (id, owner) VALUES (?, ?)", 
+                           (ident, os.getpid()))
         return
 
     def get_job(self, ident):
-        db = sqlite3.connect(self.db_fname, 
-                             detect_types=sqlite3.PARSE_DECLTYPES)
+        db = self.db_pool.connection()
+        c = db.execute("""SELECT job.*, 
+                                 launch.state AS launch_state, 
+                                 launch.message AS launch_message 
+                            FROM job LEFT JOIN launch ON launch.id = job.id 
+                           WHERE job.id = ?""", 
+                       (ident, ))
         try:
-            c = db.cursor()
-            c.execute("SELECT * FROM job WHERE id = ?", (ident, ))
             cols = [ el[0] for el in c.description ]
             row = c.fetchone()
-            if not row:
-                raise ValueError('no job %s in database' % ident)
-            d = dict(zip(cols, row))
-            c.close()
         finally:
-            db.close()
-        return d
+            c.close()
+        if not row:
+            raise ValueError('no job %s in database' % ident)
+        return dict(zip(cols, row))
 
-    def delete_job(self, ident):
-        db = sqlite3.connect(self.db_fname, 
-                             detect_types=sqlite3.PARSE_DECLTYPES)
+    def create_job(self, process_name, content_type, write_input):
+        """create and launch a job, returning its ident
+
+        write_input(fname) writes the job's input to the file fname.  
+        HTTP errors from the handler's validation are raised.
+        """
+        ph = self.process_handlers[process_name]
+        job_dir = tempfile.mkdtemp(prefix='', dir=self.base_dir)
         try:
-            c = db.cursor()
-            c.execute("UPDATE job SET deleted = ? WHERE id = ?", (True, ident))
-            if not c.rowcount:
-                raise ValueError('no job %s in database' % ident)
-            c.close()
-            db.commit()
+            ident = os.path.basename(job_dir)
+            data_fname = os.path.join(job_dir, 'data')
+            write_input(data_fname)
+            size = os.path.getsize(data_fname)
+            fname = os.path.join(job_dir, 'content-type')
+            open(fname, 'w').write(content_type)
+            ph.validate(job_dir)
+            if self.async_launch:
+                self.register_job(ident, process_name, size, None, True)
+            else:
+                ph.launch(job_dir)
+        except:
+            shutil.rmtree(job_dir, True)
+            raise
+        if self.async_launch:
+            self.launch_queue.put(ident)
+        else:
+            self.register_job(ident, process_name, size)
+        return ident
+
+    def handle_pipeline_post(self, environ):
+
+        """create a pipeline
+
+        The body is a JSON object:
+
+            {"stages": [{"process": <label>, "content_type": <accept>}, 
+                        ...], 
+             "input": <input>}
+
+        Each stage's job gets the stdout of the previous stage's job as 
+        its input, in the media type negotiated with the previous 
+        stage's content_type (which may be any Accept header, and 
+        defaults to */*).  The output is passed by hardlinking the file 
+        where possible.
+
+        <input> is either {"data": <string>, "content_type": <type>} or 
+        {"job": <job ident>, "content_type": <accept>} to use the stdout 
+        of an existing job.
+
+        A pipeline is run by a thread in the server process that created 
+        it; if that process exits, another takes the pipeline over within 
+        recover_interval seconds.
+        """
+
+        if environ['REQUEST_METHOD'] != 'POST':
+            raise dpf.HTTP405MethodNotAllowed(['POST'])
+
+        try:
+            content_length = int(environ['CONTENT_LENGTH'])
+        except KeyError:
+            raise dpf.HTTP411LengthRequired()
+        except ValueError:
+            raise dpf.HTTP400BadRequest('text/plain', 'Bad content-length.\n')
+        if content_length < 0:
+            raise dpf.HTTP400BadRequest('text/plain', 'Bad content-length.\n')
+        if self.max_input_size is not None and \
+           content_length > self.max_input_size:
+            msg = 'Input larger than %d bytes.\n' % self.max_input_size
+            raise dpf.HTTP413RequestEntityTooLarge('text/plain', msg)
+
+        body = ''.join(dpf.input_chunks(environ, content_length))
+        try:
+            spec = json.loads(body)
+            stages = spec['stages']
+            if not isinstance(stages, list) or not stages:
+                raise ValueError('no stages')
+            for stage in stages:
+                if stage['process'] not in self.process_handlers:
+                    raise ValueError('no process %s' % stage['process'])
+                stage.setdefault('content_type', '*/*')
+            input_spec = spec['input']
+            if 'job' in input_spec:
+                input_spec.setdefault('content_type', '*/*')
+                job_dict = self.get_job(input_spec['job'])
+                if job_dict['deleted']:
+                    raise ValueError('job %s deleted' % input_spec['job'])
+            else:
+                data = input_spec['data'].encode('utf-8')
+                input_type = input_spec['content_type'].encode('utf-8')
+        except (ValueError, KeyError, TypeError, AttributeError), exc:
+            msg = 'Bad pipeline: %s\n' % str(exc)
+            raise dpf.HTTP400BadRequest('text/plain', msg)
+
+        jobs = []
+        if 'job' not in input_spec:
+            # the first job is created now, so bad input gets a 400
+            def write_input(fname):
+                open(fname, 'wb').write(data)
+            ident = self.create_job(stages[0]['process'], 
+                                    input_type, 
+                                    write_input)
+            jobs.append(ident)
+
+        pipeline_id = os.urandom(8).encode('hex')
+        input_spec.pop('data', None)
+        spec = {'stages': stages, 'input': input_spec}
+        with self.db_pool.transaction() as db:
+            db.execute("""INSERT INTO pipeline 
+                          (id, created, spec, jobs, state, owner) 
+                          VALUES (?, ?, ?, ?, 'running', ?)""", 
+                       (pipeline_id, 
+                        time.time(), 
+                        json.dumps(spec), 
+                        json.dumps(jobs), 
+                        os.getpid()))
+        self._start_pipeline(pipeline_id)
+
+        app_uri = wsgiref.util.application_uri(environ).rstrip('/')
+        headers = [('Location', '%s/pipeline/%s' % (app_uri, pipeline_id)), 
+                   ('Content-Length', '0')]
+        return ('201 Created', headers, [''])
+
+    def handle_pipeline(self, environ):
+
+        if environ['REQUEST_METHOD'] != 'GET':
+            raise dpf.HTTP405MethodNotAllowed(['GET'])
+
+        pipeline_id = environ['PATH_INFO'][len('/pipeline/'):].strip('/')
+        pipeline = self.get_pipeline(pipeline_id)
+        if pipeline is None:
+            raise dpf.HTTP404NotFound()
+
+        mt = dpf.choose_media_type(dpf.get_accept(environ), text_or_json)
+
+        app_uri = wsgiref.util.application_uri(environ).rstrip('/')
+        d = {'status': pipeline['state'], 'stages': []}
+        for (i, stage) in enumerate(pipeline['spec']['stages']):
+            stage_dict = {'process': stage['process'], 
+                          'content_type': stage['content_type'], 
+                          'job': None, 
+                          'job_status': None}
+            if i < len(pipeline['jobs']):
+                ident = pipeline['jobs'][i]
+                stage_dict['job'] = '%s/job/%s' % (app_uri, ident)
+                try:
+                    stage_dict['job_status'] = self.get_job_status(ident)
+                except ValueError:
+                    # purged
+                    stage_dict['job_status'] = 'deleted'
+            d['stages'].append(stage_dict)
+        if pipeline['state'] == 'completed':
+            d['output'] = d['stages'][-1]['job'] + '/stdout'
+        if pipeline['message']:
+            d['error'] = pipeline['message']
+
+        if mt == 'text/plain':
+            output = 'status: %s\n' % d['status']
+            for key in ('output', 'error'):
+                if key in d:
+                    output += '%s: %s\n' % (key, d[key])
+            for (i, stage_dict) in enumerate(d['stages']):
+                stage_dict = dict(stage_dict, n=i+1)
+                output += 'stage %(n)d: %(process)s, ' % stage_dict
+                output += '%(job_status)s, %(job)s\n' % stage_dict
+            output = output.encode('utf-8')
+        else:
+            output = json.dumps(d) + '\n'
+        headers = [('Content-Type', mt), 
+                   ('Content-Length', str(len(output)))]
+        return ('200 OK', headers, [output])
+
+    def get_pipeline(self, pipeline_id):
+        """return the pipeline as a dictionary, or None if there is none"""
+        db = self.db_pool.connection()
+        c = db.execute("SELECT * FROM pipeline WHERE id = ?", (pipeline_id, ))
+        try:
+            cols = [ el[0] for el in c.description ]
+            row = c.fetchone()
         finally:
-            db.close()
+            c.close()
+        if not row:
+            return None
+        pipeline = dict(zip(cols, row))
+        pipeline['spec'] = json.loads(pipeline['spec'])
+        pipeline['jobs'] = [ str(ident) 
+                             for ident in json.loads(pipeline['jobs']) ]
+        return pipeline
+
+    def _recover_pipelines(self):
+        """take over the running pipelines of processes that have gone"""
+        db = self.db_pool.connection()
+        c = db.execute("""SELECT id, owner FROM pipeline 
+                           WHERE state = 'running'""")
+        rows = c.fetchall()
+        c.close()
+        for (pipeline_id, owner) in rows:
+            if owner != os.getpid() and process_exists(owner):
+                continue
+            with self.db_pool.transaction() as db:
+                c = db.execute("""UPDATE pipeline SET owner = ? 
+                                   WHERE id = ? AND owner = ?""", 
+                               (os.getpid(), pipeline_id, owner))
+                claimed = c.rowcount
+            if claimed:
+                self._start_pipeline(pipeline_id)
+        return
+
+    def _start_pipeline(self, pipeline_id):
+        t = threading.Thread(target=self._run_pipeline, args=(pipeline_id, ))
+        t.daemon = True
+        t.start()
+        return
+
+    def _run_pipeline(self, pipeline_id):
+        pipeline = self.get_pipeline(pipeline_id)
+        stages = pipeline['spec']['stages']
+        input_spec = pipeline['spec']['input']
+        jobs = pipeline['jobs']
+        try:
+            if 'job' in input_spec:
+                previous = (input_spec['job'], input_spec['content_type'])
+                self._wait_for_stage(input_spec['job'])
+            for (i, stage) in enumerate(stages):
+                if i < len(jobs):
+                    ident = jobs[i]
+                else:
+                    ident = self._create_stage_job(stage['process'], 
+                                                   *previous)
+                    jobs.append(ident)
+                    with self.db_pool.transaction() as db:
+                        db.execute("""UPDATE pipeline SET jobs = ? 
+                                       WHERE id = ?""", 
+                                   (json.dumps(jobs), pipeline_id))
+                self._wait_for_stage(ident)
+                previous = (ident, stage['content_type'])
+        except Exception, exc:
+            if isinstance(exc, dpf.BaseHTTPError):
+                message = exc.content.strip() or exc.status
+            else:
+                if not isinstance(exc, PipelineError):
+                    traceback.print_exc()
+                message = str(exc) or exc.__class__.__name__
+            state = 'error'
+        else:
+            message = None
+            state = 'completed'
+        with self.db_pool.transaction() as db:
+            db.execute("""UPDATE pipeline SET state = ?, message = ? 
+                           WHERE id = ?""", 
+                       (state, message, pipeline_id))
         return
 
+    def _wait_for_stage(self, ident):
+        """wait for a job to finish, raising PipelineError if it fails
+
+        a job whose handler doesn't track its status is taken to be 
+        finished
+        """
+        get_status = lambda: self.get_job_status(ident)
+        status = get_status()
+        while status not in final_statuses:
+            status = self.status_watcher.wait(ident, 
+                                              get_status, 
+                                              status, 
+                                              max_wait)
+        if status in ('error', 'deleted'):
+            raise PipelineError('job %s %s' % (ident, status))
+        return
+
+    def _create_stage_job(self, process_name, previous_ident, accept):
+        """create a job whose input is the stdout of job previous_ident"""
+        job_dict = self.get_job(previous_ident)
+        ph = self.process_handlers[job_dict['process']]
+        job_dir = os.path.join(self.base_dir, previous_ident)
+        rv = ph.get_subpart_file(accept, job_dir, 'stdout')
+        if rv is not None:
+            (content_type, fname) = rv
+            if os.path.exists(fname):
+                write_input = lambda dest: link_or_copy(fname, dest)
+            else:
+                write_input = lambda dest: open(dest, 'w').close()
+        else:
+            (content_type, content) = ph.get_subpart(accept, 
+                                                     job_dir, 
+                                                     'stdout')
+            write_input = lambda dest: open(dest, 'wb').write(content)
+        return self.create_job(process_name, content_type, write_input)
+
+    def delete_job(self, ident, launched=False):
+        """mark a job deleted
+
+        if launched is true, the job is also queued to be deleted by its 
+        handler and its directory removed
+        """
+        with self.db_pool.transaction() as db:
+            process = self._delete_job(db, ident)
+            if launched:
+                self.queue_reap(db, ident, process, True)
+        if launched:
+            self.wake_reaper()
+        return
+
+    def _delete_job(self, db, ident):
+        """mark a job deleted in the transaction on db, returning its 
+        process
+        """
+        c = db.execute("""UPDATE job SET deleted = ?, 
+                                         status = 'deleted', 
+                                         deleted_time = ? 
+                           WHERE id = ?""", 
+                       (True, time.time(), ident))
+        if not c.rowcount:
+            raise ValueError('no job %s in database' % ident)
+        c = db.execute("SELECT process FROM job WHERE id = ?", (ident, ))
+        process = c.fetchone()[0]
+        c.close()
+        return process
+
 # eof
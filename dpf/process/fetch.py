@@ -0,0 +1,260 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""fetching job inputs given by reference
+
+A job's input can be the URL of a dataset on a data server (a
+text/uri-list POST body) rather than the data itself.  The process
+server fetches the data into a FetchCache once for each version of the
+dataset, and each job's data file is a hard link to the cached copy, so
+a popular dataset is fetched once rather than once per job.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import shutil
+import socket
+import httplib
+import urlparse
+import dpf.data
+from dpf.data.cache import ConversionCache
+
+block_size = 1024*1024
+
+class FetchError(Exception):
+    """an input couldn't be fetched"""
+
+class FetchTooLarge(FetchError):
+    """an input is larger than the largest accepted"""
+
+class FetchCache:
+
+    """a cache of fetched job inputs, keyed by URL and entity tag
+
+    data_servers maps the base URLs of the data servers inputs may be
+    fetched from to the data servers' base directories, or to None.  If
+    a data server's base directory is given, data is copied from its
+    store rather than fetched over HTTP.  (The store's files are not
+    hard linked: the data server counts links to tell when data is no
+    longer used.)
+
+    For each URL, <hash of URL>.json records the entity tag and content
+    type of the version last fetched, which is stored in
+    <hash of URL>-<hash of entity tag>.  Data served without an entity
+    tag isn't cached.  Files can be removed from the cache at any time;
+    jobs have their own links to their inputs.
+
+    The cached files are indexed in fetches.sqlite (a
+    dpf.data.cache.ConversionCache), and if max_size is not None, the
+    least recently used are removed to keep their total size under
+    max_size bytes.  If max_input_size is not None, data larger than
+    max_input_size bytes isn't fetched: FetchTooLarge is raised as soon
+    as the size is known, or when a copy grows past it.
+    """
+
+    def __init__(self, 
+                 cache_dir, 
+                 data_servers, 
+                 max_size=None, 
+                 max_input_size=None):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.mkdir(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        self.data_servers = {}
+        for (url, base_dir) in data_servers.iteritems():
+            self.data_servers[url.rstrip('/') + '/'] = base_dir
+        self.index = ConversionCache(self.cache_dir, 
+                                     max_size, 
+                                     'fetches.sqlite')
+        self.max_input_size = max_input_size
+        return
+
+    def fetch(self, url, fname):
+        """fetch(url, fname) -> (content type, entity tag)
+
+        make fname the data at url, returning its content type and
+        entity tag (None if it has none)
+
+        raises FetchError if url isn't on one of the data servers or
+        can't be fetched, and FetchTooLarge if the data is larger than
+        max_input_size
+        """
+        for (base_url, base_dir) in self.data_servers.iteritems():
+            if url.startswith(base_url):
+                break
+        else:
+            raise FetchError('%s is not on a known data server' % url)
+        key = hashlib.sha256(url).hexdigest()
+        try:
+            with open(os.path.join(self.cache_dir, key + '.json')) as fo:
+                cached = json.load(fo)
+            if not os.path.exists(self._entry_fname(key, cached['etag'])):
+                cached = None
+        except (IOError, ValueError):
+            cached = None
+        while True:
+            rv = None
+            if base_dir is not None:
+                ident = url[len(base_url):].strip('/')
+                rv = self._fetch_local(key, url, base_dir, ident, cached)
+            if rv is None:
+                rv = self._fetch_http(key, url, cached)
+            (entry_fname, content_type, etag) = rv
+            if etag is None:
+                # not cached, so entry_fname is ours
+                shutil.move(entry_fname, fname)
+                break
+            tmp_fname = fname + '.tmp'
+            try:
+                os.link(entry_fname, tmp_fname)
+            except OSError:
+                if not os.path.exists(entry_fname):
+                    # replaced by a newer version since we looked
+                    cached = None
+                    continue
+                shutil.copyfile(entry_fname, tmp_fname)
+            os.rename(tmp_fname, fname)
+            self.index.touch(key, etag)
+            break
+        return (content_type, etag)
+
+    def _entry_fname(self, key, etag):
+        etag_key = hashlib.sha256(etag).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '%s-%s' % (key, etag_key))
+
+    def _remove_entry(self, key, etag):
+        """remove a cached file (for ConversionCache.evict())"""
+        try:
+            os.unlink(self._entry_fname(key, etag))
+        except OSError:
+            pass
+        return True
+
+    def _check_size(self, url, size):
+        if self.max_input_size is not None and size > self.max_input_size:
+            raise FetchTooLarge('%s is larger than %d bytes' % \
+                                (url, self.max_input_size))
+        return
+
+    def _fetch_local(self, key, url, base_dir, ident, cached):
+        """look for ident in the data server store at base_dir, copying
+        it to the cache if need be
+
+        returns (entry file name, content type, entity tag), or None if
+        the data should be fetched over HTTP instead
+        """
+        if not dpf.data.ident_re.search(ident):
+            return None
+        data_dir = dpf.data.data_dir(base_dir, ident)
+        try:
+            with open(os.path.join(data_dir, 'info.json')) as fo:
+                d = json.load(fo)
+        except (IOError, ValueError):
+            return None
+        if 'sha256' not in d:
+            return None
+        # the data server's entity tag for the data as uploaded (see
+        # dpf.data.Application._etag())
+        etag = '"%s"' % str(d['sha256'])
+        content_type = str(d['source content type'])
+        if cached and cached['etag'] == etag:
+            return (self._entry_fname(key, etag), content_type, etag)
+        try:
+            fo = open(os.path.join(data_dir, 'data'), 'rb')
+        except IOError:
+            return None
+        with fo:
+            self._check_size(url, os.fstat(fo.fileno()).st_size)
+            chunks = iter(lambda: fo.read(block_size), '')
+            tmp_fname = self._write_tmp(chunks, url)
+        entry_fname = self._store(key, tmp_fname, content_type, etag, cached)
+        return (entry_fname, content_type, etag)
+
+    def _fetch_http(self, key, url, cached):
+        """fetch url (revalidating the cached version, if there is one)
+
+        returns (entry file name, content type, entity tag); if the
+        entity tag is None, the file is not in the cache and belongs to
+        the caller
+        """
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = {}
+        if cached:
+            headers['If-None-Match'] = str(cached['etag'])
+        try:
+            hc = httplib.HTTPConnection(parts.netloc)
+            try:
+                hc.request('GET', path, None, headers)
+                r = hc.getresponse()
+                if cached and r.status == 304:
+                    r.read()
+                    etag = str(cached['etag'])
+                    return (self._entry_fname(key, etag),
+                            str(cached['content_type']),
+                            etag)
+                if r.status != 200:
+                    r.read()
+                    raise FetchError('%s: %d %s' % (url, r.status, r.reason))
+                content_length = r.getheader('Content-Length', '')
+                if content_length.isdigit():
+                    # the body is dropped with the connection
+                    self._check_size(url, int(content_length))
+                chunks = iter(lambda: r.read(block_size), '')
+                tmp_fname = self._write_tmp(chunks, url)
+            finally:
+                hc.close()
+        except (socket.error, httplib.HTTPException), exc:
+            raise FetchError('%s: %s' % (url, str(exc)))
+        content_type = r.getheader('Content-Type', 'application/octet-stream')
+        etag = r.getheader('ETag')
+        if etag is None or etag.startswith('W/'):
+            return (tmp_fname, content_type, None)
+        entry_fname = self._store(key, tmp_fname, content_type, etag, cached)
+        return (entry_fname, content_type, etag)
+
+    def _write_tmp(self, chunks, url=None):
+        """write chunks to a new file in the cache, returning its name
+
+        if url is given, the chunks are its data, and are checked 
+        against max_input_size as they are written
+        """
+        (fd, tmp_fname) = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fo:
+                size = 0
+                for chunk in chunks:
+                    size += len(chunk)
+                    if url is not None:
+                        self._check_size(url, size)
+                    fo.write(chunk)
+        except:
+            os.unlink(tmp_fname)
+            raise
+        return tmp_fname
+
+    def _store(self, key, tmp_fname, content_type, etag, cached):
+        """move a fetched file into the cache and record it as the
+        latest version of its URL, returning its name in the cache
+        """
+        size = os.path.getsize(tmp_fname)
+        self.index.evict(self._remove_entry, size)
+        entry_fname = self._entry_fname(key, etag)
+        os.rename(tmp_fname, entry_fname)
+        self.index.add(key, etag, size)
+        d = {'etag': etag, 'content_type': content_type}
+        meta_fname = os.path.join(self.cache_dir, key + '.json')
+        os.rename(self._write_tmp([json.dumps(d)]), meta_fname)
+        if cached and cached['etag'] != etag:
+            self._remove_entry(key, cached['etag'])
+            self.index.remove(key, cached['etag'])
+        return entry_fname
+
+# eof
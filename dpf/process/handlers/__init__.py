@@ -1,22 +1,106 @@
 # See file COPYING distributed with dpf for copyright and license.
 
 import os
+import sys
+import errno
+import signal
 import subprocess
 import tempfile
 import re
 import json
+import time
+import threading
+import traceback
 import dpf
+from .coprocess import CoprocessPool, CoprocessError, CoprocessTimeout
 
 sge_submit_re = re.compile('Your job (\d+) \(.*\) has been submitted')
 media_type_re = re.compile('^[A-Za-z0-9\-\+\.]+/[A-Za-z0-9\-\+\.]+$')
 
+text_plain = dpf.MediaTypes(['text/plain'])
+text_or_json = dpf.MediaTypes(['text/plain', 'application/json'])
+
 class BaseProcessHandler:
 
-    """base class for process handlers"""
+    """base class for process handlers
+
+    Handlers whose get_status() always returns None should set 
+    tracks_status false, so job listings don't ask.
+    """
+
+    tracks_status = True
 
     def __init__(self):
         return
 
+    def start(self, app, label):
+        """called with the application and the handler's label in each 
+        server process before it handles any requests
+        """
+        return
+
+    def validate(self, job_dir):
+        """check the data sent with the launch request before the job is 
+        launched, raising an HTTP error if it is unacceptable
+
+        launch() may also raise these, but with asynchronous launches 
+        they only reach the client as an error status
+        """
+        return
+
+    def launched(self, job_dir):
+        """return whether launch() has been done for the job, or None if 
+        the handler can't tell
+
+        This is asked when a server process stopped part way through a 
+        launch, so the launch isn't done twice.  If the handler can't 
+        tell, the job's status becomes error; a handler whose launch is 
+        safe to repeat can return False.
+        """
+        return None
+
+    def get_status(self, job_dir):
+        """return the job's status (queued, running, completed or error), 
+        or None if the handler doesn't track it
+
+        The server records the status, and job listings don't look up a 
+        final status (completed or error) again, so one must only be 
+        returned once it is certain.
+        """
+        return None
+
+    def get_subpart_file(self, accept, job_dir, subpart):
+        """return (media type, file name) if the subpart is the contents 
+        of a file, or None if it must be fetched with get_subpart()
+
+        The server streams the file, so it may be large, and it may 
+        still be growing (or not exist yet, which is served as empty).  
+        HTTP errors are raised as they are by get_subpart().
+        """
+        return None
+
+    def delete_jobs(self, job_dirs):
+        """delete several jobs, before the server removes their 
+        directories
+
+        by default, delete() is called for each job; handlers that can 
+        delete many jobs at once for less should override this
+        """
+        for job_dir in job_dirs:
+            try:
+                self.delete(job_dir)
+            except:
+                traceback.print_exc()
+        return
+
+    def _read_output(self, fname):
+        """return the contents of an output file, or '' if it doesn't 
+        exist yet
+        """
+        if not os.path.exists(fname):
+            return ''
+        return open(fname).read()
+
     def _get_data(self, job_dir):
         """return the data sent with the launch (POST) request"""
         return open(os.path.join(job_dir, 'data')).read()
@@ -30,52 +114,173 @@ class BaseProcessHandler:
             return None
         return open(ct_fname).read()
 
+def parse_qstat(output):
+    """parse_qstat(output) -> dictionary
+
+    parse the output of qstat into a dictionary mapping job IDs to the 
+    jobs' state codes
+    """
+    states = {}
+    for line in output.split('\n'):
+        if line.startswith('job-ID') or line.startswith('------'):
+            continue
+        fields = line.split()
+        if not fields:
+            continue
+        states[int(fields[0])] = fields[4]
+    return states
+
+def sge_status(state):
+    """sge_status(state) -> status
+
+    return the job status for an SGE state code from qstat, or 
+    'completed' if state is None (the job isn't listed by qstat)
+    """
+    if state is None:
+        return 'completed'
+    if state == 'r':
+        return 'running'
+    if state == 'qw':
+        return 'queued'
+    if 'E' in state:
+        return 'error'
+    raise ValueError('unhandled value "%s" for job status' % state)
+
+class SGEStatusCache:
+
+    """cache of SGE job states
+
+    A poller thread runs qstat every interval seconds and keeps the 
+    states of all listed jobs, so requests about any number of jobs 
+    share one qstat.  The poller starts with the first lookup (in each 
+    process) and stops after idle_timeout seconds without lookups.
+
+    A lookup runs qstat itself if the cached states are older than ttl 
+    seconds, or if the job isn't listed and the states are older than 
+    min_refresh seconds.  If the lookup gives the time the job was 
+    submitted, an unlisted job is only reported as not listed (and so 
+    completed) by a qstat started after it was submitted.  Concurrent 
+    lookups share one refresh.
+    """
+
+    def __init__(self, interval=10, ttl=30, min_refresh=1, idle_timeout=300):
+        self.interval = interval
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.idle_timeout = idle_timeout
+        # job ID -> state code
+        self.states = {}
+        # when qstat was started for the current states
+        self.updated = None
+        self.last_lookup = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        # the process the poller is running in
+        self.poller_pid = None
+        return
+
+    def get(self, job_id, submitted=None):
+        """get(job_id[, submitted]) -> state code, or None if qstat 
+        doesn't list the job
+
+        submitted is the time the job was submitted, if known
+        """
+        self.last_lookup = time.time()
+        self._start_poller()
+        with self.lock:
+            states = self.states
+            updated = self.updated
+        if updated is None or time.time() - updated > self.ttl:
+            self.refresh(updated)
+        elif job_id not in states and \
+             time.time() - updated > self.min_refresh:
+            self.refresh(updated)
+        while True:
+            with self.lock:
+                state = self.states.get(job_id)
+                updated = self.updated
+            # the states may be from before the job was submitted
+            if state is not None or submitted is None or \
+               updated > submitted:
+                return state
+            self.refresh(updated)
+
+    def refresh(self, seen=False):
+        """run qstat and update the cached states
+
+        if seen is given, it is the update time the caller saw; if 
+        another thread has refreshed since then, nothing is done
+        """
+        with self.refresh_lock:
+            if seen is not False and self.updated != seen:
+                return
+            t = time.time()
+            po = subprocess.Popen(['qstat'], stdout=subprocess.PIPE)
+            stdout = po.communicate()[0]
+            assert po.returncode == 0
+            states = parse_qstat(stdout)
+            with self.lock:
+                self.states = states
+                self.updated = t
+        return
+
+    def _start_poller(self):
+        with self.lock:
+            if self.poller_pid == os.getpid():
+                return
+            # the first lookup in this process, or the poller stopped
+            poller = threading.Thread(target=self._poll)
+            poller.daemon = True
+            self.poller_pid = os.getpid()
+            poller.start()
+        return
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if time.time() - self.last_lookup > self.idle_timeout:
+                    self.poller_pid = None
+                    break
+            try:
+                self.refresh()
+            except:
+                # lookups will refresh (and report the error) themselves
+                pass
+        return
+
+# shared by all SGE handlers in a process
+sge_status_cache = SGEStatusCache()
+
 class BaseSGEHandler(BaseProcessHandler):
 
-    """base class for handlers using SGE"""
+    """base class for handlers using SGE
+
+    Job statuses come from sge_status_cache.
+    """
 
     def _get_job_id(self, job_dir):
         fname = os.path.join(job_dir, 'job_id')
         return int(open(fname).read())
 
-    def _get_job_status(self, job_dir):
+    def launched(self, job_dir):
+        # qsub may have submitted the job without the job ID being 
+        # written, but then it can't be deleted or followed anyway
+        return os.path.exists(os.path.join(job_dir, 'job_id'))
 
+    def get_status(self, job_dir):
         job_id = self._get_job_id(job_dir)
-
-        po = subprocess.Popen(['qstat'], stdout=subprocess.PIPE)
-        stdout = po.communicate()[0]
-        assert po.returncode == 0
-
-        # default if the job is not found in qstat
-        status = 'completed'
-
-        for line in stdout.split('\n'):
-            if line.startswith('job-ID') or line.startswith('------'):
-                continue
-            fields = line.split()
-            if not fields:
-                continue
-            line_id = int(fields[0])
-            if line_id == job_id:
-                if fields[4] == 'r':
-                    status = 'running'
-                elif fields[4] == 'qw':
-                    status = 'queued'
-                elif 'E' in fields[4]:
-                    status = 'error'
-                else:
-                    msg = 'unhandled value "%s" for job status' % fields[4]
-                    raise ValueError(msg)
-
-        return status
+        # the job ID is written once the job is submitted
+        submitted = os.path.getmtime(os.path.join(job_dir, 'job_id'))
+        return sge_status(sge_status_cache.get(job_id, submitted))
 
     def info(self, accept, job_dir):
         d = {'job_id': self._get_job_id(job_dir), 
-             'job_status': self._get_job_status(job_dir)}
+             'job_status': self.get_status(job_dir)}
         if d['job_status'] not in ('queued', 'error'):
             d['stdout'] = 'stdout'
             d['stderr'] = 'stderr'
-        mt = dpf.choose_media_type(accept, ['text/plain', 'application/json'])
+        mt = dpf.choose_media_type(accept, text_or_json)
         if mt == 'text/plain':
             output = ''
             for key in ('job_id', 'job_status', 'stdout', 'stderr'):
@@ -85,37 +290,17 @@ class BaseSGEHandler(BaseProcessHandler):
             output = json.dumps(d)
         return (mt, output)
 
-    def get_subpart(self, accept, job_dir, subpart):
-
-        status = self._get_job_status(job_dir)
-
-        if subpart == 'stdout':
-            if status in ('queued', 'error'):
-                raise dpf.HTTP404NotFound()
-            dpf.choose_media_type(accept, ['text/plain'])
-            fname = os.path.join(job_dir, 'stdout')
-            if not os.path.exists(fname):
-                output = ''
-            else:
-                output = open(fname).read()
-            headers = [('Content-Type', 'text/plain'),
-                       ('Content-Length', str(len(output)))]
-            return ('200 OK', headers, [output])
-
-        if subpart == 'stderr':
-            if status in ('queued', 'error'):
-                raise dpf.HTTP404NotFound()
-            fname = os.path.join(job_dir, 'stderr')
-            if not os.path.exists(fname):
-                output = ''
-            else:
-                output = open(fname).read()
-            dpf.choose_media_type(accept, ['text/plain'])
-            headers = [('Content-Type', 'text/plain'),
-                       ('Content-Length', str(len(output)))]
-            return ('200 OK', headers, [output])
+    def get_subpart_file(self, accept, job_dir, subpart):
+        if subpart not in ('stdout', 'stderr'):
+            raise dpf.HTTP404NotFound()
+        if self.get_status(job_dir) in ('queued', 'error'):
+            raise dpf.HTTP404NotFound()
+        mt = dpf.choose_media_type(accept, text_plain)
+        return (mt, os.path.join(job_dir, subpart))
 
-        raise dpf.HTTP404NotFound()
+    def get_subpart(self, accept, job_dir, subpart):
+        (mt, fname) = self.get_subpart_file(accept, job_dir, subpart)
+        return (mt, self._read_output(fname))
 
     def _launch_sge(self, job_dir, extra_args):
 
@@ -145,13 +330,316 @@ class BaseSGEHandler(BaseProcessHandler):
         return
 
     def delete(self, job_dir):
-        args = ['qdel', str(self._get_job_id(job_dir))]
-        po = subprocess.Popen(args, stdout=subprocess.PIPE)
-        po.wait()
+        self.delete_jobs([job_dir])
+        return
+
+    def delete_jobs(self, job_dirs):
+        """delete the jobs with one qdel"""
+        job_ids = []
+        for job_dir in job_dirs:
+            try:
+                job_ids.append(str(self._get_job_id(job_dir)))
+            except (IOError, ValueError):
+                # never submitted
+                pass
+        if job_ids:
+            po = subprocess.Popen(['qdel'] + job_ids, stdout=subprocess.PIPE)
+            po.wait()
+        return
+
+# the local pool job queue, created by the job database migrations (see 
+# dpf.process.db_migrations)
+local_job_ddl = """CREATE TABLE IF NOT EXISTS local_job 
+                   (seq INTEGER PRIMARY KEY AUTOINCREMENT, 
+                    ident TEXT NOT NULL UNIQUE, 
+                    handler TEXT NOT NULL, 
+                    priority INTEGER NOT NULL DEFAULT 0, 
+                    state TEXT NOT NULL DEFAULT 'queued', 
+                    owner INTEGER, 
+                    claim TEXT, 
+                    pid INTEGER)"""
+
+local_job_index_ddl = """CREATE INDEX IF NOT EXISTS local_job_handler 
+                         ON local_job (handler, state)"""
+
+# take the next queued job if fewer than the limit are running; as one 
+# statement, this holds the database write lock throughout, so processes 
+# can't both take the last slot.  Jobs marked deleted are passed over 
+# until the reaper removes them.
+local_job_claim_sql = """UPDATE local_job 
+                            SET state = 'running', owner = ?, claim = ? 
+                          WHERE seq = (SELECT seq FROM local_job 
+                                        WHERE handler = ? AND state = 'queued' 
+                                          AND NOT EXISTS 
+                                              (SELECT 1 FROM job 
+                                                WHERE job.id = local_job.ident 
+                                                  AND job.deleted) 
+                                        ORDER BY priority DESC, seq 
+                                        LIMIT 1) 
+                            AND (SELECT COUNT(*) FROM local_job 
+                                  WHERE handler = ? AND state = 'running') < ?"""
+
+def process_exists(pid):
+    """return True if the process pid exists"""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        if e.errno == errno.ESRCH:
+            return False
+    return True
+
+class BaseLocalPoolHandler(BaseProcessHandler):
+
+    """base class for handlers that run jobs on the server host
+
+    Launched jobs are queued in the job database and run by up to 
+    max_jobs worker threads, highest priority first and in launch order 
+    within a priority.  The limit holds across the processes of a 
+    pre-forked server.  The queue survives a restart: jobs that were 
+    running in a process that has gone are queued again.
+
+    Subclasses implement command(job_dir), which returns the command to 
+    run as a list of arguments.  Its standard input is the data sent 
+    with the launch request and its standard output and error are the 
+    job's stdout and stderr.  A job that exits with a nonzero value has 
+    status error.  Subclasses may override priority(job_dir) (higher 
+    runs sooner, default 0) and validate(job_dir).
+
+    poll_interval is the time in seconds between checks for jobs queued 
+    by other processes.  Both arguments may be given as strings, as they 
+    are in a config file.
+    """
+
+    def __init__(self, max_jobs=2, poll_interval=1):
+        BaseProcessHandler.__init__(self)
+        self.max_jobs = int(max_jobs)
+        self.poll_interval = float(poll_interval)
+        self.app = None
+        self.label = None
+        self.pid = None
+        self.cond = threading.Condition()
+        return
+
+    def start(self, app, label):
+        self.app = app
+        self.label = label
+        # jobs left running by this process ID are from before a restart
+        self.pid = None
+        self._requeue()
+        self.pid = os.getpid()
+        for i in xrange(self.max_jobs):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+        return
+
+    def command(self, job_dir):
+        raise NotImplementedError()
+
+    def priority(self, job_dir):
+        return 0
+
+    def _owner_exists(self, owner):
+        if owner == os.getpid():
+            return owner == self.pid
+        return process_exists(owner)
+
+    def _requeue(self):
+        """queue again the jobs of processes that have gone"""
+        db = self.app.db_pool.connection()
+        c = db.execute("""SELECT DISTINCT owner FROM local_job 
+                           WHERE handler = ? AND state = 'running'""", 
+                       (self.label, ))
+        owners = [ row[0] for row in c ]
+        c.close()
+        for owner in owners:
+            if self._owner_exists(owner):
+                continue
+            with self.app.db_pool.transaction() as db:
+                db.execute("""UPDATE local_job 
+                                 SET state = 'queued', owner = NULL, 
+                                     claim = NULL, pid = NULL 
+                               WHERE handler = ? 
+                                 AND state = 'running' 
+                                 AND owner = ?""", 
+                           (self.label, owner))
+        return
+
+    def _claim(self):
+        """take the next job to run, returning its ident, or None if 
+        there is none or enough are running
+        """
+        claim = os.urandom(8).encode('hex')
+        with self.app.db_pool.transaction() as db:
+            c = db.execute(local_job_claim_sql, 
+                           (os.getpid(), 
+                            claim, 
+                            self.label, 
+                            self.label, 
+                            self.max_jobs))
+            claimed = c.rowcount
+        if not claimed:
+            return None
+        db = self.app.db_pool.connection()
+        c = db.execute("SELECT ident FROM local_job WHERE claim = ?", 
+                       (claim, ))
+        row = c.fetchone()
+        c.close()
+        if not row:
+            return None
+        return row[0]
+
+    def _work(self):
+        while True:
+            try:
+                ident = self._claim()
+                if ident is None:
+                    with self.cond:
+                        self.cond.wait(self.poll_interval)
+                    self._requeue()
+                    continue
+                self._run_job(ident)
+            except:
+                traceback.print_exc()
+                time.sleep(self.poll_interval)
+        return
+
+    def _run_job(self, ident):
+        job_dir = os.path.join(self.app.base_dir, ident)
+        try:
+            args = self.command(job_dir)
+            fo_in = open(os.path.join(job_dir, 'data'))
+            fo_out = open(os.path.join(job_dir, 'stdout'), 'w')
+            fo_err = open(os.path.join(job_dir, 'stderr'), 'w')
+            try:
+                po = subprocess.Popen(args, 
+                                      stdin=fo_in, 
+                                      stdout=fo_out, 
+                                      stderr=fo_err, 
+                                      close_fds=True)
+            finally:
+                fo_in.close()
+                fo_out.close()
+                fo_err.close()
+            with self.app.db_pool.transaction() as db:
+                c = db.execute("""UPDATE local_job SET pid = ? 
+                                   WHERE ident = ? AND state = 'running'""", 
+                               (po.pid, ident))
+                if not c.rowcount:
+                    # deleted while starting
+                    po.kill()
+            returncode = po.wait()
+        except:
+            traceback.print_exc()
+            state = 'error'
+        else:
+            if returncode == 0:
+                state = 'completed'
+            else:
+                state = 'error'
+        with self.app.db_pool.transaction() as db:
+            db.execute("""UPDATE local_job SET state = ?, pid = NULL 
+                           WHERE ident = ? AND state = 'running'""", 
+                       (state, ident))
+        return
+
+    def launch(self, job_dir):
+        if self.app is None:
+            raise ValueError('handler not started')
+        ident = os.path.basename(job_dir.rstrip('/'))
+        with self.app.db_pool.transaction() as db:
+            db.execute("""INSERT INTO local_job (ident, handler, priority) 
+                          VALUES (?, ?, ?)""", 
+                       (ident, self.label, int(self.priority(job_dir))))
+        with self.cond:
+            self.cond.notify()
+        return
+
+    def launched(self, job_dir):
+        ident = os.path.basename(job_dir.rstrip('/'))
+        db = self.app.db_pool.connection()
+        c = db.execute("SELECT 1 FROM local_job WHERE ident = ?", (ident, ))
+        row = c.fetchone()
+        c.close()
+        return row is not None
+
+    def get_status(self, job_dir):
+        ident = os.path.basename(job_dir.rstrip('/'))
+        db = self.app.db_pool.connection()
+        c = db.execute("SELECT state FROM local_job WHERE ident = ?", 
+                       (ident, ))
+        row = c.fetchone()
+        c.close()
+        if not row:
+            return 'error'
+        # sqlite gives unicode, which would make info() output unicode
+        return str(row[0])
+
+    def info(self, accept, job_dir):
+        d = {'job_status': self.get_status(job_dir)}
+        if d['job_status'] != 'queued':
+            d['stdout'] = 'stdout'
+            d['stderr'] = 'stderr'
+        mt = dpf.choose_media_type(accept, text_or_json)
+        if mt == 'text/plain':
+            output = ''
+            for key in ('job_status', 'stdout', 'stderr'):
+                if key in d:
+                    output += '%s: %s\n' % (key, d[key])
+        else:
+            output = json.dumps(d)
+        return (mt, output)
+
+    def get_subpart_file(self, accept, job_dir, subpart):
+        if subpart not in ('stdout', 'stderr'):
+            raise dpf.HTTP404NotFound()
+        if self.get_status(job_dir) == 'queued':
+            raise dpf.HTTP404NotFound()
+        mt = dpf.choose_media_type(accept, text_plain)
+        return (mt, os.path.join(job_dir, subpart))
+
+    def get_subpart(self, accept, job_dir, subpart):
+        (mt, fname) = self.get_subpart_file(accept, job_dir, subpart)
+        return (mt, self._read_output(fname))
+
+    def delete(self, job_dir):
+        ident = os.path.basename(job_dir.rstrip('/'))
+        with self.app.db_pool.transaction() as db:
+            c = db.execute("SELECT pid FROM local_job WHERE ident = ?", 
+                           (ident, ))
+            row = c.fetchone()
+            c.close()
+            db.execute("DELETE FROM local_job WHERE ident = ?", (ident, ))
+        if row and row[0] is not None:
+            try:
+                os.kill(row[0], signal.SIGTERM)
+            except OSError:
+                pass
         return
 
 class ScriptHandler(BaseProcessHandler):
 
+    """handler implemented by a script
+
+    The script is run with a command (description, doc, launch, info, 
+    subpart or delete) and its arguments, and answers with its standard 
+    output and exit value.
+
+    In the default mode ('exec'), the script is run for each call.  In 
+    'coprocess' mode, up to pool_size instances of the script are started 
+    once (as "script serve") and the doc, info, subpart and delete calls 
+    are sent to them (see dpf.process.handlers.coprocess).  A call that 
+    gets no response in timeout seconds fails.  If a co-process exits or 
+    misbehaves, the call is made by running the script, and a new 
+    co-process is started for the next call.  description and launch 
+    (which may take a long time) are always run directly.  If the 
+    script doesn't answer a request when it is first started as a 
+    co-process, it is taken not to support the mode, and the handler 
+    runs the script for each call.
+
+    All arguments may be given as strings, as they are in a config file.
+    """
+
     def _execute(self, args):
         with tempfile.TemporaryFile() as fo_stdout:
             with open(os.devnull, 'w') as fo_stderr:
@@ -179,9 +667,43 @@ class ScriptHandler(BaseProcessHandler):
             raise ValueError('bad media type: %s' % media_type)
         return (media_type, content)
 
-    def __init__(self, script):
+    def _call(self, args):
+        """_call(args) -> (returncode, stdout)
+
+        make a call through the co-process pool if there is one, 
+        otherwise by running the script
+        """
+        if self.pool is not None:
+            try:
+                return self.pool.call(args[0], args[1:])
+            except CoprocessTimeout:
+                raise
+            except CoprocessError:
+                pass
+        return self._execute(args)
+
+    def __init__(self, script, mode='exec', pool_size=4, timeout=30):
         BaseProcessHandler.__init__(self)
         self.script = script
+        if mode == 'exec':
+            self.pool = None
+        elif mode == 'coprocess':
+            self.pool = CoprocessPool([self.script, 'serve'], 
+                                      int(pool_size), 
+                                      float(timeout))
+            try:
+                self.pool.call('description', [])
+            except CoprocessError:
+                # otherwise every call would start a co-process that 
+                # fails before running the script
+                msg = '%s: no co-process mode; running it for each call\n'
+                sys.stderr.write(msg % self.script)
+                self.pool = None
+            else:
+                # co-processes for requests are started after any fork
+                self.pool.close()
+        else:
+            raise ValueError('bad mode "%s"' % mode)
         (returncode, stdout) = self._execute(['description'])
         if returncode != 0:
             raise ValueError('"%s description" returned %d' % (self.script, 
@@ -190,7 +712,7 @@ class ScriptHandler(BaseProcessHandler):
         return
 
     def get_doc(self, accept):
-        (returncode, stdout) = self._execute(['doc', accept])
+        (returncode, stdout) = self._call(['doc', accept])
         if returncode == 40:
             raise dpf.HTTP400BadRequest()
         if returncode == 6:
@@ -211,7 +733,7 @@ class ScriptHandler(BaseProcessHandler):
         return
 
     def info(self, accept, job_dir):
-        (returncode, stdout) = self._execute(['info', accept, job_dir])
+        (returncode, stdout) = self._call(['info', accept, job_dir])
         if returncode == 40:
             raise dpf.HTTP400BadRequest()
         if returncode == 6:
@@ -221,9 +743,29 @@ class ScriptHandler(BaseProcessHandler):
                                                         returncode))
         return self._split_output(stdout)
 
+    def get_status(self, job_dir):
+        """the job_status the script gives in its JSON info, if any
+
+        a script whose JSON info has no job_status is taken not to track 
+        statuses
+        """
+        try:
+            (returncode, stdout) = self._call(['info', 
+                                               'application/json', 
+                                               job_dir])
+            if returncode != 0:
+                return None
+            (media_type, content) = self._split_output(stdout)
+            info = json.loads(content)
+            if 'job_status' not in info:
+                self.tracks_status = False
+            return info.get('job_status')
+        except (CoprocessTimeout, ValueError, AttributeError, TypeError):
+            return None
+
     def get_subpart(self, accept, job_dir, subpart):
         args = ['subpart', accept, job_dir, subpart]
-        (returncode, stdout) = self._execute(args)
+        (returncode, stdout) = self._call(args)
         if returncode == 40:
             raise dpf.HTTP400BadRequest()
         if returncode == 4:
@@ -236,7 +778,7 @@ class ScriptHandler(BaseProcessHandler):
         return self._split_output(stdout)
 
     def delete(self, job_dir):
-        (returncode, stdout) = self._execute(['delete', job_dir])
+        (returncode, stdout) = self._call(['delete', job_dir])
         if returncode != 0:
             raise ValueError('"%s delete" returned %d' % (self.script, 
                                                           returncode))
@@ -0,0 +1,192 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""long-lived handler scripts
+
+A script that supports the co-process protocol is started once as
+
+    script serve
+
+and then reads requests from stdin and writes responses to stdout, one
+JSON object per line.  A request gives the command and its arguments as
+they would be passed on the command line:
+
+    {"command": "info", "arguments": ["text/plain", "/path/to/job"]}
+
+and the response gives the exit value and standard output the command
+would have had:
+
+    {"status": 0, "output": "text/plain\\nprocess: bc\\n"}
+
+serve() implements the script side of the protocol for scripts written
+in Python.
+"""
+
+import os
+import sys
+import time
+import json
+import select
+import signal
+import subprocess
+import threading
+
+class CoprocessError(Exception):
+    """a co-process exited or misbehaved"""
+
+class CoprocessTimeout(CoprocessError):
+    """a co-process took too long to respond"""
+
+class Coprocess:
+
+    """a running co-process"""
+
+    def __init__(self, args):
+        with open(os.devnull, 'w') as fo_stderr:
+            self.po = subprocess.Popen(args,
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=fo_stderr,
+                                       close_fds=True)
+        self.buffer = ''
+        return
+
+    def call(self, command, arguments, timeout):
+        """call(command, arguments, timeout) -> (status, output)"""
+        request = {'command': command, 'arguments': arguments}
+        try:
+            self.po.stdin.write(json.dumps(request) + '\n')
+            self.po.stdin.flush()
+        except IOError:
+            raise CoprocessError('co-process exited')
+        deadline = time.time() + timeout
+        fd = self.po.stdout.fileno()
+        while '\n' not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise CoprocessTimeout('no response in %g seconds' % timeout)
+            if not select.select([fd], [], [], remaining)[0]:
+                continue
+            data = os.read(fd, 64*1024)
+            if not data:
+                raise CoprocessError('co-process exited')
+            self.buffer += data
+        (line, self.buffer) = self.buffer.split('\n', 1)
+        try:
+            response = json.loads(line)
+            status = int(response['status'])
+            output = response['output'].encode('utf-8')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise CoprocessError('bad response from co-process')
+        return (status, output)
+
+    def kill(self):
+        if self.po.poll() is None:
+            os.kill(self.po.pid, signal.SIGKILL)
+        self.po.wait()
+        return
+
+class CoprocessPool:
+
+    """pool of up to size co-processes running args
+
+    Co-processes are started as they are needed.  One that exits,
+    misbehaves or times out is killed and replaced by the next call
+    that needs one.  Co-processes are not shared across forks: the
+    first call in a new process starts new ones.
+    """
+
+    def __init__(self, args, size, timeout):
+        self.args = args
+        self.size = size
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.idle = []
+        self.n_running = 0
+        self.pid = os.getpid()
+        return
+
+    def call(self, command, arguments):
+        """call(command, arguments) -> (status, output)
+
+        raises CoprocessError if the co-process fails and
+        CoprocessTimeout if it doesn't respond within the timeout
+        """
+        coprocess = self._get()
+        try:
+            rv = coprocess.call(command, arguments, self.timeout)
+        except:
+            coprocess.kill()
+            self._put(None)
+            raise
+        self._put(coprocess)
+        return rv
+
+    def close(self):
+        """stop the idle co-processes"""
+        with self.cond:
+            idle = self.idle
+            self.n_running -= len(idle)
+            self.idle = []
+        for coprocess in idle:
+            coprocess.kill()
+        return
+
+    def _get(self):
+        with self.cond:
+            if self.pid != os.getpid():
+                # these belong to the parent
+                self.idle = []
+                self.n_running = 0
+                self.pid = os.getpid()
+            while not self.idle and self.n_running >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.n_running += 1
+        try:
+            return Coprocess(self.args)
+        except:
+            self._put(None)
+            raise
+
+    def _put(self, coprocess):
+        """return a co-process to the pool, or note that one has gone
+        (if coprocess is None)
+        """
+        with self.cond:
+            if coprocess is None:
+                self.n_running -= 1
+            else:
+                self.idle.append(coprocess)
+            self.cond.notify()
+        return
+
+def serve(commands, fo_in=sys.stdin, fo_out=sys.stdout):
+
+    """serve(commands[, fo_in, fo_out])
+
+    Serve co-process requests until fo_in ends.
+
+    commands is a dictionary mapping command names to functions that are
+    called with the request's arguments and return (status, output).  An
+    unknown command gets status 1.
+    """
+
+    while True:
+        line = fo_in.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        try:
+            f = commands[request['command']]
+        except KeyError:
+            (status, output) = (1, '')
+        else:
+            (status, output) = f(*request['arguments'])
+        response = {'status': status, 'output': output}
+        fo_out.write(json.dumps(response) + '\n')
+        fo_out.flush()
+
+    return
+
+# eof
@@ -1,7 +1,10 @@
 # See file COPYING distributed with dpf for copyright and license.
 
+import os
+import time
 import dpf
-from . import BaseProcessHandler, BaseSGEHandler
+from . import BaseProcessHandler, BaseSGEHandler, BaseLocalPoolHandler, \
+              text_plain, text_or_json
 import json
 
 class WCHandler(BaseSGEHandler):
@@ -14,29 +17,95 @@ class WCHandler(BaseSGEHandler):
         return
 
     def get_doc(self, accept):
-        mt = dpf.choose_media_type(accept, ['text/plain', 'application/json'])
+        mt = dpf.choose_media_type(accept, text_or_json)
         if mt == 'text/plain':
             output = 'wc\n'
         else:
             output = json.dumps('wc json') + '\n'
         return (mt, output)
 
-    def launch(self, job_dir):
-
+    def validate(self, job_dir):
+        # input fetched by the server (see dpf.process.fetch) is counted 
+        # from the job directory
+        if os.path.exists(os.path.join(job_dir, 'url')):
+            return
         data = self._get_data(job_dir)
         content_type = self._get_content_type(job_dir)
         if content_type is None:
             content_type = 'text/plain'
-
         if content_type != 'text/plain':
             raise dpf.HTTP415UnsupportedMediaType()
         if not data.startswith('http://'):
             raise dpf.HTTP400BadRequest('text/plain',
                                         'data must contain a URL\n')
+        return
+
+    def launch(self, job_dir):
+        if os.path.exists(os.path.join(job_dir, 'url')):
+            url = 'file://%s' % os.path.abspath(os.path.join(job_dir, 'data'))
+        else:
+            url = self._get_data(job_dir)
+        self._launch_sge(job_dir, ['wc.sge', url])
+        return
+
+class LocalWCHandler(BaseLocalPoolHandler):
+
+    """handler for wc, run on the server"""
+
+    def __init__(self, max_jobs=2):
+        BaseLocalPoolHandler.__init__(self, max_jobs)
+        self.description = 'word count (wc), run locally'
+        return
+
+    def get_doc(self, accept):
+        mt = dpf.choose_media_type(accept, text_or_json)
+        if mt == 'text/plain':
+            output = 'wc, run locally\n'
+        else:
+            output = json.dumps('wc, run locally') + '\n'
+        return (mt, output)
+
+    def command(self, job_dir):
+        return ['wc']
+
+class SleepHandler(BaseLocalPoolHandler):
+
+    """sleep, run on the server one job at a time
+
+    the data is the number of seconds to sleep, optionally followed by 
+    the job's priority
+    """
+
+    def __init__(self, max_jobs=1):
+        BaseLocalPoolHandler.__init__(self, max_jobs, 0.2)
+        self.description = 'sleep'
+        return
+
+    def get_doc(self, accept):
+        mt = dpf.choose_media_type(accept, text_or_json)
+        if mt == 'text/plain':
+            output = 'sleep\n'
+        else:
+            output = json.dumps('sleep') + '\n'
+        return (mt, output)
 
-        self._launch_sge(job_dir, ['wc.sge', data])
+    def validate(self, job_dir):
+        try:
+            [ float(field) for field in self._get_data(job_dir).split() ]
+        except ValueError:
+            raise dpf.HTTP400BadRequest('text/plain', 
+                                        'data must be numbers\n')
         return
 
+    def priority(self, job_dir):
+        fields = self._get_data(job_dir).split()
+        if len(fields) < 2:
+            return 0
+        return int(fields[1])
+
+    def command(self, job_dir):
+        return ['sleep', self._get_data(job_dir).split()[0]]
+
 class EchoHandler(BaseProcessHandler):
 
     """this handler does nothing
@@ -54,7 +123,7 @@ class EchoHandler(BaseProcessHandler):
         return
 
     def get_doc(self, accept):
-        mt = dpf.choose_media_type(accept, ['text/plain', 'application/json'])
+        mt = dpf.choose_media_type(accept, text_or_json)
         if mt == 'text/plain':
             output = 'echo the input to stdout\n'
         else:
@@ -64,13 +133,20 @@ class EchoHandler(BaseProcessHandler):
     def launch(self, job_dir):
         return
 
+    def launched(self, job_dir):
+        # launching does nothing, so it can be repeated
+        return False
+
+    def get_status(self, job_dir):
+        return 'completed'
+
     def info(self, accept, job_dir):
         data = self._get_data(job_dir)
         content_type = self._get_content_type(job_dir)
         d = {'process': 'echo', 
              'content type': content_type, 
              'data length': len(data)}
-        mt = dpf.choose_media_type(accept, ['text/plain', 'application/json'])
+        mt = dpf.choose_media_type(accept, text_or_json)
         if mt == 'text/plain':
             output = ''
             for key in ('process', 'content type', 'data length'):
@@ -80,6 +156,13 @@ class EchoHandler(BaseProcessHandler):
             output = json.dumps(d)
         return (mt, output)
 
+    def get_subpart_file(self, accept, job_dir, subpart):
+        if subpart != 'stdout':
+            return None
+        content_type = self._get_content_type(job_dir)
+        mt = dpf.choose_media_type(accept, [content_type])
+        return (mt, os.path.join(job_dir, 'data'))
+
     def get_subpart(self, accept, job_dir, subpart):
         content_type = self._get_content_type(job_dir)
         if subpart == 'stdout':
@@ -87,11 +170,37 @@ class EchoHandler(BaseProcessHandler):
             output = self._get_data(job_dir)
             return(mt, output)
         if subpart == 'stderr':
-            mt = dpf.choose_media_type(accept, ['text/plain'])
+            mt = dpf.choose_media_type(accept, text_plain)
             return (mt, '')
         raise dpf.HTTP404NotFound()
 
     def delete(self, job_dir):
         return
 
+class SlowEchoHandler(EchoHandler):
+
+    """echo handler whose launch takes the number of seconds given in the 
+    data, and then fails if the number is negative
+    """
+
+    def __init__(self):
+        EchoHandler.__init__(self)
+        self.description = 'echo the input to stdout, slowly'
+        return
+
+    def validate(self, job_dir):
+        try:
+            float(self._get_data(job_dir))
+        except ValueError:
+            raise dpf.HTTP400BadRequest('text/plain', 
+                                        'data must be a number\n')
+        return
+
+    def launch(self, job_dir):
+        seconds = float(self._get_data(job_dir))
+        time.sleep(abs(seconds))
+        if seconds < 0:
+            raise ValueError('launch failed')
+        return
+
 # eof
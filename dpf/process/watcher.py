@@ -0,0 +1,92 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""job status watching
+
+A StatusWatcher lets any number of threads wait for job status changes
+while a single poller thread looks the statuses up, once per watched
+job per interval however many threads are waiting on it.  (For SGE
+jobs, the lookups are answered by one shared qstat; see
+dpf.process.handlers.SGEStatusCache.)
+"""
+
+import os
+import time
+import threading
+import traceback
+
+class StatusWatcher:
+
+    """wait for job status changes
+
+    The poller looks up the status of each watched job every interval
+    seconds.  It starts with the first wait (in each process) and stops
+    when nothing is being watched.
+    """
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.cond = threading.Condition()
+        # key -> {'get_status': function, 'status': status, 'waiters': n}
+        self.watches = {}
+        # the process the poller is running in
+        self.poller_pid = None
+        return
+
+    def wait(self, key, get_status, status, timeout):
+        """wait(key, get_status, status, timeout) -> status
+
+        wait up to timeout seconds for the status of the job identified
+        by key to differ from status, and return the last status seen
+
+        get_status is called with no arguments to look up the job's
+        status; if several threads wait for the same key, the first
+        one's get_status is used.
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            if self.poller_pid != os.getpid():
+                # the first wait in this process, or the poller stopped
+                self.watches = {}
+                poller = threading.Thread(target=self._poll)
+                poller.daemon = True
+                self.poller_pid = os.getpid()
+                poller.start()
+            if key not in self.watches:
+                self.watches[key] = {'get_status': get_status,
+                                     'status': status,
+                                     'waiters': 0}
+            watch = self.watches[key]
+            watch['waiters'] += 1
+            try:
+                # the poller notifies every interval, so waits without a
+                # timeout (which are cheaper) see the deadline in time
+                while watch['status'] == status and time.time() < deadline:
+                    self.cond.wait()
+            finally:
+                watch['waiters'] -= 1
+                if not watch['waiters']:
+                    del self.watches[key]
+            return watch['status']
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            with self.cond:
+                if not self.watches:
+                    self.poller_pid = None
+                    break
+                watches = self.watches.items()
+            statuses = {}
+            for (key, watch) in watches:
+                try:
+                    statuses[key] = watch['get_status']()
+                except:
+                    traceback.print_exc()
+            with self.cond:
+                for (key, status) in statuses.iteritems():
+                    if key in self.watches:
+                        self.watches[key]['status'] = status
+                self.cond.notifyAll()
+        return
+
+# eof
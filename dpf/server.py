@@ -0,0 +1,320 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+"""WSGI servers for the DPF applications
+
+make_server() returns a server with serve_forever() and handle_request()
+methods, like wsgiref.simple_server.make_server().  By default this is
+the wsgiref server itself, which handles one request at a time.  A
+server with more than one thread hands accepted connections to a pool
+of threads, and a server with more than one worker forks that many
+processes which all accept connections on the listening socket:
+
+    server = make_server('localhost', 8080, app, workers=4, threads=8)
+    server.serve_forever()
+
+In the pre-forked server, the master process only supervises the
+workers, restarting any that exit.  Signals to the master:
+
+    SIGHUP: graceful restart -- start new workers, then tell the old
+            workers to finish the requests they are handling and exit
+    SIGTERM, SIGINT: graceful shutdown
+
+If max_requests is given, each worker exits after handling that many
+requests and is replaced, which bounds the effect of any leaks.
+
+The application's start() method is called in each worker process
+before it handles any requests (in the single process servers, before
+serving starts), and its stop() method is called in each worker process
+after it has finished its requests, before it exits.
+"""
+
+import os
+import sys
+import errno
+import time
+import signal
+import select
+import threading
+import Queue
+import traceback
+import wsgiref.simple_server
+
+# how often (in seconds) a worker checks whether it has been told to stop
+poll_interval = 0.5
+
+def make_server(host, port, app, workers=1, threads=1, max_requests=None):
+
+    """make_server(host, port, app[, workers, threads, max_requests]) -> server
+
+    Create a server for the WSGI application app on host and port.
+
+    workers is the number of processes and threads is the number of
+    threads per process handling requests.  With the defaults (one of
+    each), the wsgiref server is used.
+
+    max_requests (only used if workers > 1) is the number of requests
+    each worker handles before being replaced; if it is None, workers
+    are not replaced.
+    """
+
+    if workers < 1 or threads < 1:
+        raise ValueError('workers and threads must be at least 1')
+
+    if workers == 1 and threads == 1:
+        server = wsgiref.simple_server.make_server(host, port, app)
+        app.start()
+        return server
+
+    server = wsgiref.simple_server.make_server(host,
+                                               port,
+                                               app,
+                                               server_class=PoolWSGIServer)
+    server.threads = threads
+
+    if workers == 1:
+        app.start()
+        return server
+
+    return PreforkServer(server, app, workers, max_requests)
+
+class PoolWSGIServer(wsgiref.simple_server.WSGIServer):
+
+    """WSGI server that handles requests in a pool of threads
+
+    The accepting thread queues each connection for the pool, so a slow
+    request only ties up its own thread.  handle_request() serves a
+    request in the calling thread.
+    """
+
+    threads = 1
+    max_requests = None
+    # the wsgiref default of 5 refuses connections under modest load
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs):
+        wsgiref.simple_server.WSGIServer.__init__(self, *args, **kwargs)
+        self.stopping = False
+        self.n_requests = 0
+        # the pool's queue, while serve_forever() is running
+        self.queue = None
+        return
+
+    def serve_forever(self):
+        """serve until stop() is called (or max_requests is reached)"""
+        self.stopping = False
+        self.n_requests = 0
+        self.queue = Queue.Queue(self.threads)
+        pool = []
+        for i in xrange(self.threads):
+            t = threading.Thread(target=self._run_pool)
+            t.daemon = True
+            t.start()
+            pool.append(t)
+        try:
+            while not self.stopping:
+                try:
+                    r = select.select([self], [], [], poll_interval)[0]
+                except select.error, data:
+                    if data.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if r:
+                    self._handle_request_noblock()
+                if self.max_requests and \
+                   self.n_requests >= self.max_requests:
+                    break
+        finally:
+            # let the pool finish what has been queued
+            for t in pool:
+                self.queue.put(None)
+            for t in pool:
+                t.join()
+            self.queue = None
+        return
+
+    def stop(self):
+        """stop accepting requests; this is safe to call from a signal
+        handler
+        """
+        self.stopping = True
+        return
+
+    def get_request(self):
+        # the listening socket is non-blocking in pre-forked workers, but
+        # the connections should block
+        (conn, addr) = self.socket.accept()
+        conn.setblocking(1)
+        return (conn, addr)
+
+    def process_request(self, request, client_address):
+        self.n_requests += 1
+        if self.queue is None:
+            # handle_request()
+            wsgiref.simple_server.WSGIServer.process_request(self, 
+                                                             request, 
+                                                             client_address)
+        else:
+            self.queue.put((request, client_address))
+        return
+
+    def _run_pool(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            (request, client_address) = item
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+        return
+
+class PreforkServer:
+
+    """pre-forking server
+
+    server is a bound PoolWSGIServer, which each worker runs after the
+    fork.
+    """
+
+    def __init__(self, server, app, workers, max_requests=None):
+        self.server = server
+        self.app = app
+        self.workers = workers
+        self.max_requests = max_requests
+        # the worker pids we expect to be running, mapped to the
+        # generation they were started in
+        self.pids = {}
+        self.generation = 0
+        self.restarting = False
+        self.stopping = False
+        return
+
+    def serve_forever(self):
+
+        old_handlers = {}
+        for (signum, handler) in ((signal.SIGHUP, self._sighup),
+                                  (signal.SIGTERM, self._sigterm),
+                                  (signal.SIGINT, self._sigterm)):
+            old_handlers[signum] = signal.signal(signum, handler)
+
+        try:
+            self._spawn_workers()
+            while True:
+                if self.stopping:
+                    break
+                if self.restarting:
+                    self.restarting = False
+                    self._restart()
+                # poll rather than block in wait() so a signal arriving 
+                # just before the wait isn't missed
+                try:
+                    (pid, status) = os.waitpid(-1, os.WNOHANG)
+                except OSError, data:
+                    if data.errno == errno.EINTR:
+                        continue
+                    if data.errno == errno.ECHILD:
+                        self._spawn_workers()
+                        continue
+                    raise
+                if pid == 0:
+                    time.sleep(poll_interval)
+                    continue
+                generation = self.pids.pop(pid, None)
+                if generation == self.generation and not self.stopping:
+                    if status:
+                        # don't spin if workers are failing on startup
+                        time.sleep(1)
+                    # recycled or crashed
+                    self._spawn_workers()
+        finally:
+            for (signum, handler) in old_handlers.iteritems():
+                signal.signal(signum, handler)
+            self._stop_workers(self.pids.keys())
+            self.server.server_close()
+
+        return
+
+    def handle_request(self):
+        """serve one request in this process, without starting workers"""
+        try:
+            self.app.start()
+            self.server.handle_request()
+        finally:
+            self.server.server_close()
+        return
+
+    def _sighup(self, signum, frame):
+        self.restarting = True
+        return
+
+    def _sigterm(self, signum, frame):
+        self.stopping = True
+        return
+
+    def _spawn_workers(self):
+        """start workers until there are self.workers in this generation"""
+        n = len([ g for g in self.pids.itervalues() if g == self.generation ])
+        # so buffered output isn't written by the workers too
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for i in xrange(self.workers - n):
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker()
+            self.pids[pid] = self.generation
+        return
+
+    def _restart(self):
+        old_pids = self.pids.keys()
+        self.generation += 1
+        self._spawn_workers()
+        for pid in old_pids:
+            self._kill(pid, signal.SIGTERM)
+        return
+
+    def _stop_workers(self, pids):
+        for pid in pids:
+            self._kill(pid, signal.SIGTERM)
+        for pid in pids:
+            while True:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError, data:
+                    if data.errno == errno.EINTR:
+                        continue
+                    if data.errno != errno.ECHILD:
+                        raise
+                break
+        return
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError, data:
+            if data.errno != errno.ESRCH:
+                raise
+        return
+
+    def _run_worker(self):
+        """run a worker; this never returns"""
+        status = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM,
+                          lambda signum, frame: self.server.stop())
+            self.server.socket.setblocking(0)
+            self.server.max_requests = self.max_requests
+            self.app.start()
+            self.server.serve_forever()
+            self.app.stop()
+        except:
+            traceback.print_exc()
+            status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+# eof
@@ -8,20 +8,27 @@ import time
 class ServerError(Exception):
     """server error"""
 
-def start_data_server():
+def start_data_server(port=8080, cache='tmp/data', args=[]):
+
+    """start a data server on port, storing data in cache
+
+    args are additional arguments for dpf_data_server
+    """
 
     if not os.path.exists('tmp'):
         os.mkdir('tmp')
-    if not os.path.exists('tmp/data'):
-        os.mkdir('tmp/data')
+    if not os.path.exists(cache):
+        os.mkdir(cache)
 
-    fo_out = open('tmp/data_test.stdout', 'a')
-    fo_err = open('tmp/data_test.stderr', 'a')
+    log_base = 'tmp/%s_test' % os.path.basename(cache)
+    fo_out = open(log_base + '.stdout', 'a')
+    fo_err = open(log_base + '.stderr', 'a')
 
     po = subprocess.Popen(['dpf_data_server', 
-                           '-C', 'tmp/data', 
+                           '-C', cache, 
+                           '-p', str(port), 
                            '-H', 'dpf.data.handlers.CSVHandler', 
-                           '-H', 'dpf.data.handlers.JSONHandler'],
+                           '-H', 'dpf.data.handlers.JSONHandler'] + args,
                           stdout=fo_out, 
                           stderr=fo_err)
 
@@ -32,7 +39,7 @@ def start_data_server():
     for i in xrange(5):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            s.connect(('localhost', 8080))
+            s.connect(('localhost', port))
         except socket.error:
             time.sleep(1)
             pass
@@ -48,20 +55,33 @@ def start_data_server():
 
     return (po, fo_out, fo_err)
 
-def start_process_server():
+def start_process_server(port=8081, cache='tmp/process', args=[]):
+
+    """start a process server on port, storing jobs in cache
+
+    args are additional arguments for dpf_process_server
+    """
 
     if not os.path.exists('tmp'):
         os.mkdir('tmp')
-    if not os.path.exists('tmp/process'):
-        os.mkdir('tmp/process')
-    fo_out = open('tmp/process_test.stdout', 'a')
-    fo_err = open('tmp/process_test.stderr', 'a')
-    po = subprocess.Popen(['dpf_process_server', 
-                           '-C', 'tmp/process', 
-                           '-H', 'wc=dpf.process.handlers.tests.WCHandler', 
-                           '-H', 'echo=dpf.process.handlers.tests.EchoHandler'], 
-                          stdout=fo_out, 
-                          stderr=fo_err)
+    if not os.path.exists(cache):
+        os.mkdir(cache)
+
+    log_base = 'tmp/%s_test' % os.path.basename(cache)
+    fo_out = open(log_base + '.stdout', 'a')
+    fo_err = open(log_base + '.stderr', 'a')
+
+    handlers = ['wc=dpf.process.handlers.tests.WCHandler', 
+                'echo=dpf.process.handlers.tests.EchoHandler', 
+                'wclocal=dpf.process.handlers.tests.LocalWCHandler', 
+                'wcmemo=dpf.process.handlers.tests.LocalWCHandler', 
+                'sleep=dpf.process.handlers.tests.SleepHandler', 
+                'slowecho=dpf.process.handlers.tests.SlowEchoHandler']
+    command = ['dpf_process_server', '-C', cache, '-p', str(port)]
+    for handler in handlers:
+        command.extend(['-H', handler])
+
+    po = subprocess.Popen(command + args, stdout=fo_out, stderr=fo_err)
 
     # wait for the data server to be listening
     # if it doesn't come up after a certain amount of time, clean up and 
@@ -70,7 +90,7 @@ def start_process_server():
     for i in xrange(5):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            s.connect(('localhost', 8081))
+            s.connect(('localhost', port))
         except socket.error:
             time.sleep(1)
             pass
@@ -87,7 +107,9 @@ def start_process_server():
     return (po, fo_out, fo_err)
 
 def stop_server(po, fo_out, fo_err):
-    po.terminate()
+    if po.poll() is None:
+        po.terminate()
+        po.wait()
     fo_out.close()
     fo_err.close()
     return
@@ -0,0 +1,167 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+import os
+import subprocess
+import socket
+import tempfile
+import shutil
+import time
+import itertools
+import dpf
+
+def run(args, stdin=''):
+    po = subprocess.Popen(['dpf_choose_media_type'] + args, 
+                          stdin=subprocess.PIPE, 
+                          stdout=subprocess.PIPE)
+    stdout = po.communicate(stdin)[0]
+    return (po.returncode, stdout)
+
+batch_input = '*/*\ttext/plain\tapplication/json\n' + \
+              'application/*\ttext/plain\tapplication/json\n' + \
+              'image/png\ttext/plain\n' + \
+              'bogus\ttext/plain\n' + \
+              '*/*\tbogus\n' + \
+              'text/plain\n' + \
+              '*/*\ttext/plain\n'
+
+batch_output = 'text/plain\n' + \
+               'application/json\n' + \
+               '406 Not Acceptable\n' + \
+               '400 Bad Request\n' + \
+               '400 Bad Request\n' + \
+               '400 Bad Request\n' + \
+               'text/plain\n'
+
+def reference_choose_media_type(accept, resource_types):
+    """choose_media_type() as it was before parsed headers were cached 
+    and resource types precompiled, for comparison
+    """
+    accept_types = []
+    for part in accept.split(','):
+        part = part.strip()
+        if ';' not in part:
+            mt = part
+            q = 1.0
+        else:
+            (mt, q) = part.split(';', 1)
+            mt = mt.strip()
+            q = q.strip()
+            if not q.startswith('q='):
+                raise dpf.HTTP400BadRequest()
+            try:
+                q = float(q[2:])
+            except ValueError:
+                raise dpf.HTTP400BadRequest()
+        if '/' not in mt:
+            raise dpf.HTTP400BadRequest()
+        (type, subtype) = mt.split('/', 1)
+        accept_types.append((type, subtype, q))
+    accept_types.sort(dpf.cmp_accept_type)
+    accept_types.reverse()
+    for (type, subtype, q) in accept_types:
+        for available_type in resource_types:
+            (a_type, a_subtype) = available_type.split('/', 1)
+            if type != '*' and type != a_type:
+                continue
+            if subtype != '*' and subtype != a_subtype:
+                continue
+            return available_type
+    raise dpf.HTTP406NotAcceptable()
+
+def outcome(f, accept, resource_types):
+    try:
+        return f(accept, resource_types)
+    except dpf.HTTP400BadRequest:
+        return 400
+    except dpf.HTTP406NotAcceptable:
+        return 406
+
+class TestNegotiation:
+
+    """test choose_media_type() against the reference implementation"""
+
+    def test(self):
+        ranges = ['*/*', 'text/*', 'text/plain', 'application/json', 
+                  '*/json', 'image/png', 'text/plain;q=0.5', 
+                  'application/*;q=0.8', '*/*;q=0.1', 'bogus', 
+                  'text/html;level=1']
+        types = ['text/plain', 'application/json', 'text/csv', 'image/png']
+        for n in (1, 2, 3):
+            for accept_ranges in itertools.permutations(ranges, n):
+                accept = ','.join(accept_ranges)
+                for n_types in (1, 2, 3):
+                    for resource_types in itertools.permutations(types, 
+                                                                 n_types):
+                        expected = outcome(reference_choose_media_type, 
+                                           accept, 
+                                           resource_types)
+                        # twice, to use the cached parse
+                        for i in xrange(2):
+                            result = outcome(dpf.choose_media_type, 
+                                             accept, 
+                                             resource_types)
+                            assert result == expected
+                        mts = dpf.MediaTypes(resource_types)
+                        result = outcome(dpf.choose_media_type, accept, mts)
+                        assert result == expected
+        return
+
+class TestCommandLine:
+
+    def test(self):
+        assert run(['text/*', 'application/json', 'text/plain']) == \
+               (0, 'text/plain\n')
+        assert run(['image/png', 'text/plain']) == \
+               (6, '406 Not Acceptable\n')
+        assert run(['bogus', 'text/plain']) == (4, '400 Bad Request\n')
+        assert run(['*/*', 'bogus']) == (2, '')
+        return
+
+    def test_bad_media_type(self):
+        try:
+            dpf.MediaTypes(['text/plain', 'bogus'])
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
+        return
+
+    def test_batch(self):
+        assert run(['--batch'], batch_input) == (0, batch_output)
+        return
+
+class TestServe:
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.socket_fname = os.path.join(self.dir, 'socket')
+        self.po = subprocess.Popen(['dpf_choose_media_type', 
+                                    '--serve', 
+                                    self.socket_fname])
+        for i in xrange(50):
+            if os.path.exists(self.socket_fname):
+                break
+            time.sleep(0.1)
+        return
+
+    def tearDown(self):
+        self.po.terminate()
+        self.po.wait()
+        shutil.rmtree(self.dir)
+        return
+
+    def test(self):
+        for i in xrange(2):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(self.socket_fname)
+            fo = s.makefile('r+')
+            s.close()
+            for (line, result) in zip(batch_input.splitlines(True), 
+                                      batch_output.splitlines(True)):
+                fo.write(line)
+                fo.flush()
+                assert fo.readline() == result
+            fo.close()
+        return
+
+# eof
@@ -1,14 +1,33 @@
 # See file COPYING distributed with dpf for copyright and license.
 
+import os
 import uuid
 import httplib
 import json
+import tempfile
+import shutil
+import hashlib
+import dpf.data
+import dpf.data.handlers.validators
 from . import start_data_server, stop_server
 
 test_vars = {}
 
+def data_dir(ident):
+    """return the directory in which the test server stores ident"""
+    return os.path.join('tmp', 'data', ident[0:2], ident[2:4], ident)
+
+def blob_fname(sha256, content_type=None):
+    """return the name of the file in the test server's blob store for 
+    sha256 (and content_type)
+    """
+    fname = os.path.join('tmp', 'data', 'blobs', sha256[0:2], sha256[2:4], sha256)
+    if content_type is not None:
+        fname += '-%s' % content_type.replace('/', '_')
+    return fname
+
 def setup():
-    po, fo_out, fo_err = start_data_server()
+    po, fo_out, fo_err = start_data_server(args=['--metrics'])
     test_vars['po'] = po
     test_vars['fo_out'] = fo_out
     test_vars['fo_err'] = fo_err
@@ -127,6 +146,30 @@ class TestPostGetDelete(BaseDataTest):
 
         return
 
+class TestHead(BaseDataTest):
+
+    """test HEAD of the source representation"""
+
+    n_connections = 2
+
+    def test(self):
+
+        data = str(uuid.uuid4())
+
+        r = self.request('POST', '/', data)
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+
+        r = self.request('HEAD', '/%s' % ident)
+        assert r.status == 200
+        assert r.reason == 'OK'
+        headers = dict(r.getheaders())
+        assert 'content-length' in headers
+        assert headers['content-length'] == str(len(data))
+        assert r.read() == ''
+
+        return
+
 class TestMediaType(BaseDataTest):
 
     """test media types"""
@@ -187,6 +230,51 @@ class TestValidator(BaseDataTest):
         assert r.status == 400
         assert r.reason == 'Bad Request'
 
+    def test_json(self):
+        data = json.dumps({'a': [1, 2.5, None, 'x' * 100000]})
+        r = self.request('POST', '/', data, {'Content-Type': 'application/json'})
+        assert r.status == 201
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+        d = json.load(open(os.path.join(data_dir(ident), 'info.json')))
+        assert d['size'] == len(data)
+        assert d['sha256'] == hashlib.sha256(data).hexdigest()
+        return
+
+    def test_csv(self):
+        r = self.request('POST', '/', 'a,b\nc\0d\n', {'Content-Type': 'text/csv'})
+        assert r.status == 400
+        assert r.reason == 'Bad Request'
+        return
+
+class TestJSONValidator:
+
+    """test the incremental JSON validator on data split between chunks"""
+
+    def validate(self, chunks):
+        validator = dpf.data.handlers.validators.JSONValidator()
+        for chunk in chunks:
+            validator.update(chunk)
+        return validator.finish()
+
+    def test_split_string(self):
+        data = json.dumps({'a': ['xyz', 'x\\y\u00e9z', 1.5], 
+                           'bc': 'd 12 [true]'})
+        for i in xrange(len(data)):
+            assert self.validate([data[:i], data[i:]]), i
+        return
+
+    def test_split_string_1mb(self):
+        """a string value split at the server's read size"""
+        split = 1024 * 1024
+        prefix = '{"a": 1, "b": "'
+        # split just before the closing quote, so the next chunk starts 
+        # with what looks like a string
+        data = prefix + 'x' * (split - len(prefix)) + '", "c": [2]}'
+        assert self.validate([data[:split], data[split:]])
+        assert not self.validate([data[:split], data[split:-1]])
+        return
+
 class TestConverter(BaseDataTest):
 
     """test a media type converter"""
@@ -213,4 +301,491 @@ class TestConverter(BaseDataTest):
         assert headers['content-type'] == 'application/json'
         assert r.read() == json_data
 
+class TestNDJSON(BaseDataTest):
+
+    """test conversion from CSV to NDJSON"""
+
+    n_connections = 3
+
+    def test(self):
+
+        data = '1,2\na,b\n'
+        ndjson_data = '["1", "2"]\n["a", "b"]\n'
+
+        r = self.request('POST', '/', data, {'Content-Type': 'text/csv'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+
+        # the first request streams the conversion, the second reads the 
+        # stored conversion
+        for i in xrange(2):
+            r = self.request('GET', 
+                             '/%s' % ident, 
+                             '', 
+                             {'Accept': 'application/x-ndjson'})
+            assert r.status == 200
+            assert r.reason == 'OK'
+            headers = dict(r.getheaders())
+            assert headers['content-type'] == 'application/x-ndjson'
+            assert r.read() == ndjson_data
+
+        return
+
+class TestConversionCache(BaseDataTest):
+
+    """test that conversions are stored and reused"""
+
+    n_connections = 5
+
+    def test(self):
+
+        # unique, so the data isn't shared with other tests' datasets
+        u = uuid.uuid4().hex
+        data = '1,2\na,%s\n' % u
+        json_data = '[["1", "2"], ["a", "%s"]]' % u
+
+        r = self.request('POST', '/', data, {'Content-Type': 'text/csv'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+
+        info_fname = os.path.join(data_dir(ident), 'info.json')
+        assert json.load(open(info_fname))['data'].keys() == ['text/csv']
+
+        r = self.request('HEAD', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Accept': 'application/json'})
+        assert r.status == 200
+        headers = dict(r.getheaders())
+        assert headers['content-length'] == str(len(json_data))
+
+        # conversions are stored in the blob store, not with the dataset
+        d = json.load(open(info_fname))
+        assert d['data'].keys() == ['text/csv']
+        stored_fname = blob_fname(d['sha256'], 'application/json')
+        assert open(stored_fname).read() == json_data
+
+        for i in xrange(2):
+            r = self.request('GET', 
+                             '/%s' % ident, 
+                             '', 
+                             {'Accept': 'application/json'})
+            assert r.status == 200
+            headers = dict(r.getheaders())
+            assert headers['content-type'] == 'application/json'
+            assert r.read() == json_data
+
+        r = self.request('DELETE', '/%s' % ident)
+        assert r.status == 204
+        assert not os.path.exists(stored_fname)
+
+        return
+
+class TestDedup(BaseDataTest):
+
+    """test that identical uploads share storage and conversions"""
+
+    n_connections = 9
+
+    def test(self):
+
+        data = '1,2\n%s\n' % uuid.uuid4().hex
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        idents = []
+        for i in xrange(2):
+            r = self.request('POST', '/', data, {'Content-Type': 'text/csv'})
+            assert r.status == 201
+            headers = dict(r.getheaders())
+            idents.append(headers['location'].split('/')[-1])
+            r.read()
+
+        assert os.stat(blob_fname(sha256)).st_nlink == 3
+        for ident in idents:
+            fname = os.path.join(data_dir(ident), 'data')
+            assert os.path.samefile(fname, blob_fname(sha256))
+
+        r = self.request('GET', 
+                         '/%s' % idents[0], 
+                         '', 
+                         {'Accept': 'application/json'})
+        assert r.status == 200
+        json_data = r.read()
+        stored_fname = blob_fname(sha256, 'application/json')
+        assert os.path.exists(stored_fname)
+
+        r = self.request('GET', '/admin/store', '', {'Accept': 'application/json'})
+        assert r.status == 200
+        d = json.loads(r.read())
+        assert d['datasets'] >= 2
+        assert d['dedup ratio'] > 1
+
+        # the first dataset's conversion serves the second
+        r = self.request('DELETE', '/%s' % idents[0])
+        assert r.status == 204
+        assert os.path.exists(blob_fname(sha256))
+        assert os.path.exists(stored_fname)
+
+        r = self.request('GET', 
+                         '/%s' % idents[1], 
+                         '', 
+                         {'Accept': 'application/json'})
+        assert r.status == 200
+        assert r.read() == json_data
+
+        r = self.request('DELETE', '/%s' % idents[1])
+        assert r.status == 204
+        assert not os.path.exists(blob_fname(sha256))
+        assert not os.path.exists(stored_fname)
+
+        r = self.request('GET', '/%s' % idents[1])
+        assert r.status == 410
+        r.read()
+
+        r = self.request('GET', '/admin/store', '', {'Accept': 'text/plain'})
+        assert r.status == 200
+        assert 'dedup ratio: ' in r.read()
+
+        return
+
+class TestRange(BaseDataTest):
+
+    """test Range requests"""
+
+    n_connections = 9
+
+    def test(self):
+
+        data = '0123456789abcdefghij'
+
+        r = self.request('POST', '/', data, {'Content-Type': 'text/plain'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+
+        r = self.request('HEAD', '/%s' % ident)
+        headers = dict(r.getheaders())
+        assert headers['accept-ranges'] == 'bytes'
+        last_modified = headers['last-modified']
+        r.read()
+
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=2-5'})
+        assert r.status == 206
+        assert r.reason == 'Partial Content'
+        headers = dict(r.getheaders())
+        assert headers['content-range'] == 'bytes 2-5/20'
+        assert headers['content-length'] == '4'
+        assert r.read() == '2345'
+
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=-3'})
+        assert r.status == 206
+        assert r.read() == 'hij'
+
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=18-'})
+        assert r.status == 206
+        assert r.read() == 'ij'
+
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=0-1,5-6'})
+        assert r.status == 206
+        headers = dict(r.getheaders())
+        ct = headers['content-type']
+        assert ct.startswith('multipart/byteranges; boundary=')
+        boundary = ct.split('=', 1)[1]
+        body = r.read()
+        assert len(body) == int(headers['content-length'])
+        assert body.endswith('--%s--\r\n' % boundary)
+        assert 'Content-Range: bytes 0-1/20\r\n\r\n01\r\n' in body
+        assert 'Content-Range: bytes 5-6/20\r\n\r\n56\r\n' in body
+
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=20-'})
+        assert r.status == 416
+        headers = dict(r.getheaders())
+        assert headers['content-range'] == 'bytes */20'
+        r.read()
+
+        # an out-of-date If-Range gets the whole entity
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Range': 'bytes=2-5', 
+                          'If-Range': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        assert r.status == 200
+        assert r.read() == data
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Range': 'bytes=2-5', 'If-Range': last_modified})
+        assert r.status == 206
+        assert r.read() == '2345'
+
+        return
+
+class TestRangeLimits(BaseDataTest):
+
+    """test Range requests with empty entities and many ranges"""
+
+    n_connections = 6
+
+    def test(self):
+
+        r = self.request('POST', '/', '', {'Content-Type': 'text/plain'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+        r.read()
+
+        # there are no last bytes of an empty entity
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=-5'})
+        assert r.status == 416
+        headers = dict(r.getheaders())
+        assert headers['content-range'] == 'bytes */0'
+        r.read()
+
+        data = '0123456789abcdefghij'
+        r = self.request('POST', '/', data, {'Content-Type': 'text/plain'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+        r.read()
+
+        # overlapping and adjacent ranges are merged into one
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Range': 'bytes=4-6,0-2,3-3,5-9'})
+        assert r.status == 206
+        headers = dict(r.getheaders())
+        assert headers['content-range'] == 'bytes 0-9/20'
+        assert r.read() == '0123456789'
+
+        r = self.request('GET', '/%s' % ident, '', {'Range': 'bytes=8-9,0-1'})
+        assert r.status == 206
+        body = r.read()
+        assert body.index('bytes 0-1/20') < body.index('bytes 8-9/20')
+
+        # too many ranges, and the header is ignored
+        range_header = 'bytes=' + ','.join([ '%d-%d' % (i, i) 
+                                             for i in xrange(0, 20, 2) ] * 3)
+        r = self.request('GET', '/%s' % ident, '', {'Range': range_header})
+        assert r.status == 200
+        assert r.read() == data
+
+        return
+
+class TestRangeConversion(BaseDataTest):
+
+    """test Range requests for a converted representation"""
+
+    n_connections = 2
+
+    def test(self):
+
+        data = '1,2\na,b\n'
+        json_data = '[["1", "2"], ["a", "b"]]'
+
+        r = self.request('POST', '/', data, {'Content-Type': 'text/csv'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Accept': 'application/json', 'Range': 'bytes=1-10'})
+        assert r.status == 206
+        headers = dict(r.getheaders())
+        assert headers['content-type'] == 'application/json'
+        assert headers['content-range'] == 'bytes 1-10/%d' % len(json_data)
+        assert r.read() == json_data[1:11]
+
+        return
+
+class TestConditional(BaseDataTest):
+
+    """test conditional GETs"""
+
+    n_connections = 10
+
+    def test(self):
+
+        data = '1,2\na,b\n'
+
+        r = self.request('POST', '/', data, {'Content-Type': 'text/csv'})
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+
+        r = self.request('GET', '/%s' % ident)
+        assert r.status == 200
+        headers = dict(r.getheaders())
+        etag = headers['etag']
+        last_modified = headers['last-modified']
+        assert etag.startswith('"')
+        r.read()
+
+        r = self.request('GET', '/%s' % ident, '', {'If-None-Match': etag})
+        assert r.status == 304
+        assert r.reason == 'Not Modified'
+        headers = dict(r.getheaders())
+        assert headers['etag'] == etag
+        r.read()
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'If-None-Match': '"bogus", W/%s' % etag})
+        assert r.status == 304
+        r.read()
+
+        r = self.request('GET', '/%s' % ident, '', {'If-None-Match': '"bogus"'})
+        assert r.status == 200
+        assert r.read() == data
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'If-Modified-Since': last_modified})
+        assert r.status == 304
+        r.read()
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        assert r.status == 200
+        assert r.read() == data
+
+        # a 304 for a conversion doesn't run the conversion
+        json_etag = etag[:-1] + '-application_json"'
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Accept': 'application/json', 
+                          'If-None-Match': json_etag})
+        assert r.status == 304
+        headers = dict(r.getheaders())
+        assert headers['etag'] == json_etag
+        r.read()
+        info_fname = os.path.join(data_dir(ident), 'info.json')
+        assert 'application/json' not in json.load(open(info_fname))['data']
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Accept': 'application/json'})
+        assert r.status == 200
+        headers = dict(r.getheaders())
+        assert headers['etag'] == json_etag
+        r.read()
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Range': 'bytes=0-0', 'If-Range': etag})
+        assert r.status == 206
+        assert r.read() == data[0]
+
+        return
+
+class TestMetrics(BaseDataTest):
+
+    """test request metrics"""
+
+    n_connections = 4
+
+    def test(self):
+
+        data = '1,2\na,%s\n' % uuid.uuid4().hex
+
+        r = self.request('POST', '/', data, {'Content-Type': 'text/csv'})
+        assert r.status == 201
+        headers = dict(r.getheaders())
+        ident = headers['location'].split('/')[-1]
+        timing = headers['server-timing']
+        for phase in ('read', 'write', 'validate', 'metadata', 'total'):
+            assert '%s;dur=' % phase in timing
+
+        r = self.request('GET', 
+                         '/%s' % ident, 
+                         '', 
+                         {'Accept': 'application/json'})
+        assert r.status == 200
+        headers = dict(r.getheaders())
+        assert 'negotiate;dur=' in headers['server-timing']
+        r.read()
+
+        r = self.request('GET', '/00000000')
+        assert r.status == 404
+        r.read()
+
+        r = self.request('GET', '/admin/metrics')
+        assert r.status == 200
+        headers = dict(r.getheaders())
+        assert headers['content-type'].startswith('text/plain')
+        values = {}
+        for line in r.read().split('\n'):
+            if line and not line.startswith('#'):
+                (name, value) = line.rsplit(' ', 1)
+                values[name] = float(value)
+        assert values['dpf_data_bytes_in_total'] >= len(data)
+        assert values['dpf_data_bytes_out_total'] > 0
+        assert values['dpf_data_conversion_cache_misses_total'] >= 1
+        assert values['dpf_data_errors_total{status="404"}'] >= 1
+        name = 'dpf_data_phase_seconds_count{phase="convert"}'
+        assert values[name] >= 1
+        name = 'dpf_data_requests_total{method="POST",status="201"}'
+        assert values[name] >= 1
+
+        return
+
+class TestBadIdent(BaseDataTest):
+
+    """test that identifiers can't reach outside the data directory"""
+
+    n_connections = 1
+
+    def test(self):
+        r = self.request('GET', '/../data')
+        assert r.status == 404
+        r.read()
+        return
+
+class TestMigrate:
+
+    """test migration of the flat data layout"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def test(self):
+        os.mkdir(os.path.join(self.base_dir, '12345678'))
+        open(os.path.join(self.base_dir, '12345678', 'data'), 'w').write('x')
+        open(os.path.join(self.base_dir, 'conversions.sqlite'), 'w')
+        assert dpf.data.migrate(self.base_dir) == 1
+        assert not os.path.exists(os.path.join(self.base_dir, '12345678'))
+        fname = os.path.join(self.base_dir, '12', '34', '12345678', 'data')
+        assert open(fname).read() == 'x'
+        assert os.path.exists(os.path.join(self.base_dir, 'conversions.sqlite'))
+        assert dpf.data.migrate(self.base_dir) == 0
+        return
+
+    def test_blob_store(self):
+        dir = os.path.join(self.base_dir, '12', '34', '12345678')
+        os.makedirs(dir)
+        open(os.path.join(dir, 'data'), 'w').write('[1]')
+        open(os.path.join(dir, 'data.json'), 'w').write('[1]')
+        d = {'source content type': 'text/csv', 
+             'creation time': 0, 
+             'data': {'text/csv': 'data', 'application/json': 'data.json'}}
+        json.dump(d, open(os.path.join(dir, 'info.json'), 'w'))
+        assert dpf.data.migrate(self.base_dir) == 1
+        d = json.load(open(os.path.join(dir, 'info.json')))
+        assert d['sha256'] == hashlib.sha256('[1]').hexdigest()
+        assert d['data'] == {'text/csv': 'data'}
+        assert not os.path.exists(os.path.join(dir, 'data.json'))
+        assert os.stat(os.path.join(dir, 'data')).st_nlink == 2
+        assert dpf.data.migrate(self.base_dir) == 0
+        return
+
 # eof
@@ -6,6 +6,20 @@ import socket
 import time
 import httplib
 import json
+import tempfile
+import shutil
+import hashlib
+import threading
+import signal
+import sqlite3
+import wsgiref.util
+import dpf.db
+import dpf.process
+import dpf.process.handlers
+import dpf.process.handlers.coprocess
+import dpf.process.handlers.tests
+import dpf.process.fetch
+import dpf.process.watcher
 from . import start_process_server, start_data_server, stop_server
 
 test_vars = {}
@@ -15,7 +29,8 @@ def setup():
 #    test_vars['data_po'] = po
 #    test_vars['data_fo_out'] = fo_out
 #    test_vars['data_fo_err'] = fo_err
-    (po, fo_out, fo_err) = start_process_server()
+    args = ['--max-input-size', '1', '--memoize', 'wcmemo', '--threads', '4']
+    (po, fo_out, fo_err) = start_process_server(args=args)
     test_vars['process_po'] = po
     test_vars['process_fo_out'] = fo_out
     test_vars['process_fo_err'] = fo_err
@@ -188,4 +203,1600 @@ class TestValidator(BaseProcessTest):
         assert r.reason == 'Bad Request'
         return
 
+def post_job(process, data, port=8081):
+    """launch a job and return its ident"""
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.request('POST', '/%s' % process, data, {'Content-Type': 'text/plain'})
+    r = hc.getresponse()
+    r.read()
+    hc.close()
+    assert r.status == 201
+    return r.getheader('Location').split('/')[-1]
+
+def job_status(ident, port=8081):
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.request('GET', '/job/%s' % ident, '', {'Accept': 'application/json'})
+    r = hc.getresponse()
+    data = r.read()
+    hc.close()
+    assert r.status == 200
+    return json.loads(data)['job_status']
+
+def job_status_code(ident, port=8081):
+    """return the HTTP status of a GET for a job"""
+    hc = httplib.HTTPConnection('localhost', port)
+    hc.request('GET', '/job/%s' % ident)
+    r = hc.getresponse()
+    r.read()
+    hc.close()
+    return r.status
+
+def wait_for_job(ident, states, port=8081, timeout=10):
+    """wait for a job to reach one of states and return its status"""
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        status = job_status(ident, port)
+        if status in states:
+            return status
+        time.sleep(0.1)
+    raise AssertionError('job %s still %s' % (ident, status))
+
+def wait_for_removal(path, timeout=10):
+    """wait for a deleted job's directory to be removed"""
+    t0 = time.time()
+    while os.path.exists(path):
+        if time.time() - t0 > timeout:
+            raise AssertionError('%s not removed' % path)
+        time.sleep(0.1)
+    return
+
+class TestLocalPool(BaseProcessTest):
+
+    """test jobs run by a local process pool"""
+
+    n_process_connections = 4
+
+    def test(self):
+        data = 'one two three\nfour\n'
+        ident = post_job('wclocal', data)
+        assert wait_for_job(ident, ('completed', 'error')) == 'completed'
+        r = self.process_request('GET', '/job/%s/stdout' % ident)
+        assert r.status == 200
+        assert r.read().split() == ['2', '4', '19']
+        r = self.process_request('GET', '/job/%s/stderr' % ident)
+        assert r.status == 200
+        assert r.read() == ''
+        r = self.process_request('GET', '/job/%s/bogus' % ident)
+        assert r.status == 404
+        r.read()
+        r = self.process_request('DELETE', '/job/%s' % ident)
+        assert r.status == 204
+        return
+
+    def test_error(self):
+        ident = post_job('sleep', '-1')
+        assert wait_for_job(ident, ('completed', 'error')) == 'error'
+        return
+
+    def test_text_info(self):
+        ident = post_job('sleep', '1')
+        assert wait_for_job(ident, ('running', )) == 'running'
+        r = self.process_request('GET', '/job/%s' % ident)
+        assert r.status == 200
+        assert r.getheader('Content-Type') == 'text/plain'
+        assert 'job_status: running\n' in r.read()
+        return
+
+    def test_bad_request(self):
+        headers = {'Content-Type': 'text/plain'}
+        r = self.process_request('POST', '/sleep', 'bogus', headers)
+        assert r.status == 400
+        return
+
+    def test_queue(self):
+        """the sleep handler runs one job at a time, highest priority 
+        first
+        """
+        first = post_job('sleep', '1')
+        assert wait_for_job(first, ('running', )) == 'running'
+        low = post_job('sleep', '1')
+        high = post_job('sleep', '1 5')
+        assert job_status(low) == 'queued'
+        assert job_status(high) == 'queued'
+        r = self.process_request('GET', '/job/%s/stdout' % low)
+        assert r.status == 404
+        r.read()
+        wait_for_job(first, ('completed', ))
+        wait_for_job(high, ('running', 'completed'))
+        assert job_status(low) == 'queued'
+        wait_for_job(low, ('completed', ))
+        return
+
+    def test_delete_queued(self):
+        first = post_job('sleep', '1')
+        queued = post_job('sleep', '0')
+        r = self.process_request('DELETE', '/job/%s' % queued)
+        assert r.status == 204
+        r = self.process_request('DELETE', '/job/%s' % first)
+        assert r.status == 204
+        return
+
+class TestInputSize(BaseProcessTest):
+
+    """test the maximum job input size"""
+
+    n_process_connections = 1
+
+    def test_okay(self):
+        data = 'x' * 1024 * 1024
+        ident = post_job('echo', data)
+        r = self.process_request('GET', '/job/%s/stdout' % ident)
+        assert r.status == 200
+        assert r.read() == data
+        return
+
+    def test_too_large(self):
+        """the request is refused without reading the body"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect(('localhost', 8081))
+        s.sendall('POST /echo HTTP/1.0\r\n' + 
+                  'Content-Type: text/plain\r\n' + 
+                  'Content-Length: %d\r\n\r\n' % (1024 * 1024 + 1))
+        fo = s.makefile()
+        status_line = fo.readline()
+        fo.close()
+        s.close()
+        assert status_line.split(None, 1)[1].strip() == \
+               '413 Request Entity Too Large'
+        return
+
+class TestJobList(BaseProcessTest):
+
+    """test listing jobs"""
+
+    def list(self, query):
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('GET', '/job/?' + query, '', {'Accept': 'application/json'})
+        r = hc.getresponse()
+        data = r.read()
+        hc.close()
+        if r.status != 200:
+            return (r, data)
+        return (r, json.loads(data))
+
+    def test(self):
+        t0 = time.time()
+        idents = [ post_job('echo', 'data %d' % i) for i in xrange(3) ]
+        (r, page) = self.list('process=echo&limit=2&created_after=%r' % t0)
+        assert r.status == 200
+        assert [ job['id'] for job in page['jobs'] ] == idents[:0:-1]
+        job = page['jobs'][0]
+        assert job['process'] == 'echo'
+        assert job['status'] == 'completed'
+        assert job['size'] == 6
+        assert job['url'].endswith('/job/%s' % idents[2])
+        assert r.getheader('Link') == '<%s>; rel="next"' % page['next']
+        (r, page) = self.list(page['next'].split('?', 1)[1])
+        assert [ job['id'] for job in page['jobs'] ] == idents[:1]
+        assert page['next'] is None
+        return
+
+    def test_filters(self):
+        t0 = time.time()
+        idents = [ post_job('echo', 'data') for i in xrange(2) ]
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('DELETE', '/job/%s' % idents[0])
+        assert hc.getresponse().status == 204
+        hc.close()
+        (r, page) = self.list('created_after=%r' % t0)
+        assert [ job['id'] for job in page['jobs'] ] == idents[1:]
+        (r, page) = self.list('created_after=%r&deleted=1' % t0)
+        assert [ job['id'] for job in page['jobs'] ] == idents[:1]
+        assert page['jobs'][0]['status'] == 'deleted'
+        (r, page) = self.list('created_after=%r&status=completed' % t0)
+        assert [ job['id'] for job in page['jobs'] ] == idents[1:]
+        (r, page) = self.list('created_before=%r' % t0)
+        assert not set(idents) & set( job['id'] for job in page['jobs'] )
+        return
+
+    def test_text(self):
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('GET', '/job/', '', {'Accept': 'text/plain'})
+        r = hc.getresponse()
+        assert r.status == 200
+        assert r.read().startswith('Jobs:\n')
+        hc.close()
+        return
+
+    def test_bad_request(self):
+        for query in ('limit=0', 'limit=bogus', 'after=bogus', 
+                      'created_after=bogus', 'deleted=2'):
+            (r, data) = self.list(query)
+            assert r.status == 400
+        return
+
+class TestMigrateJobDB:
+
+    """test bringing an old job database up to date"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def test(self):
+        db = sqlite3.connect(os.path.join(self.base_dir, 'jobs.sqlite'))
+        db.execute(dpf.process.db_ddl)
+        db.execute("INSERT INTO job (id, process) VALUES ('abc', 'echo')")
+        db.execute("INSERT INTO job (id, process) VALUES ('gone', 'echo')")
+        db.commit()
+        db.close()
+        os.mkdir(os.path.join(self.base_dir, 'abc'))
+        open(os.path.join(self.base_dir, 'abc', 'data'), 'w').write('data')
+        app = dpf.process.Application(self.base_dir, {})
+        db = sqlite3.connect(app.db_fname)
+        assert db.execute('PRAGMA user_version').fetchone()[0] == \
+               dpf.process.db_version
+        rows = db.execute('SELECT id, created, size FROM job ORDER BY id')
+        rows = rows.fetchall()
+        db.close()
+        assert rows[0][0] == 'abc'
+        assert rows[0][1] > 0
+        assert rows[0][2] == 4
+        assert rows[1] == ('gone', 0, None)
+        # a second migration does nothing
+        dpf.process.Application(self.base_dir, {})
+        assert self.tables() >= set(['launch', 'reap', 'local_job'])
+        return
+
+    def test_existing_tables(self):
+        """servers before version 5 created some tables on startup"""
+        db = sqlite3.connect(os.path.join(self.base_dir, 'jobs.sqlite'))
+        db.execute(dpf.process.db_ddl)
+        for version in xrange(4):
+            for statement in dpf.process.db_migrations[version]:
+                db.execute(statement)
+        db.execute(dpf.process.launch_ddl)
+        db.execute(dpf.process.reap_ddl)
+        db.execute(dpf.process.handlers.local_job_ddl)
+        db.execute("INSERT INTO launch (id) VALUES ('abc')")
+        db.execute('PRAGMA user_version = 4')
+        db.commit()
+        db.close()
+        app = dpf.process.Application(self.base_dir, {})
+        db = sqlite3.connect(app.db_fname)
+        assert db.execute('PRAGMA user_version').fetchone()[0] == \
+               dpf.process.db_version
+        assert db.execute('SELECT id FROM launch').fetchall() == [('abc', )]
+        db.close()
+        assert self.tables() >= set(['launch', 'reap', 'local_job'])
+        return
+
+    def tables(self):
+        db = sqlite3.connect(os.path.join(self.base_dir, 'jobs.sqlite'))
+        c = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = set( row[0] for row in c )
+        db.close()
+        return tables
+
+class TestMemoize:
+
+    """test reusing the results of jobs with the same input"""
+
+    def post(self, data, headers={}):
+        headers = dict(headers)
+        headers['Content-Type'] = 'text/plain'
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('POST', '/wcmemo', data, headers)
+        r = hc.getresponse()
+        r.read()
+        hc.close()
+        return (r.status, r.getheader('Location').split('/')[-1])
+
+    def test(self):
+        data = 'memoize %f\n' % time.time()
+        (status, ident) = self.post(data)
+        assert status == 201
+        wait_for_job(ident, ('completed', ))
+        assert self.post(data) == (303, ident)
+        # a different input or content type is a different job
+        (status, other) = self.post(data + 'x')
+        assert status == 201
+        # no-cache forces a new job
+        headers = {'Cache-Control': 'no-cache'}
+        (status, forced) = self.post(data, headers)
+        assert status == 201
+        assert forced != ident
+        wait_for_job(forced, ('completed', ))
+        # the newest completed job is reused, and deleted ones aren't
+        assert self.post(data) == (303, forced)
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('DELETE', '/job/%s' % forced)
+        assert hc.getresponse().status == 204
+        hc.close()
+        assert self.post(data) == (303, ident)
+        return
+
+    def test_not_completed(self):
+        """only completed jobs are reused"""
+        data = 'memoize %f\n' % time.time()
+        (status, ident) = self.post(data)
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('DELETE', '/job/%s' % ident)
+        assert hc.getresponse().status == 204
+        hc.close()
+        (status, new_ident) = self.post(data)
+        assert status == 201
+        assert new_ident != ident
+        return
+
+class RunningHandler(dpf.process.handlers.tests.EchoHandler):
+
+    """handler whose jobs are always running"""
+
+    def get_status(self, job_dir):
+        return 'running'
+
+class TestMemoizeStatus:
+
+    """test that reused jobs are confirmed completed by their handlers"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.app = dpf.process.Application(self.base_dir, 
+                                           {'run': RunningHandler()}, 
+                                           memoize=['run'])
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def test(self):
+        self.app.register_job('job1', 'run', 0, 'key')
+        with self.app.db_pool.transaction() as db:
+            db.execute("UPDATE job SET status = 'completed'")
+        assert self.app.find_memo_job('key') is None
+        assert self.app.get_job('job1')['status'] == 'running'
+        return
+
+class CountingHandler(RunningHandler):
+
+    """handler whose jobs are always running, counting status lookups"""
+
+    def __init__(self, tracks_status=True):
+        RunningHandler.__init__(self)
+        self.tracks_status = tracks_status
+        self.n_lookups = 0
+        return
+
+    def get_status(self, job_dir):
+        self.n_lookups += 1
+        return RunningHandler.get_status(self, job_dir)
+
+class TestJobListRefresh:
+
+    """test that job listings look up a bounded number of statuses"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.tracked = CountingHandler()
+        self.untracked = CountingHandler(False)
+        handlers = {'tracked': self.tracked, 'untracked': self.untracked}
+        self.app = dpf.process.Application(self.base_dir, handlers)
+        for i in xrange(50):
+            self.app.register_job('t%02d' % i, 'tracked', 0)
+            self.app.register_job('u%02d' % i, 'untracked', 0)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def list(self, process):
+        environ = {'REQUEST_METHOD': 'GET', 
+                   'QUERY_STRING': 'process=%s&limit=1000' % process, 
+                   'HTTP_ACCEPT': 'application/json'}
+        wsgiref.util.setup_testing_defaults(environ)
+        (status, headers, output) = self.app.handle_job_list(environ)
+        return json.loads(''.join(output))['jobs']
+
+    def test(self):
+        jobs = self.list('tracked')
+        assert self.tracked.n_lookups == dpf.process.max_list_refreshes
+        statuses = [ job['status'] for job in jobs ]
+        n = dpf.process.max_list_refreshes
+        assert statuses == ['running'] * n + [None] * (50 - n)
+        return
+
+    def test_untracked(self):
+        jobs = self.list('untracked')
+        assert len(jobs) == 50
+        assert self.untracked.n_lookups == 0
+        return
+
+class TestPipeline:
+
+    """test server-side pipelines"""
+
+    def post(self, spec):
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('POST', 
+                   '/pipeline', 
+                   json.dumps(spec), 
+                   {'Content-Type': 'application/json'})
+        r = hc.getresponse()
+        r.read()
+        hc.close()
+        if r.status != 201:
+            return (r.status, None)
+        return (r.status, r.getheader('Location').split('/')[-1])
+
+    def get(self, pipeline_id, accept='application/json'):
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('GET', '/pipeline/%s' % pipeline_id, '', {'Accept': accept})
+        r = hc.getresponse()
+        data = r.read()
+        hc.close()
+        assert r.status == 200
+        return data
+
+    def wait(self, pipeline_id, timeout=10):
+        t0 = time.time()
+        while time.time() - t0 < timeout:
+            d = json.loads(self.get(pipeline_id))
+            if d['status'] != 'running':
+                return d
+            time.sleep(0.1)
+        raise AssertionError('pipeline %s still running' % pipeline_id)
+
+    def test(self):
+        spec = {'stages': [{'process': 'wclocal'}, {'process': 'echo'}], 
+                'input': {'data': 'one two\nthree\n', 
+                          'content_type': 'text/plain'}}
+        (status, pipeline_id) = self.post(spec)
+        assert status == 201
+        d = self.wait(pipeline_id)
+        assert d['status'] == 'completed'
+        assert [ s['process'] for s in d['stages'] ] == ['wclocal', 'echo']
+        idents = [ s['job'].split('/')[-1] for s in d['stages'] ]
+        assert d['output'].endswith('/job/%s/stdout' % idents[1])
+        # the output of the first stage is linked, not copied
+        st1 = os.stat('tmp/process/%s/stdout' % idents[0])
+        st2 = os.stat('tmp/process/%s/data' % idents[1])
+        assert st1.st_ino == st2.st_ino
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('GET', '/job/%s/stdout' % idents[1])
+        assert hc.getresponse().read().split() == ['2', '3', '14']
+        hc.close()
+        assert self.get(pipeline_id, 'text/plain').startswith('status: ')
+        return
+
+    def test_job_input(self):
+        ident = post_job('echo', 'a b c\n')
+        spec = {'stages': [{'process': 'wclocal'}], 
+                'input': {'job': ident}}
+        (status, pipeline_id) = self.post(spec)
+        assert status == 201
+        assert self.wait(pipeline_id)['status'] == 'completed'
+        return
+
+    def test_error(self):
+        """a stage that rejects its input fails the pipeline"""
+        spec = {'stages': [{'process': 'wclocal'}, {'process': 'slowecho'}], 
+                'input': {'data': 'x\n', 'content_type': 'text/plain'}}
+        (status, pipeline_id) = self.post(spec)
+        assert status == 201
+        d = self.wait(pipeline_id)
+        assert d['status'] == 'error'
+        assert 'number' in d['error']
+        assert d['stages'][1]['job'] is None
+        return
+
+    def test_bad_request(self):
+        assert self.post({'stages': [{'process': 'bogus'}], 
+                          'input': {'data': '', 
+                                    'content_type': 'text/plain'}})[0] == 400
+        assert self.post({'stages': [], 
+                          'input': {'data': '', 
+                                    'content_type': 'text/plain'}})[0] == 400
+        assert self.post({'stages': [{'process': 'echo'}]})[0] == 400
+        # the first job is validated when the pipeline is created
+        assert self.post({'stages': [{'process': 'slowecho'}], 
+                          'input': {'data': 'x', 
+                                    'content_type': 'text/plain'}})[0] == 400
+        return
+
+    def test_negative_content_length(self):
+        """the request is refused without reading the body"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.settimeout(5)
+        s.connect(('localhost', 8081))
+        s.sendall('POST /pipeline HTTP/1.0\r\n' + 
+                  'Content-Type: application/json\r\n' + 
+                  'Content-Length: -1\r\n\r\n')
+        fo = s.makefile()
+        status_line = fo.readline()
+        fo.close()
+        s.close()
+        assert status_line.split(None, 1)[1].strip() == '400 Bad Request'
+        return
+
+    def test_not_found(self):
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('GET', '/pipeline/bogus')
+        assert hc.getresponse().status == 404
+        hc.close()
+        return
+
+class TestFetch:
+
+    """test job inputs given by URL"""
+
+    data_port = 8085
+    port = 8086
+
+    def setUp(self):
+        self.data_server = start_data_server(self.data_port, 'tmp/fetchdata')
+        url = 'http://localhost:%d/' % self.data_port
+        self.server = start_process_server(self.port, 
+                                           'tmp/process_fetch', 
+                                           ['--data-server', url, 
+                                            '--memoize', 'wcmemo'])
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        stop_server(*self.data_server)
+        return
+
+    def request(self, port, method, path, body='', headers={}):
+        hc = httplib.HTTPConnection('localhost', port)
+        hc.request(method, path, body, headers)
+        r = hc.getresponse()
+        data = r.read()
+        hc.close()
+        return (r, data)
+
+    def upload(self, data):
+        headers = {'Content-Type': 'text/csv'}
+        (r, data) = self.request(self.data_port, 'POST', '/', data, headers)
+        assert r.status == 201
+        return r.getheader('Location')
+
+    def post(self, process, url):
+        headers = {'Content-Type': 'text/uri-list'}
+        (r, data) = self.request(self.port, 'POST', '/%s' % process, 
+                                 '# input\r\n%s\r\n' % url, headers)
+        return (r.status, r.getheader('Location', '').split('/')[-1])
+
+    def test(self):
+        url = self.upload('a,b\n1,2\n')
+        (status, ident1) = self.post('wclocal', url)
+        assert status == 201
+        (status, ident2) = self.post('wclocal', url)
+        assert status == 201
+        for ident in (ident1, ident2):
+            assert wait_for_job(ident, ('completed', ), self.port)
+            path = '/job/%s/stdout' % ident
+            (r, data) = self.request(self.port, 'GET', path)
+            assert data.split() == ['2', '2', '8']
+        # both jobs have links to one fetched copy
+        st1 = os.stat('tmp/process_fetch/%s/data' % ident1)
+        st2 = os.stat('tmp/process_fetch/%s/data' % ident2)
+        assert st1.st_ino == st2.st_ino
+        assert open('tmp/process_fetch/%s/url' % ident1).read() == url + '\n'
+        assert open('tmp/process_fetch/%s/content-type' % ident1).read() == \
+               'text/csv'
+        return
+
+    def test_memoize(self):
+        """memoized jobs are reused for the same version of the data"""
+        url = self.upload('a,b\n')
+        (status, ident) = self.post('wcmemo', url)
+        wait_for_job(ident, ('completed', ), self.port)
+        assert self.post('wcmemo', url) == (303, ident)
+        return
+
+    def test_bad_url(self):
+        (status, ident) = self.post('wclocal', 'http://localhost:1/12345678')
+        assert status == 400
+        url = 'http://localhost:%d/00000000' % self.data_port
+        (status, ident) = self.post('wclocal', url)
+        assert status == 400
+        return
+
+    def test_local(self):
+        """data is copied from the data server's store if it can be"""
+        url = self.upload('a,b\n1,2\n')
+        cache_dir = tempfile.mkdtemp(dir='tmp')
+        try:
+            fc = dpf.process.fetch.FetchCache(cache_dir, 
+                                              {url.rsplit('/', 1)[0]: 
+                                               'tmp/fetchdata'})
+            fname = os.path.join(cache_dir, 'job_data')
+            # stop the data server, so the data can't come from it
+            stop_server(*self.data_server)
+            (content_type, etag) = fc.fetch(url, fname)
+            self.data_server = start_data_server(self.data_port, 
+                                                 'tmp/fetchdata')
+            assert content_type == 'text/csv'
+            assert open(fname).read() == 'a,b\n1,2\n'
+            # the entity tag is the data server's
+            (r, data) = self.request(self.data_port, 'GET', 
+                                     url[url.rindex('/'):])
+            assert r.getheader('ETag') == etag
+            # fetched over HTTP, the same version comes from the cache
+            fc.data_servers = dict.fromkeys(fc.data_servers)
+            os.unlink(fname)
+            assert fc.fetch(url, fname) == (content_type, etag)
+            assert os.stat(fname).st_nlink == 2
+        finally:
+            shutil.rmtree(cache_dir)
+        return
+
+    def test_evict(self):
+        """the least recently used fetched data is removed from the cache"""
+        urls = [ self.upload('a,b\n%d,%d\n' % (i, i)) for i in xrange(3) ]
+        base_url = urls[0].rsplit('/', 1)[0]
+        cache_dir = tempfile.mkdtemp(dir='tmp')
+        try:
+            # room for two of the 8-byte datasets
+            fc = dpf.process.fetch.FetchCache(cache_dir, {base_url: None}, 20)
+            fname = os.path.join(cache_dir, 'job_data')
+            def cached(url):
+                key = hashlib.sha256(url).hexdigest()
+                with open(os.path.join(cache_dir, key + '.json')) as fo:
+                    etag = json.load(fo)['etag']
+                return os.path.exists(fc._entry_fname(key, str(etag)))
+            for url in (urls[0], urls[1], urls[0], urls[2]):
+                fc.fetch(url, fname)
+                os.unlink(fname)
+            assert cached(urls[0])
+            assert not cached(urls[1])
+            assert cached(urls[2])
+            # an evicted dataset is fetched again
+            fc.fetch(urls[1], fname)
+            assert open(fname).read() == 'a,b\n1,1\n'
+        finally:
+            shutil.rmtree(cache_dir)
+        return
+
+    def test_too_large(self):
+        """data larger than max_input_size isn't fetched"""
+        url = self.upload('a,b\n1,2\n')
+        base_url = url.rsplit('/', 1)[0]
+        cache_dir = tempfile.mkdtemp(dir='tmp')
+        try:
+            fname = os.path.join(cache_dir, 'job_data')
+            for base_dir in (None, 'tmp/fetchdata'):
+                fc = dpf.process.fetch.FetchCache(cache_dir, 
+                                                  {base_url: base_dir}, 
+                                                  None, 
+                                                  4)
+                try:
+                    fc.fetch(url, fname)
+                except dpf.process.fetch.FetchTooLarge:
+                    pass
+                else:
+                    assert False, 'FetchTooLarge not raised'
+            # a copy without a known size stops at the limit
+            try:
+                fc._write_tmp(iter(['abc', 'def']), url)
+            except dpf.process.fetch.FetchTooLarge:
+                pass
+            else:
+                assert False, 'FetchTooLarge not raised'
+            assert not [ f for f in os.listdir(cache_dir) 
+                         if f.endswith('.tmp') ]
+            assert not os.path.exists(fname)
+        finally:
+            shutil.rmtree(cache_dir)
+        return
+
+class TestDelete:
+
+    """test deleting jobs"""
+
+    def test(self):
+        ident = post_job('sleep', '10')
+        wait_for_job(ident, ('running', ))
+        hc = httplib.HTTPConnection('localhost', 8081)
+        hc.request('DELETE', '/job/%s' % ident)
+        assert hc.getresponse().status == 204
+        hc.close()
+        assert job_status_code(ident) == 410
+        # the job is stopped and its directory removed in the background
+        wait_for_removal('tmp/process/%s' % ident)
+        ident = post_job('sleep', '0')
+        assert wait_for_job(ident, ('completed', )) == 'completed'
+        return
+
+    def test_orphaned(self):
+        """a cleanup left by a process that has gone is taken over"""
+        ident = post_job('echo', 'orphan')
+        po = subprocess.Popen(['true'])
+        po.wait()
+        db = sqlite3.connect('tmp/process/jobs.sqlite', timeout=60)
+        db.execute("""UPDATE job SET deleted = 1, deleted_time = ? 
+                       WHERE id = ?""", 
+                   (time.time(), ident))
+        db.execute("""INSERT INTO reap (id, process, launched, owner) 
+                      VALUES (?, 'echo', 1, ?)""", 
+                   (ident, po.pid))
+        db.commit()
+        db.close()
+        wait_for_removal('tmp/process/%s' % ident)
+        return
+
+class TestPurge:
+
+    """test removing deleted jobs from the job database"""
+
+    port = 8087
+
+    def setUp(self):
+        self.server = start_process_server(self.port, 
+                                           'tmp/process_purge', 
+                                           ['--purge-deleted', '0'])
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        return
+
+    def test(self):
+        ident = post_job('echo', 'purge me', self.port)
+        hc = httplib.HTTPConnection('localhost', self.port)
+        hc.request('DELETE', '/job/%s' % ident)
+        assert hc.getresponse().status == 204
+        hc.close()
+        t0 = time.time()
+        while job_status_code(ident, self.port) == 410:
+            assert time.time() - t0 < 10
+            time.sleep(0.1)
+        assert job_status_code(ident, self.port) == 404
+        assert not os.path.exists('tmp/process_purge/%s' % ident)
+        return
+
+class TestSGEDelete:
+
+    """test deleting SGE jobs using a fake qdel"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.calls_fname = os.path.join(self.dir, 'calls')
+        fname = os.path.join(self.dir, 'qdel')
+        with open(fname, 'w') as fo:
+            fo.write('#!/bin/sh\n')
+            fo.write('echo "$@" >> %s\n' % self.calls_fname)
+        os.chmod(fname, 0755)
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = '%s:%s' % (self.dir, self.old_path)
+        return
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.dir)
+        return
+
+    def test(self):
+        job_dirs = []
+        for job_id in (11, 12, None, 13):
+            job_dir = tempfile.mkdtemp(dir=self.dir)
+            if job_id is not None:
+                open(os.path.join(job_dir, 'job_id'), 'w').write(str(job_id))
+            job_dirs.append(job_dir)
+        ph = dpf.process.handlers.tests.WCHandler()
+        ph.delete_jobs(job_dirs)
+        # one qdel, skipping the job that was never submitted
+        assert open(self.calls_fname).read() == '11 12 13\n'
+        return
+
+class TestOutput(BaseProcessTest):
+
+    """test fetching subpart files"""
+
+    n_process_connections = 1
+
+    def setUp(self):
+        BaseProcessTest.setUp(self)
+        self.ident = post_job('echo', 'some data')
+        return
+
+    def get(self, path, headers={}):
+        r = self.process_request('GET', '/job/%s/%s' % (self.ident, path), 
+                                 '', headers)
+        return (r, r.read())
+
+    def test(self):
+        (r, data) = self.get('stdout')
+        assert r.status == 200
+        assert r.getheader('Content-Type') == 'text/plain'
+        assert r.getheader('Content-Length') == '9'
+        assert data == 'some data'
+        return
+
+    def test_offset(self):
+        (r, data) = self.get('stdout?offset=5')
+        assert r.status == 200
+        assert r.getheader('Content-Length') == '4'
+        assert data == 'data'
+        return
+
+    def test_offset_end(self):
+        (r, data) = self.get('stdout?offset=100')
+        assert r.status == 200
+        assert data == ''
+        return
+
+    def test_bad_offset(self):
+        (r, data) = self.get('stdout?offset=-1')
+        assert r.status == 400
+        return
+
+    def test_range(self):
+        (r, data) = self.get('stdout', {'Range': 'bytes=0-3'})
+        assert r.status == 206
+        assert r.getheader('Content-Range') == 'bytes 0-3/9'
+        assert data == 'some'
+        return
+
+class TestWait(BaseProcessTest):
+
+    """test waiting for job status changes"""
+
+    n_process_connections = 2
+
+    def test_long_poll(self):
+        ident = post_job('sleep', '1')
+        assert wait_for_job(ident, ('running', )) == 'running'
+        t0 = time.time()
+        headers = {'Accept': 'application/json'}
+        r = self.process_request('GET', '/job/%s?wait=10' % ident, '', headers)
+        assert r.status == 200
+        assert json.loads(r.read())['job_status'] == 'completed'
+        assert time.time() - t0 < 5
+        return
+
+    def test_final(self):
+        """a job whose status won't change doesn't wait"""
+        ident = post_job('echo', 'data')
+        t0 = time.time()
+        r = self.process_request('GET', '/job/%s?wait=10' % ident)
+        assert r.status == 200
+        r.read()
+        assert time.time() - t0 < 1
+        return
+
+    def test_bad_wait(self):
+        ident = post_job('echo', 'data')
+        r = self.process_request('GET', '/job/%s?wait=bogus' % ident)
+        assert r.status == 400
+        return
+
+    def test_events(self):
+        ident = post_job('sleep', '0.5')
+        r = self.process_request('GET', '/job/%s/events' % ident)
+        assert r.status == 200
+        assert r.getheader('Content-Type') == 'text/event-stream'
+        statuses = []
+        for event in r.read().split('\n\n'):
+            if event.startswith('event: status\n'):
+                data = event.split('\n')[1]
+                assert data.startswith('data: ')
+                statuses.append(json.loads(data[6:])['job_status'])
+        assert statuses[-1] == 'completed'
+        assert len(set(statuses)) == len(statuses)
+        return
+
+class TestWaitOneThread:
+
+    """test that a single-threaded server doesn't wait for status changes"""
+
+    port = 8088
+
+    def setUp(self):
+        self.server = start_process_server(self.port, 'tmp/process_single')
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        return
+
+    def test_long_poll(self):
+        ident = post_job('sleep', '2', self.port)
+        t0 = time.time()
+        hc = httplib.HTTPConnection('localhost', self.port)
+        hc.request('GET', '/job/%s?wait=10' % ident)
+        r = hc.getresponse()
+        assert r.status == 200
+        r.read()
+        hc.close()
+        assert time.time() - t0 < 1
+        return
+
+    def test_events(self):
+        ident = post_job('sleep', '2', self.port)
+        hc = httplib.HTTPConnection('localhost', self.port)
+        hc.request('GET', '/job/%s/events' % ident)
+        r = hc.getresponse()
+        assert r.status == 503
+        r.read()
+        hc.close()
+        # the server is still free for other requests
+        assert job_status_code(ident, self.port) == 200
+        return
+
+class TestStatusWatcher:
+
+    """test the shared status poller"""
+
+    def setUp(self):
+        self.watcher = dpf.process.watcher.StatusWatcher(0.1)
+        self.status = 'running'
+        self.n_lookups = 0
+        return
+
+    def get_status(self):
+        self.n_lookups += 1
+        return self.status
+
+    def test_timeout(self):
+        t0 = time.time()
+        status = self.watcher.wait('job', self.get_status, 'running', 0.3)
+        assert status == 'running'
+        assert 0.3 <= time.time() - t0 < 1
+        return
+
+    def test_shared(self):
+        """many waiters on a job cost one lookup per interval"""
+        results = []
+        def wait():
+            results.append(self.watcher.wait('job', 
+                                             self.get_status, 
+                                             'running', 
+                                             5))
+        threads = [ threading.Thread(target=wait) for i in xrange(50) ]
+        for t in threads:
+            t.start()
+        time.sleep(0.5)
+        self.status = 'completed'
+        for t in threads:
+            t.join()
+        assert results == ['completed'] * 50
+        assert self.n_lookups < 10
+        return
+
+class TestLocalPoolDeleted:
+
+    """test that queued local jobs that are deleted aren't run"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.ph = dpf.process.handlers.tests.LocalWCHandler()
+        self.app = dpf.process.Application(self.base_dir, {'wc': self.ph})
+        # the handler's worker threads aren't started, so jobs are only 
+        # claimed here
+        self.ph.app = self.app
+        self.ph.label = 'wc'
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def test(self):
+        for ident in ('job1', 'job2'):
+            self.app.register_job(ident, 'wc', 0)
+            self.ph.launch(os.path.join(self.base_dir, ident))
+        # deleted, but not yet deleted by the handler
+        self.app.delete_job('job1')
+        assert self.ph._claim() == 'job2'
+        assert self.ph._claim() is None
+        assert self.ph.get_status(os.path.join(self.base_dir, 'job1')) == \
+               'queued'
+        return
+
+class TestLocalPoolRestart:
+
+    """test that queued and interrupted local jobs survive a server crash"""
+
+    def setUp(self):
+        self.cache = 'tmp/process_restart'
+        self.server = start_process_server(8083, self.cache)
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        return
+
+    def test(self):
+        running = post_job('sleep', '1', 8083)
+        assert wait_for_job(running, ('running', ), 8083) == 'running'
+        queued = post_job('sleep', '0', 8083)
+        self.server[0].kill()
+        self.server[0].wait()
+        stop_server(*self.server)
+        self.server = start_process_server(8083, self.cache)
+        for ident in (running, queued):
+            assert wait_for_job(ident, ('completed', ), 8083) == 'completed'
+        return
+
+class TestAsyncLaunch:
+
+    """test returning from job creation before the launch"""
+
+    port = 8084
+
+    def setUp(self):
+        self.cache = 'tmp/process_async'
+        self.server = start_process_server(self.port, 
+                                           self.cache, 
+                                           ['--async-launch'])
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        return
+
+    def request(self, method, path, body=None, headers={}):
+        hc = httplib.HTTPConnection('localhost', self.port)
+        hc.request(method, path, body, headers)
+        r = hc.getresponse()
+        data = r.read()
+        hc.close()
+        return (r, data)
+
+    def post(self, data):
+        headers = {'Content-Type': 'text/plain'}
+        (r, data) = self.request('POST', '/slowecho', data, headers)
+        assert r.status == 202
+        assert r.reason == 'Accepted'
+        return r.getheader('Location').split('/')[-1]
+
+    def info(self, ident):
+        headers = {'Accept': 'application/json'}
+        (r, data) = self.request('GET', '/job/%s' % ident, None, headers)
+        assert r.status == 200
+        return json.loads(data)
+
+    def wait_for_launch(self, ident):
+        t0 = time.time()
+        while time.time() - t0 < 10:
+            info = self.info(ident)
+            if info.get('job_status') != 'queued':
+                return info
+            time.sleep(0.1)
+        raise AssertionError('job %s not launched' % ident)
+
+    def test(self):
+        t0 = time.time()
+        ident = self.post('1')
+        assert time.time() - t0 < 0.5
+        assert self.info(ident) == {'job_status': 'queued'}
+        (r, data) = self.request('GET', '/job/%s/stdout' % ident)
+        assert r.status == 404
+        info = self.wait_for_launch(ident)
+        assert info['process'] == 'echo'
+        (r, data) = self.request('GET', '/job/%s/stdout' % ident)
+        assert r.status == 200
+        assert data == '1'
+        return
+
+    def test_error(self):
+        ident = self.post('-0.1')
+        info = self.wait_for_launch(ident)
+        assert info == {'job_status': 'error', 'error': 'launch failed'}
+        (r, data) = self.request('DELETE', '/job/%s' % ident)
+        assert r.status == 204
+        wait_for_removal(os.path.join(self.cache, ident))
+        return
+
+    def test_bad_request(self):
+        headers = {'Content-Type': 'text/plain'}
+        (r, data) = self.request('POST', '/slowecho', 'bogus', headers)
+        assert r.status == 400
+        return
+
+    def test_delete_pending(self):
+        ident = self.post('0.5')
+        (r, data) = self.request('DELETE', '/job/%s' % ident)
+        assert r.status == 204
+        (r, data) = self.request('GET', '/job/%s' % ident)
+        assert r.status == 410
+        time.sleep(1)
+        assert not os.path.exists(os.path.join(self.cache, ident))
+        return
+
+    def test_restart(self):
+        ident = self.post('0.5')
+        self.server[0].kill()
+        self.server[0].wait()
+        stop_server(*self.server)
+        self.server = start_process_server(self.port, 
+                                           self.cache, 
+                                           ['--async-launch'])
+        info = self.wait_for_launch(ident)
+        assert info['process'] == 'echo'
+        return
+
+class LaunchCountHandler(dpf.process.handlers.tests.EchoHandler):
+
+    """handler that counts its launches and may not know whether an 
+    interrupted one happened
+    """
+
+    def __init__(self, launched=None):
+        dpf.process.handlers.tests.EchoHandler.__init__(self)
+        self.n_launches = 0
+        self.launched_value = launched
+        return
+
+    def launch(self, job_dir):
+        self.n_launches += 1
+        return
+
+    def launched(self, job_dir):
+        return self.launched_value
+
+class TestInterruptedLaunch:
+
+    """test taking over a launch that was interrupted part way"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def interrupted_launch(self, ph):
+        app = dpf.process.Application(self.base_dir, {'count': ph})
+        app.register_job('job1', 'count', 0, pending_launch=True)
+        job_dir = os.path.join(self.base_dir, 'job1')
+        os.mkdir(job_dir)
+        open(os.path.join(job_dir, 'data'), 'w').close()
+        open(os.path.join(job_dir, 'launch_attempted'), 'w').close()
+        app._launch_job('job1')
+        return app
+
+    def test_launched(self):
+        ph = LaunchCountHandler(True)
+        app = self.interrupted_launch(ph)
+        assert ph.n_launches == 0
+        assert app.get_job('job1')['launch_state'] is None
+        return
+
+    def test_not_launched(self):
+        ph = LaunchCountHandler(False)
+        app = self.interrupted_launch(ph)
+        assert ph.n_launches == 1
+        assert app.get_job('job1')['launch_state'] is None
+        return
+
+    def test_unknown(self):
+        ph = LaunchCountHandler(None)
+        app = self.interrupted_launch(ph)
+        assert ph.n_launches == 0
+        job_dict = app.get_job('job1')
+        assert job_dict['launch_state'] == 'error'
+        assert job_dict['launch_message'] == 'launch interrupted'
+        return
+
+class TestGracefulRestart:
+
+    """test that a graceful restart of a pre-forked server doesn't lose 
+    pending launches
+    """
+
+    port = 8089
+
+    def setUp(self):
+        args = ['--async-launch', '--launch-threads', '1', 
+                '--workers', '2', '--threads', '2']
+        self.server = start_process_server(self.port, 
+                                           'tmp/process_hup', 
+                                           args)
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        return
+
+    def test(self):
+        idents = []
+        for i in xrange(4):
+            hc = httplib.HTTPConnection('localhost', self.port)
+            hc.request('POST', '/slowecho', '1', 
+                       {'Content-Type': 'text/plain'})
+            r = hc.getresponse()
+            r.read()
+            hc.close()
+            assert r.status == 202
+            idents.append(r.getheader('Location').split('/')[-1])
+        self.server[0].send_signal(signal.SIGHUP)
+        for ident in idents:
+            t0 = time.time()
+            while True:
+                hc = httplib.HTTPConnection('localhost', self.port)
+                hc.request('GET', '/job/%s' % ident, '', 
+                           {'Accept': 'application/json'})
+                r = hc.getresponse()
+                info = json.loads(r.read())
+                hc.close()
+                if info.get('job_status') != 'queued':
+                    break
+                assert time.time() - t0 < 20, 'job %s not launched' % ident
+                time.sleep(0.1)
+            assert info['process'] == 'echo'
+        return
+
+    def test_pipeline(self):
+        spec = {'stages': [{'process': 'sleep'}, {'process': 'echo'}], 
+                'input': {'data': '2', 'content_type': 'text/plain'}}
+        hc = httplib.HTTPConnection('localhost', self.port)
+        hc.request('POST', '/pipeline', json.dumps(spec), 
+                   {'Content-Type': 'application/json'})
+        r = hc.getresponse()
+        r.read()
+        hc.close()
+        assert r.status == 201
+        pipeline_id = r.getheader('Location').split('/')[-1]
+        # the worker running the pipeline exits
+        self.server[0].send_signal(signal.SIGHUP)
+        t0 = time.time()
+        while True:
+            hc = httplib.HTTPConnection('localhost', self.port)
+            hc.request('GET', '/pipeline/%s' % pipeline_id, '', 
+                       {'Accept': 'application/json'})
+            r = hc.getresponse()
+            state = json.loads(r.read())['status']
+            hc.close()
+            if state != 'running':
+                break
+            assert time.time() - t0 < 20, 'pipeline still running'
+            time.sleep(0.1)
+        assert state == 'completed'
+        return
+
+class TestConnectionPool:
+
+    """test the job database connection pool"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.pool = dpf.db.ConnectionPool(os.path.join(self.base_dir, 'db'))
+        with self.pool.transaction() as db:
+            db.execute("CREATE TABLE t (x INTEGER)")
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        return
+
+    def test(self):
+        db = self.pool.connection()
+        assert self.pool.connection() is db
+        mode = db.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode.lower() == 'wal'
+        return
+
+    def test_threads(self):
+        dbs = []
+        def insert():
+            with self.pool.transaction() as db:
+                db.execute("INSERT INTO t (x) VALUES (1)")
+            dbs.append(self.pool.connection())
+            return
+        threads = [ threading.Thread(target=insert) for i in xrange(4) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set( id(db) for db in dbs )) == 4
+        db = self.pool.connection()
+        assert db.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 4
+        return
+
+    def test_rollback(self):
+        try:
+            with self.pool.transaction() as db:
+                db.execute("INSERT INTO t (x) VALUES (1)")
+                raise ValueError()
+        except ValueError:
+            pass
+        db = self.pool.connection()
+        assert db.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+        return
+
+qstat_output = """job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID 
+-----------------------------------------------------------------------------------------------------------------
+     11 0.55500 wc.sge     dpf          r     01/01/2015 00:00:00 all.q@node1                        1        
+     12 0.00000 wc.sge     dpf          qw    01/01/2015 00:00:01                                    1        
+     13 0.00000 wc.sge     dpf          Eqw   01/01/2015 00:00:02                                    1        
+"""
+
+class TestSGEStatusCache:
+
+    """test the SGE status cache using a fake qstat"""
+
+    def setUp(self):
+        self.bin_dir = tempfile.mkdtemp()
+        self.calls_fname = os.path.join(self.bin_dir, 'calls')
+        open(os.path.join(self.bin_dir, 'output'), 'w').write(qstat_output)
+        fname = os.path.join(self.bin_dir, 'qstat')
+        with open(fname, 'w') as fo:
+            fo.write('#!/bin/sh\n')
+            fo.write('echo >> %s\n' % self.calls_fname)
+            fo.write('cat %s\n' % os.path.join(self.bin_dir, 'output'))
+        os.chmod(fname, 0755)
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = '%s:%s' % (self.bin_dir, self.old_path)
+        return
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.bin_dir)
+        return
+
+    def n_calls(self):
+        if not os.path.exists(self.calls_fname):
+            return 0
+        return len(open(self.calls_fname).readlines())
+
+    def test(self):
+        cache = dpf.process.handlers.SGEStatusCache(interval=60, 
+                                                    min_refresh=60)
+        status = dpf.process.handlers.sge_status
+        assert status(cache.get(11)) == 'running'
+        assert status(cache.get(12)) == 'queued'
+        assert status(cache.get(13)) == 'error'
+        assert status(cache.get(14)) == 'completed'
+        assert self.n_calls() == 1
+        return
+
+    def test_miss(self):
+        cache = dpf.process.handlers.SGEStatusCache(interval=60, 
+                                                    min_refresh=0)
+        assert cache.get(11) == 'r'
+        assert cache.get(14) is None
+        assert self.n_calls() == 2
+        return
+
+    def test_submitted(self):
+        """a job submitted since the last qstat isn't taken as completed"""
+        cache = dpf.process.handlers.SGEStatusCache(interval=60, 
+                                                    min_refresh=60)
+        assert cache.get(11) == 'r'
+        time.sleep(0.01)
+        submitted = time.time()
+        with open(os.path.join(self.bin_dir, 'output'), 'a') as fo:
+            fo.write('     14 0.00000 wc.sge     dpf          qw    ' + 
+                     '01/01/2015 00:00:03          1\n')
+        assert cache.get(14, submitted) == 'qw'
+        assert self.n_calls() == 2
+        # a job that finished before the next qstat is then completed
+        assert cache.get(15, submitted) is None
+        assert self.n_calls() == 2
+        assert cache.get(15, time.time()) is None
+        assert self.n_calls() == 3
+        return
+
+    def test_job_status(self):
+        """the status recorded for a new SGE job isn't completed"""
+        base_dir = tempfile.mkdtemp(dir=self.bin_dir)
+        handlers = {'wc': dpf.process.handlers.tests.WCHandler()}
+        app = dpf.process.Application(base_dir, handlers)
+        old_cache = dpf.process.handlers.sge_status_cache
+        cache = dpf.process.handlers.SGEStatusCache(interval=60, 
+                                                    min_refresh=60)
+        dpf.process.handlers.sge_status_cache = cache
+        try:
+            # the last qstat was before the job was submitted
+            cache.get(11)
+            time.sleep(0.01)
+            job_dir = tempfile.mkdtemp(prefix='', dir=base_dir)
+            ident = os.path.basename(job_dir)
+            open(os.path.join(job_dir, 'job_id'), 'w').write('14\n')
+            app.register_job(ident, 'wc', 0)
+            with open(os.path.join(self.bin_dir, 'output'), 'a') as fo:
+                fo.write('     14 0.00000 wc.sge     dpf          qw    ' + 
+                         '01/01/2015 00:00:03          1\n')
+            assert app.get_job_status(ident) == 'queued'
+            assert app.get_job(ident)['status'] == 'queued'
+        finally:
+            dpf.process.handlers.sge_status_cache = old_cache
+        return
+
+    def test_ttl(self):
+        cache = dpf.process.handlers.SGEStatusCache(interval=60, ttl=0.1)
+        cache.get(11)
+        time.sleep(0.2)
+        cache.get(11)
+        assert self.n_calls() == 2
+        return
+
+    def test_poller(self):
+        cache = dpf.process.handlers.SGEStatusCache(interval=0.1, 
+                                                    idle_timeout=0.45)
+        cache.get(11)
+        time.sleep(0.8)
+        # the poller should have run and then stopped
+        n = self.n_calls()
+        assert n >= 3
+        time.sleep(0.3)
+        assert self.n_calls() == n
+        return
+
+    def test_bad_state(self):
+        try:
+            dpf.process.handlers.sge_status('t')
+        except ValueError:
+            pass
+        else:
+            assert False
+        return
+
+coprocess_script = """#!/usr/bin/env python
+import sys
+import os
+import time
+sys.path.insert(0, %r)
+from dpf.process.handlers.coprocess import serve
+
+def description():
+    return (0, 'test handler\\n')
+
+def info(accept, job_dir):
+    return (0, 'text/plain\\npid: %%d\\n' %% os.getpid())
+
+def subpart(accept, job_dir, subpart):
+    if subpart == 'crash' and serving:
+        os._exit(1)
+    if subpart == 'sleep':
+        time.sleep(5)
+    return (0, 'text/plain\\n%%s\\n' %% subpart)
+
+commands = {'description': description, 'info': info, 'subpart': subpart}
+
+serving = sys.argv[1] == 'serve'
+if serving:
+    serve(commands)
+else:
+    (status, output) = commands[sys.argv[1]](*sys.argv[2:])
+    sys.stdout.write(output)
+    sys.exit(status)
+"""
+
+class TestCoprocess:
+
+    """test ScriptHandler's co-process mode"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.script = os.path.join(self.dir, 'test.ph')
+        top = os.path.dirname(os.path.dirname(os.path.abspath(dpf.__file__)))
+        open(self.script, 'w').write(coprocess_script % top)
+        os.chmod(self.script, 0755)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        return
+
+    def test(self):
+        handler = dpf.process.handlers.ScriptHandler(self.script, 
+                                                     'coprocess', 
+                                                     '1')
+        assert handler.description == 'test handler'
+        (mt, output) = handler.info('*/*', self.dir)
+        assert mt == 'text/plain'
+        assert output == handler.info('*/*', self.dir)[1]
+        return
+
+    def test_exec(self):
+        handler = dpf.process.handlers.ScriptHandler(self.script)
+        output = handler.info('*/*', self.dir)[1]
+        assert output != handler.info('*/*', self.dir)[1]
+        return
+
+    def test_crash(self):
+        handler = dpf.process.handlers.ScriptHandler(self.script, 
+                                                     'coprocess', 
+                                                     '1')
+        output = handler.info('*/*', self.dir)[1]
+        # falls back to running the script
+        result = handler.get_subpart('*/*', self.dir, 'crash')
+        assert result == ('text/plain', 'crash\n')
+        # and a new co-process is started
+        new_output = handler.info('*/*', self.dir)[1]
+        assert new_output != output
+        assert new_output == handler.info('*/*', self.dir)[1]
+        return
+
+    def test_timeout(self):
+        handler = dpf.process.handlers.ScriptHandler(self.script, 
+                                                     'coprocess', 
+                                                     '1', 
+                                                     '0.5')
+        try:
+            handler.get_subpart('*/*', self.dir, 'sleep')
+        except dpf.process.handlers.coprocess.CoprocessTimeout:
+            pass
+        else:
+            assert False
+        assert handler.get_subpart('*/*', self.dir, 'x')[1] == 'x\n'
+        return
+
+    def test_no_serve(self):
+        """a script without a co-process mode is run for each call"""
+        script = open(self.script).read()
+        script = script.replace("sys.argv[1] == 'serve'", 'False')
+        open(self.script, 'w').write(script)
+        handler = dpf.process.handlers.ScriptHandler(self.script, 
+                                                     'coprocess', 
+                                                     '1')
+        assert handler.pool is None
+        output = handler.info('*/*', self.dir)[1]
+        assert output != handler.info('*/*', self.dir)[1]
+        return
+
+class TestBCCoprocess:
+
+    """test bc.ph's co-process mode against running it for each call"""
+
+    def setUp(self):
+        top = os.path.dirname(os.path.dirname(os.path.abspath(dpf.__file__)))
+        self.script = os.path.join(top, 'bc.ph')
+        self.job_dir = tempfile.mkdtemp()
+        open(os.path.join(self.job_dir, 'stdout'), 'w').write('2\n')
+        stderr = 'a\\b "c"\td\r\n\n'
+        open(os.path.join(self.job_dir, 'stderr'), 'w').write(stderr)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+        return
+
+    def outcome(self, f, *args):
+        try:
+            return f(*args)
+        except dpf.BaseHTTPError, exc:
+            return exc.status
+
+    def test(self):
+        handler = dpf.process.handlers.ScriptHandler(self.script, 
+                                                     'coprocess', 
+                                                     '1')
+        assert handler.pool is not None
+        exec_handler = dpf.process.handlers.ScriptHandler(self.script)
+        calls = [('get_doc', '*/*'), 
+                 ('get_doc', 'image/png'), 
+                 ('info', 'text/plain', self.job_dir), 
+                 ('info', 'application/json', self.job_dir), 
+                 ('info', 'bogus', self.job_dir), 
+                 ('get_subpart', '*/*', self.job_dir, 'stdout'), 
+                 ('get_subpart', '*/*', self.job_dir, 'stderr'), 
+                 ('get_subpart', '*/*', self.job_dir, 'bogus')]
+        for call in calls:
+            expected = self.outcome(getattr(exec_handler, call[0]), *call[1:])
+            result = self.outcome(getattr(handler, call[0]), *call[1:])
+            assert result == expected, call
+        assert handler.get_subpart('*/*', self.job_dir, 'stderr') == \
+               ('text/plain', 'a\\b "c"\td\r\n\n')
+        return
+
+    def test_status(self):
+        """bc.ph doesn't track job statuses"""
+        handler = dpf.process.handlers.ScriptHandler(self.script)
+        assert handler.tracks_status
+        assert handler.get_status(self.job_dir) is None
+        assert not handler.tracks_status
+        return
+
 # eof
@@ -0,0 +1,145 @@
+# See file COPYING distributed with dpf for copyright and license.
+
+import os
+import signal
+import threading
+import time
+import httplib
+import dpf.server
+from . import start_data_server, stop_server
+
+port = 8082
+
+def request(*args):
+    hc = httplib.HTTPConnection('localhost', port)
+    try:
+        hc.request(*args)
+        r = hc.getresponse()
+        return (r.status, dict(r.getheaders()), r.read())
+    finally:
+        hc.close()
+
+def post_get_delete(results):
+    data = '1,2\na,%s\n' % os.urandom(8).encode('hex')
+    (status, headers, body) = request('POST',
+                                      '/',
+                                      data,
+                                      {'Content-Type': 'text/csv'})
+    assert status == 201
+    path = '/' + headers['location'].split('/')[-1]
+    (status, headers, body) = request('GET', path)
+    assert status == 200
+    assert body == data
+    (status, headers, body) = request('DELETE', path)
+    assert status == 204
+    results.append(True)
+    return
+
+class TestPrefork:
+
+    """test the pre-forked server"""
+
+    def setUp(self):
+        self.server = start_data_server(port,
+                                        'tmp/data_prefork',
+                                        ['--workers', '3',
+                                         '--threads', '2',
+                                         '--max-requests', '5'])
+        return
+
+    def tearDown(self):
+        stop_server(*self.server)
+        return
+
+    def run_clients(self, n):
+        results = []
+        threads = [ threading.Thread(target=post_get_delete, args=(results, ))
+                    for i in xrange(n) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(results) == n
+        return
+
+    def test(self):
+        """test concurrent requests and worker recycling"""
+        # 60 requests, so each worker is recycled several times
+        self.run_clients(20)
+        return
+
+    def test_no_metrics(self):
+        """test that metrics are off by default"""
+        (status, headers, body) = request('GET', '/admin/metrics')
+        assert status == 404
+        assert 'server-timing' not in headers
+        return
+
+    def test_restart(self):
+        """test that SIGHUP replaces the workers without dropping requests"""
+        self.run_clients(4)
+        self.server[0].send_signal(signal.SIGHUP)
+        self.run_clients(4)
+        return
+
+    def test_shutdown(self):
+        """test that SIGTERM stops the master and the workers"""
+        self.run_clients(2)
+        self.server[0].terminate()
+        for i in xrange(20):
+            if self.server[0].poll() is not None:
+                break
+            time.sleep(0.5)
+        assert self.server[0].returncode == 0
+        try:
+            request('GET', '/')
+        except IOError:
+            pass
+        else:
+            assert False
+        return
+
+class OneRequestApp:
+
+    """WSGI application for testing handle_request()"""
+
+    def __init__(self):
+        self.started = False
+        return
+
+    def start(self):
+        self.started = True
+        return
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK', [('Content-Length', '2')])
+        return ['ok']
+
+class TestOneRequest:
+
+    """test serving one request with threads and workers"""
+
+    def check(self, **kwargs):
+        app = OneRequestApp()
+        server = dpf.server.make_server('localhost', port, app, **kwargs)
+        t = threading.Thread(target=server.handle_request)
+        t.start()
+        try:
+            (status, headers, body) = request('GET', '/')
+        finally:
+            t.join()
+            if isinstance(server, dpf.server.PoolWSGIServer):
+                server.server_close()
+        assert app.started
+        assert (status, body) == (200, 'ok')
+        return
+
+    def test_threads(self):
+        self.check(threads=2)
+        return
+
+    def test_workers(self):
+        self.check(workers=2, threads=2)
+        return
+
+# eof